@@ -39,11 +39,15 @@ That location includes the version currently activated.
 import os
 import os.path
 
-from ardana_packager.config import DIR_FORMAT
 from ardana_packager.error import InstallerError
+import ardana_packager.scan as scan
+import ardana_packager.util as util
 from ardana_packager.version import from_service_dir
 
 
+_SWITCH_SUFFIX = '.switching'
+
+
 def active_version(base_location, spec):
     """Is there a package installed at the specified location?
 
@@ -93,6 +97,39 @@ def activate(base_location, spec):
 
     try:
         os.symlink(target, location)
+        scan.invalidate(base_location)
+    except OSError:
+        raise InstallerError(
+            "Cannot symlink {location} to {target}"
+            .format(location=location, target=target))
+
+
+def switch(base_location, spec):
+    """Point the service at an installed version, atomically
+
+        The new symlink is made under a temporary name and renamed
+        over whatever is there, so there is no moment at which the
+        service has no version. The caller is expected to have
+        checked (with active_version) that any existing entry is a
+        symlink to a version.
+        Raise an error if the pre-installed version does not exist.
+    """
+
+    location = os.path.join(base_location, spec.service)
+    spec = ensure_suffix(base_location, spec)
+    target = spec.service + "-" + spec.suffix
+    if not os.path.isdir(location + "-" + spec.suffix):
+        raise InstallerError(
+            "No pre-expanded version {version} for {location} found"
+            .format(location=location, version=str(spec.version)))
+
+    temp = util.hidden_path(location, _SWITCH_SUFFIX)
+    try:
+        if os.path.lexists(temp):
+            os.unlink(temp)
+        os.symlink(target, temp)
+        os.rename(temp, location)
+        scan.invalidate(base_location)
     except OSError:
         raise InstallerError(
             "Cannot symlink {location} to {target}"
@@ -107,17 +144,9 @@ def ensure_suffix(base_location, spec):
         pass
 
     # Locate the appropriate suffix associated with this verison.
-    for file_name in os.listdir(base_location):
-        match = DIR_FORMAT.match(file_name)
-        if not match:
-            continue
-        #if not file_name.startswith(spec.service + "-"):
-        if spec.service != match.group(1):
-            continue
-        dir = os.path.join(base_location, file_name)
-        if spec.version != from_service_dir(dir):
-            continue
-        spec.suffix = match.group(2)
+    suffix = scan.snapshot(base_location).suffix(spec.service, spec.version)
+    if suffix is not None:
+        spec.suffix = suffix
         return spec
 
     raise InstallerError(
@@ -149,6 +178,7 @@ def deactivate(base_location, spec):
     if os.path.islink(location):
         try:
             os.unlink(location)
+            scan.invalidate(base_location)
         except IOError as e:
             raise InstallerError("Can't unlink {location}"
                                  .format(location=location), e)
@@ -20,20 +20,83 @@ The cache handler.
 This downloads packages.
 """
 
+import hashlib
+import json
+import multiprocessing.pool
 import os
 import os.path
 import requests
+import requests.adapters
+import time
+import yaml
 
-from ardana_packager.config import PACKAGE_FILE, VERSION_LATEST  # noqa
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+from ardana_packager.config import (DELTA_FORMAT, PACKAGE_FILE,  # noqa
+                                    PACKAGE_JSON_FILE, TAR_FORMAT,
+                                    VERSION_LATEST)
 from ardana_packager.error import InstallerError
-from ardana_packager.version import from_str, best_guess  # noqa
 import ardana_packager.indexer as indexer
+import ardana_packager.util as util
+
+
+# Next to each cached index file, we keep the HTTP validators
+# (ETag, Last-Modified) that came with it.
+_VALIDATORS_SUFFIX = '.validators'
+
+# Downloads in progress live next to their target, with this suffix.
+PARTIAL_SUFFIX = '.part'
+
+# A partial download untouched for this long (in seconds) has been
+# abandoned; a younger one may still be being written by another run.
+_PARTIAL_AGE = 60 * 60
+
+# Concurrent downloads when prefetching; also the number of
+# connections to the repo we keep open for reuse.
+_PREFETCH_JOBS = 8
+
+# One HTTP session per distinct repo configuration, so that
+# every fetch in this process shares its connection pool.
+_SESSIONS = {}
 
 
 def cache_file(config, spec):
     return os.path.join(config.CACHE_DIR, spec.tarball)
 
 
+def session(config, jobs=_PREFETCH_JOBS):
+    """Return the shared HTTP session for talking to the repo
+
+    It is configured from the [repo] section of the config file:
+    an optional proxy, and the number of times to retry (with
+    backoff) connection failures and server errors. It keeps up
+    to `jobs` connections open, one for each concurrent fetch.
+    """
+    key = (config.repo_proxy, config.repo_retries, jobs)
+    try:
+        return _SESSIONS[key]
+    except KeyError:
+        pass
+
+    s = requests.Session()
+    retry = Retry(total=config.repo_retries,
+                  backoff_factor=0.5,
+                  status_forcelist=(500, 502, 503, 504))
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry,
+                                            pool_maxsize=jobs)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    if config.repo_proxy is not None:
+        s.proxies = {'http': config.repo_proxy,
+                     'https': config.repo_proxy}
+
+    _SESSIONS[key] = s
+    return s
+
+
 def create_cache(config):
     if not os.path.isdir(config.CACHE_DIR):
         os.mkdir(config.CACHE_DIR, 0o755)
@@ -43,16 +106,27 @@ def update(config):
     # Get the new config.
     create_cache(config)
 
-    # Where are we getting the index from?
+    # Where are we getting the index from? Prefer the JSON copy,
+    # but older repos only publish the YAML one.
     url = config.repo_url
-    # TODO(jan): configure the proxy
-    r = requests.get(url + PACKAGE_FILE)
-    assert r.status_code == 200
+    for index_file in (PACKAGE_JSON_FILE, PACKAGE_FILE):
+        r = _fetch_index(config, url + index_file, index_file)
+        if r.status_code != 404:
+            break
+
+    if r.status_code == 304:
+        # Our cached copy is current
+        return _remove_stale_index(config, index_file)
+
+    if r.status_code != 200:
+        raise InstallerError(
+            "Could not fetch {url}: HTTP status {status}"
+            .format(url=url + index_file, status=r.status_code))
     after = r.text
 
-    target = os.path.join(config.CACHE_DIR, PACKAGE_FILE)
+    target = os.path.join(config.CACHE_DIR, index_file)
 
-    changed = False
+    changed = _remove_stale_index(config, index_file)
     before = ""
     try:
         with open(target, 'r') as f:
@@ -64,59 +138,360 @@ def update(config):
         # Write out the new index
         with open(target, 'w') as f:
             f.write(after)
-        return True
+        changed = True
+
+    # Only once the index is safely written do we record what
+    # version of it we have.
+    _save_validators(config, index_file, r)
+    return changed
 
+
+def _validators_file(config, index_file):
+    return os.path.join(config.CACHE_DIR, index_file + _VALIDATORS_SUFFIX)
+
+
+def _fetch_index(config, url, index_file):
+    """GET an index file, unless our cached copy is still current
+
+    If we have a cached copy, send the ETag and Last-Modified the
+    server gave us for it; the server may then answer 304.
+    """
+    headers = {}
+    if os.path.isfile(os.path.join(config.CACHE_DIR, index_file)):
+        try:
+            with open(_validators_file(config, index_file)) as f:
+                validators = json.load(f)
+        except (IOError, ValueError):
+            validators = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    return session(config).get(url, headers=headers,
+                               timeout=config.repo_timeout)
+
+
+def _save_validators(config, index_file, r):
+    """Remember the ETag and Last-Modified of a freshly fetched index"""
+    validators = {
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+    }
+    target = _validators_file(config, index_file)
+    if not any(validators.values()):
+        if os.path.exists(target):
+            os.unlink(target)
+        return
+    with open(target, 'w') as f:
+        json.dump(validators, f)
+
+
+def _remove_stale_index(config, index_file):
+    """Drop any cached copy of the index in the format we didn't fetch
+
+    Returns True if there was one.
+    """
+    for other in (PACKAGE_JSON_FILE, PACKAGE_FILE):
+        if other == index_file:
+            continue
+        try:
+            os.unlink(os.path.join(config.CACHE_DIR, other))
+        except OSError:
+            continue
+        if os.path.exists(_validators_file(config, other)):
+            os.unlink(_validators_file(config, other))
+        return True
     return False
 
 
-def _download(url, target):
-    # TODO(jan): configure the proxy
-    r = requests.get(url, stream=True)
-    with open(target, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                f.write(chunk)
+def _download(config, url, target, sha256=None, jobs=_PREFETCH_JOBS):
+    """Fetch url into target
+
+    The data goes into a partial file first; if an earlier attempt
+    left one behind, we ask the server for just the missing bytes.
+    Only once the whole file is present, and matches the sha256
+    (if we know it), is it renamed into place.
+
+    Returns the number of bytes transferred.
+    """
+    partial = target + PARTIAL_SUFFIX
+    try:
+        offset = os.path.getsize(partial)
+    except OSError:
+        offset = 0
+
+    transferred = 0
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes={offset}-'.format(offset=offset)
+    r = session(config, jobs).get(url, stream=True, headers=headers,
+                                  timeout=config.repo_timeout)
+    try:
+        h = hashlib.sha256()
+        if r.status_code == 206 and offset:
+            content_range = r.headers.get('Content-Range', '')
+            if not content_range.startswith(
+                    'bytes {offset}-'.format(offset=offset)):
+                # Not what we asked for; start again from scratch.
+                r.close()
+                os.unlink(partial)
+                return _download(config, url, target, sha256, jobs)
+            with open(partial, 'rb') as f:
+                util.hash_file(f, h)
+            mode = 'ab'
+        elif r.status_code == 416 and offset:
+            # Either we already have every byte there is, or the
+            # partial file is longer than the file on the server.
+            content_range = r.headers.get('Content-Range', '')
+            if content_range != 'bytes */{offset}'.format(offset=offset):
+                r.close()
+                os.unlink(partial)
+                return _download(config, url, target, sha256, jobs)
+            with open(partial, 'rb') as f:
+                util.hash_file(f, h)
+            mode = None
+        elif r.status_code == 200:
+            mode = 'wb'
+        else:
+            raise InstallerError(
+                "Could not fetch {url}: HTTP status {status}"
+                .format(url=url, status=r.status_code))
+
+        if mode is not None:
+            with open(partial, mode) as f:
+                for chunk in r.iter_content(chunk_size=util.CHUNK):
+                    if chunk:
+                        f.write(chunk)
+                        h.update(chunk)
+                        transferred += len(chunk)
                 f.flush()
-    r.close()
+                os.fsync(f.fileno())
+    finally:
+        r.close()
+
+    if sha256 is not None and h.hexdigest() != sha256:
+        os.unlink(partial)
+        raise InstallerError(
+            "{url} failed verification: sha256 is {actual}, expected {sha256}"
+            .format(url=url, actual=h.hexdigest(), sha256=sha256))
+
+    os.rename(partial, target)
+    return transferred
+
 
+def resolve(config, spec, index=None):
+    """Fill in spec's version, tarball and suffix from the index
 
-def assert_package_present(config, spec):
-    index = indexer.load_index(config.CACHE_DIR)
+    Nothing is downloaded. Returns the index entry for the resolved
+    version.
+    """
+    if index is None:
+        index = indexer.PackageIndex.load(config.CACHE_DIR)
 
-    if 'packages' not in index:
+    if not isinstance(index.packages, dict):
         raise InstallerError(
             "Badly formed index file in {cache_dir}"
             .format(cache_dir=config.CACHE_DIR))
-    packages = index['packages']
 
-    if spec.package not in packages:
+    if spec.package not in index:
         raise InstallerError(
             "{package} not listed in index in {cache_dir}"
             .format(package=spec.package, cache_dir=config.CACHE_DIR))
-    available = index['packages'][spec.package]
 
     if spec.version is VERSION_LATEST:
-        try:
-            v = max(available.keys(), key=from_str)
-            spec.version = from_str(best_guess(v))
-        except KeyError:
+        latest = index.latest(spec.package)
+        if latest is None:
             raise InstallerError(
                 "no versions of {package} are not available"
                 .format(package=spec.package))
+        spec.version = latest
 
-    if str(spec.version) not in available:
+    entry = index.entry(spec.package, spec.version)
+    if entry is None:
         raise InstallerError(
             "{version} of {package} is not available"
             .format(package=spec.package, version=str(spec.version)))
 
-    spec.tarball = available[str(spec.version)]['file']
-    spec.suffix = available[str(spec.version)]['suffix']
+    spec.tarball = entry['file']
+    spec.suffix = entry['suffix']
+    return entry
+
 
-    source = config.repo_url + spec.tarball
-    target = os.path.join(config.CACHE_DIR, spec.tarball)
+def fetch(config, file, sha256=None):
+    """Make sure file, from the repo, is in the cache
 
+    Returns its path in the cache.
+    """
+    target = os.path.join(config.CACHE_DIR, file)
     if not os.path.isfile(target):
-        # If the file's there, assume we've nothing to do
-        _download(source, target)
+        # If the file's there, assume we've nothing to do: downloads
+        # only land there once they're complete.
+        _download(config, config.repo_url + file, target, sha256)
+    return target
+
 
+def assert_package_present(config, spec, index=None):
+    entry = resolve(config, spec, index)
+    fetch(config, spec.tarball, entry.get('sha256'))
     return spec
+
+
+def prefetch(config, specs, jobs=_PREFETCH_JOBS):
+    """Make sure the tarballs for all of specs are in the cache
+
+    Missing tarballs are downloaded concurrently, by up to `jobs`
+    threads. Each spec is resolved as for assert_package_present.
+    Nothing is fetched for a version that is already exploded. Where
+    explode would build a version from a delta package, because the
+    base version is exploded, the delta package is fetched instead of
+    the tarball; if that fails, the tarball is fetched after all.
+
+    Returns a list of dicts, one per file downloaded, giving the
+    file, the bytes transferred and the seconds taken.
+    """
+    index = indexer.PackageIndex.load(config.CACHE_DIR)
+
+    missing = {}
+    for spec in specs:
+        entry = resolve(config, spec, index)
+        if os.path.isdir(os.path.join(config.VENV_LOCATION,
+                                      spec.package + "-" + spec.suffix)):
+            continue
+        if os.path.isfile(cache_file(config, spec)):
+            continue
+        full = (spec.tarball, entry.get('sha256'), None)
+        delta = _usable_delta(config, spec, entry)
+        if delta is None:
+            missing[spec.tarball] = full
+        elif not os.path.isfile(os.path.join(config.CACHE_DIR,
+                                             delta['file'])):
+            missing[delta['file']] = (delta['file'], delta['sha256'], full)
+    if not missing:
+        return []
+
+    def _fetch_one(item):
+        (file, sha256, fallback) = item
+        start = time.time()
+        try:
+            transferred = _download(config, config.repo_url + file,
+                                    os.path.join(config.CACHE_DIR, file),
+                                    sha256, jobs)
+        except Exception as e:
+            if fallback is not None:
+                return _fetch_one(fallback)
+            return {'file': file, 'error': str(e)}
+        return {'file': file,
+                'bytes': transferred,
+                'seconds': round(time.time() - start, 3)}
+
+    pool = multiprocessing.pool.ThreadPool(min(jobs, len(missing)))
+    try:
+        report = pool.map(_fetch_one, sorted(missing.values()))
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = [r for r in report if 'error' in r]
+    if failed:
+        raise InstallerError(
+            "Could not prefetch {files}: {errors}"
+            .format(files=", ".join(r['file'] for r in failed),
+                    errors="; ".join(r['error'] for r in failed)))
+    return report
+
+
+def _usable_delta(config, spec, entry):
+    """The delta package that explode would build spec from, if any
+
+    That's the first one listed whose base version is exploded.
+    """
+    for delta in entry.get('deltas', []):
+        base_dir = os.path.join(config.VENV_LOCATION,
+                                spec.package + "-" + delta['base_suffix'])
+        if os.path.isdir(base_dir):
+            return delta
+    return None
+
+
+def clean(config, keep=None, budget=None):
+    """Evict tarballs from the cache
+
+    We never remove the tarball for a version that is expanded under
+    VENV_LOCATION (which covers every version that is active or
+    referred to by a service), nor the `keep` newest versions of each
+    package in the index (nor their delta packages). The remaining
+    tarballs and delta packages, and any abandoned partial downloads
+    (those not written to for _PARTIAL_AGE), are removed least
+    recently used first until what's left of them fits in `budget`
+    bytes. If the index can't be read, we can't tell which versions
+    are newest, so only abandoned partial downloads are removed.
+
+    Returns the list of files removed.
+    """
+    if keep is None:
+        keep = config.cache_keep
+    if budget is None:
+        budget = config.cache_budget
+    if not os.path.isdir(config.CACHE_DIR):
+        return []
+
+    protected = set()
+    try:
+        index = indexer.PackageIndex.load(config.CACHE_DIR)
+    except (IOError, ValueError, yaml.YAMLError):
+        index = None
+    else:
+        for package in index.packages or {}:
+            newest = index.versions(package)[-keep:] if keep else []
+            for v in newest:
+                entry = index.entry(package, v)
+                protected.add(entry['file'])
+                protected.update(d['file'] for d in entry.get('deltas', []))
+
+    try:
+        expanded = set(os.listdir(config.VENV_LOCATION))
+    except OSError:
+        expanded = set()
+
+    cutoff = time.time() - _PARTIAL_AGE
+    candidates = []
+    for file in os.listdir(config.CACHE_DIR):
+        if file.endswith(PARTIAL_SUFFIX):
+            tarball = file[:-len(PARTIAL_SUFFIX)]
+        else:
+            tarball = file
+        match = TAR_FORMAT.match(tarball) or DELTA_FORMAT.match(tarball)
+        if not match:
+            continue
+        if file == tarball:
+            if index is None or file in protected:
+                continue
+            if match.group(1) + "-" + match.group(2) in expanded:
+                continue
+        try:
+            st = os.stat(os.path.join(config.CACHE_DIR, file))
+        except OSError:
+            continue
+        if file != tarball and st.st_mtime >= cutoff:
+            # Perhaps still downloading
+            continue
+        candidates.append((max(st.st_atime, st.st_mtime), st.st_size, file))
+
+    # Most recently used first; evict once we're over budget
+    candidates.sort(reverse=True)
+    removed = []
+    used = 0
+    for (_, size, file) in candidates:
+        used += size
+        if used <= budget:
+            continue
+        try:
+            os.unlink(os.path.join(config.CACHE_DIR, file))
+        except OSError as e:
+            raise InstallerError(
+                "Could not remove {file} from {cache_dir}"
+                .format(file=file, cache_dir=config.CACHE_DIR), e)
+        removed.append(file)
+
+    return removed
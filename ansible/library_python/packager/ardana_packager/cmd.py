@@ -25,6 +25,9 @@ import ardana_packager.cache as cache
 import ardana_packager.config as config
 from ardana_packager.error import InstallerError
 import ardana_packager.expand as expand
+import ardana_packager.indexer as indexer
+import ardana_packager.prune as prune
+import ardana_packager.query as query
 import ardana_packager.service as service
 from ardana_packager.version import Spec
 
@@ -40,8 +43,11 @@ def main():
                   'version': config.VERSION_LATEST,
                   'suffix': None,
                   'cache': None,
+                  'packages': None,
                   'clean': False,
                   'activate': None,
+                  'keep': None,
+                  'aside': False,
                   }
         params.update(json.load(f))
         # We make an "empty" module as the ansible module doesn't
@@ -49,7 +55,7 @@ def main():
         module = ansible.AnsibleModule(argument_spec={}, args=[])
 
     state = params['state']
-    assert state in ('present', 'absent', None)
+    assert state in ('present', 'absent', 'query', 'prune', None)
     name = params['name']
     group_name = params['group']
     extra_mode_bits = int(params['extra_mode_bits'], 8)
@@ -57,7 +63,8 @@ def main():
     version = params['version']
     suffix = params['suffix']
     cache_op = params['cache']
-    assert cache_op in ('update', None)
+    assert cache_op in ('update', 'prefetch', None)
+    packages = params['packages']
     clean = params['clean']
     activate = params['activate']
     assert activate in ('act_on', 'act_off', None)
@@ -65,10 +72,7 @@ def main():
     # Backward-compatible argument munging: sometimes "version"
     # really means "suffix".
     if isinstance(version, dict):
-        assert version['v'] == 1
-        if suffix is None:
-            suffix = version['suffix']
-        version = version['version']
+        (version, suffix) = _split_version(version, suffix)
 
     elif activate == 'act_on' and state is None:
         if suffix is None and isinstance(version, six.string_types):
@@ -85,9 +89,35 @@ def main():
     conf = config.Config(group_name=group_name,
                          extra_mode_bits=extra_mode_bits)
 
+    if state == "query":
+        module.exit_json(changed=False, **query.report(conf))
+        return
+
+    if state == "prune":
+        try:
+            keep = params['keep']
+            pruned = prune.prune(conf,
+                                 keep=None if keep is None else int(keep),
+                                 aside=params['aside'])
+        except InstallerError as e:
+            module.fail_json(msg="Prune failed",
+                             exception=str(e))
+            return
+        module.exit_json(state=state, pruned=pruned,
+                         changed=bool(pruned['services'] or
+                                      pruned['venvs']))
+        return
+
+    if packages is not None and state is not None:
+        # Bulk mode: the whole list is handled in this one process
+        bulk(module, conf, state, package_specs(packages),
+             cache_op=cache_op, clean=clean, activate=activate)
+        return
+
     # For the moment ...
     # TODO(jan) break this out into a class that can control it all.
     changed = False
+    prefetched = None
 
     if cache_op == "update":
         try:
@@ -102,6 +132,16 @@ def main():
                              exception=str(e))
             return
 
+    elif cache_op == "prefetch":
+        try:
+            prefetched = cache.prefetch(conf, package_specs(packages))
+            changed = bool(prefetched)
+        except InstallerError as e:
+            module.fail_json(msg="Prefetch failed",
+                             packages=packages,
+                             exception=str(e))
+            return
+
     elif state == "present":
         try:
             (changed_ret, spec) = install(spec, conf)
@@ -127,9 +167,16 @@ def main():
                              exception=str(e))
             return
 
+    cleaned = None
     if clean:
-        # TODO(jang)
-        pass
+        try:
+            cleaned = cache.clean(conf)
+            changed = changed or bool(cleaned)
+        except InstallerError as e:
+            module.fail_json(msg="Cache clean failed",
+                             cache_dir=conf.CACHE_DIR,
+                             exception=str(e))
+            return
 
     # activate defaults to act_on but if we are removing package then
     # we can't activate it
@@ -164,17 +211,142 @@ def main():
                      # with package_version or suffix
                      version=_version,
                      cache=cache_op, clean=clean,
+                     prefetched=prefetched, cleaned=cleaned,
                      changed=changed)
 
 
+def bulk(module, conf, state, specs, cache_op=None, clean=False,
+         activate='act_on'):
+    """Install or uninstall each of specs
+
+    This is what a run of main() does for a single package, but the
+    cache is updated at most once, and the index loaded only once,
+    for the whole list. We stop at the first failure.
+    """
+    changed = False
+    results = []
+
+    def fail(msg, spec, e):
+        module.fail_json(msg=msg,
+                         name=getattr(spec, 'package', None),
+                         service=getattr(spec, 'service', None),
+                         packages=results,
+                         exception=str(e))
+
+    if cache_op == "update":
+        try:
+            changed = cache.update(conf) or changed
+        except Exception as e:
+            fail("Installation failed", None, e)
+            return
+
+    prefetched = None
+    if cache_op == "prefetch" and state == "present":
+        # Download whatever tarballs are missing concurrently, rather
+        # than one at a time as each is installed.
+        try:
+            prefetched = cache.prefetch(conf, specs)
+        except InstallerError as e:
+            fail("Prefetch failed", None, e)
+            return
+
+    index = None
+    if state == "present":
+        try:
+            index = indexer.PackageIndex.load(conf.CACHE_DIR)
+        except Exception as e:
+            fail("Installation failed", None, e)
+            return
+
+    for spec in specs:
+        if state == "present":
+            try:
+                (changed_ret, spec) = install(spec, conf, index)
+            except InstallerError as e:
+                fail("Installation failed", spec, e)
+                return
+            if activate == "act_on" and \
+               getattr(spec, 'service', None) is not None:
+                try:
+                    (activated, spec) = activate_install(spec, conf)
+                    changed_ret = changed_ret or activated
+                except InstallerError as e:
+                    fail("Activation failed", spec, e)
+                    return
+        else:
+            try:
+                (changed_ret, spec) = uninstall(spec, conf)
+            except InstallerError as e:
+                fail("Installation failed", spec, e)
+                return
+
+        changed = changed or changed_ret
+        results.append({'name': spec.package,
+                        'service': getattr(spec, 'service', None),
+                        'package_version': _report_version(spec.version),
+                        'suffix': getattr(spec, 'suffix', None),
+                        'changed': changed_ret})
+
+    cleaned = None
+    if clean:
+        try:
+            cleaned = cache.clean(conf)
+            changed = changed or bool(cleaned)
+        except InstallerError as e:
+            module.fail_json(msg="Cache clean failed",
+                             cache_dir=conf.CACHE_DIR,
+                             exception=str(e))
+            return
+
+    module.exit_json(state=state, packages=results,
+                     cache=cache_op, clean=clean,
+                     prefetched=prefetched, cleaned=cleaned,
+                     changed=changed)
+
+
+def package_specs(packages):
+    """Turn a list of packages into Specs
+
+    Each item is either a package name, or a dict with a 'name'
+    and optionally a 'version', a 'suffix' and a 'service'. As for
+    a single package, the 'version' may be a dict giving both the
+    version and the suffix.
+    """
+    specs = []
+    for package in packages or []:
+        if isinstance(package, six.string_types):
+            package = {'name': package}
+        (version, suffix) = _split_version(
+            package.get('version', config.VERSION_LATEST),
+            package.get('suffix'))
+        specs.append(Spec(package=package['name'],
+                          service=package.get('service'),
+                          version=version, suffix=suffix))
+    return specs
+
+
+def _split_version(version, suffix):
+    """Unpack a version given as {'v': 1, 'version': ..., 'suffix': ...}
+
+    An explicit suffix takes precedence over the one in the dict.
+    Anything else is returned unchanged.
+    """
+    if isinstance(version, dict):
+        assert version['v'] == 1
+        if suffix is None:
+            suffix = version['suffix']
+        version = version['version']
+    return (version, suffix)
+
+
 def _report_version(version):
     if version is cache.VERSION_LATEST:
         return None
     return str(version)
 
 
-def install(spec, conf):
-    (changed, spec) = expand.explode(conf, spec)
+def install(spec, conf, index=None):
+    (changed, spec) = expand.explode(conf, spec, index)
     changed = service.refer(conf, spec) or changed
     current_version = activate.active_version(conf.SERVICE_LOCATION, spec)
     changed = service.refer(conf, spec) or changed
@@ -201,12 +373,10 @@ def activate_install(spec, conf):
     current_version = activate.active_version(conf.SERVICE_LOCATION, spec)
     if current_version == spec.version:
         return (False, spec)
-    if current_version is not None:
-        activate.deactivate(conf.SERVICE_LOCATION,
-                            Spec(package=spec.package, service=spec.service,
-                                 version=current_version))
-        # Leaving removal of service venv until separate cleanup phase
-        # service.remove(conf, spec, current_version)
-    activate.activate(conf.SERVICE_LOCATION, spec)
+    # Swap the symlink over in one step, so the service is never
+    # without a version. Leaving removal of the old service venv
+    # until separate cleanup phase (state: prune) so that we can
+    # roll back.
+    activate.switch(conf.SERVICE_LOCATION, spec)
     # TODO(howleyt): should we differentiate between new vs. old version?
     return (True, spec)
@@ -18,7 +18,7 @@
 The configuration handler.
 """
 
-import collections
+import os.path
 import re
 
 try:
@@ -27,11 +27,24 @@ try:
 except ImportError:
     import configparser
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 CONFIG = '/etc/packager.conf'
 _CACHE_DIR = '/var/cache/ardana_packager'
 _VENV_LOCATION = '/opt/stack/venv'
 _SERVICE_LOCATION = '/opt/stack/service'
+_POOL_DIR = '.pool'
+_CACHE_KEEP = 2
+_CACHE_BUDGET = 4 * 1024 * 1024 * 1024
+_PRUNE_KEEP = 2
+_REPO_RETRIES = 3
+_REPO_TIMEOUT = 60.0
 PACKAGE_FILE = 'packages'
+PACKAGE_JSON_FILE = PACKAGE_FILE + '.json'
+STAT_CACHE_FILE = '.packages.stat'
 
 # Let's fix this format up.
 _format = r'''^  ( \w+ (?: -\w+ )* )
@@ -47,12 +60,13 @@ _format = r'''^  ( \w+ (?: -\w+ )* )
                  )'''.replace(' ', '').replace('\n', '')
 
 TAR_FORMAT = re.compile(_format + '\\.tgz$')
+DELTA_FORMAT = re.compile(_format + '\\.delta\\.tgz$')
 DIR_FORMAT = re.compile(_format + '$')
 
 VERSION_LATEST = object()
 
 
-class Config(collections.MutableMapping):
+class Config(MutableMapping):
     def __init__(self, file=CONFIG, *args, **kwargs):
         self._config = configparser.SafeConfigParser()
         self._config.read(file)
@@ -69,6 +83,30 @@ class Config(collections.MutableMapping):
             return url
         return url + '/'
 
+    @property
+    def repo_proxy(self):
+        """Return the proxy to reach the repo through, or None"""
+        try:
+            return self._config.get("repo", "proxy")
+        except Exception:
+            return None
+
+    @property
+    def repo_retries(self):
+        """How many times to retry a failed request to the repo"""
+        try:
+            return self._config.getint("repo", "retries")
+        except Exception:
+            return _REPO_RETRIES
+
+    @property
+    def repo_timeout(self):
+        """Seconds to wait for the repo to connect or send data"""
+        try:
+            return self._config.getfloat("repo", "timeout")
+        except Exception:
+            return _REPO_TIMEOUT
+
     @property
     def VENV_LOCATION(self):
         try:
@@ -90,6 +128,51 @@ class Config(collections.MutableMapping):
         except Exception:
             return _CACHE_DIR
 
+    @property
+    def dedup(self):
+        """Whether to explode venvs into a shared, hard linked pool"""
+        try:
+            return self._config.getboolean("install", "dedup")
+        except Exception:
+            return False
+
+    @property
+    def POOL_LOCATION(self):
+        try:
+            return self._config.get("install", "pool")
+        except Exception:
+            return os.path.join(self.VENV_LOCATION, _POOL_DIR)
+
+    @property
+    def cache_keep(self):
+        """How many of the newest versions of each package to keep cached"""
+        try:
+            return self._config.getint("install", "cache_keep")
+        except Exception:
+            return _CACHE_KEEP
+
+    @property
+    def cache_budget(self):
+        """Bytes of other cached tarballs to keep, least recently used first
+
+        Set it to 0 to keep nothing beyond what cache_keep protects.
+        """
+        try:
+            return self._config.getint("install", "cache_budget")
+        except Exception:
+            return _CACHE_BUDGET
+
+    @property
+    def prune_keep(self):
+        """How many of the newest versions of each service to keep
+
+        The active version is always kept, and counts towards this.
+        """
+        try:
+            return self._config.getint("install", "prune_keep")
+        except Exception:
+            return _PRUNE_KEEP
+
     # Implementing the following gives us the whole MutableMapping interface
 
     def __getitem__(self, *args, **kwargs):
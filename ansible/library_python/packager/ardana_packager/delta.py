@@ -0,0 +1,197 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Delta packages: just the changes between two versions of a venv.
+
+A delta package is a tarball named
+
+  package-suffix.delta.tgz
+
+alongside the full package-suffix.tgz. It holds every member that was
+added or changed since a base version of the same package, and a
+META-INF/delta.yml describing the rest:
+
+  file_format: 1
+  base: 4.0.0:20180101T000000Z      # the Version it applies to
+  base_suffix: 20180101T000000Z     # the suffix of that version
+  removed:                          # paths no longer present
+    - ./lib/python2.7/site-packages/old_module.py
+
+The indexer lists delta packages under the version they produce. A
+node that already has the base version exploded builds the new one by
+hard linking a copy of the base directory and applying the delta.
+"""
+
+import argparse
+import io
+import os
+import os.path
+import shutil
+import stat
+import tarfile
+import yaml
+
+from ardana_packager.config import TAR_FORMAT
+from ardana_packager.error import InstallerError
+import ardana_packager.extract as extract
+import ardana_packager.util as util
+import ardana_packager.version as version
+
+
+DELTA_MEMBER = os.path.join('META-INF', 'delta.yml')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Create an ardana_packager delta package')
+    parser.add_argument('base', help='tarball of the base version')
+    parser.add_argument('new', help='tarball of the new version')
+    parser.add_argument('--dir', type=str, default=None,
+                        help='directory to write the delta to'
+                             ' (default: alongside the new tarball)')
+
+    args = parser.parse_args()
+    dir = args.dir or os.path.dirname(args.new)
+    create(args.base, args.new, os.path.join(dir, delta_name(args.new)))
+
+
+def delta_name(tarball):
+    """The name of the delta package that produces tarball"""
+    name = os.path.basename(tarball)
+    return name[:-len('.tgz')] + '.delta.tgz'
+
+
+def create(base_tarball, new_tarball, delta_tarball):
+    """Write a delta package that turns base_tarball into new_tarball"""
+    match = TAR_FORMAT.match(os.path.basename(base_tarball))
+    if not match:
+        raise InstallerError(
+            "{tarball} doesn't have a viable suffix"
+            .format(tarball=base_tarball))
+
+    base = _manifest(base_tarball)
+    new = _manifest(new_tarball)
+    metadata = {
+        'file_format': 1,
+        'base': str(version.from_tarball(base_tarball)),
+        'base_suffix': match.group(2),
+        'removed': sorted(name for name in base if name not in new),
+    }
+    changed = set(name for name in new if base.get(name) != new[name])
+    # A hard link shares its target's contents, so it has to be carried
+    # (and re-linked on the new inode) whenever that changes.
+    changed.update(name for (name, signature) in new.items()
+                   if signature[0] == 'link' and
+                   util.member_name(signature[1]) in changed)
+    # Always carry the new version.yml, so the delta can be indexed
+    changed.add(os.path.join('.', 'META-INF', 'version.yml'))
+
+    with tarfile.open(delta_tarball, 'w:gz') as out:
+        # META-INF/delta.yml goes first, so it can be found cheaply
+        data = yaml.safe_dump(metadata, default_flow_style=False)
+        data = data.encode('utf-8')
+        info = tarfile.TarInfo(os.path.join('.', DELTA_MEMBER))
+        info.size = len(data)
+        info.mode = 0o644
+        out.addfile(info, io.BytesIO(data))
+
+        with tarfile.open(new_tarball, 'r|*') as tar:
+            for member in tar:
+                if util.member_name(member.name) not in changed:
+                    continue
+                if member.isreg():
+                    out.addfile(member, tar.extractfile(member))
+                else:
+                    out.addfile(member)
+
+
+def apply(delta_tarball, base_dir, target_dir, **kwargs):
+    """Build target_dir from base_dir and a delta package
+
+    target_dir must exist and be empty. Unchanged files are hard
+    links to those in base_dir; the rest come from the delta. Any
+    further keyword arguments are passed on to extract.extract.
+    """
+    metadata = read_metadata(delta_tarball)
+    if metadata is None:
+        raise InstallerError(
+            "{tarball} is not a delta package"
+            .format(tarball=delta_tarball))
+
+    util.clone(base_dir, target_dir, kwargs.get('extra_mode_bits', 0))
+
+    for name in metadata.get('removed', []):
+        path = os.path.normpath(os.path.join(target_dir, name))
+        if not path.startswith(target_dir + os.sep):
+            raise InstallerError(
+                "{tarball}: cannot remove {name}"
+                .format(tarball=delta_tarball, name=name))
+        _remove(path)
+
+    extract.extract(delta_tarball, target_dir, replace=True, **kwargs)
+
+    # The delta's own metadata is no part of the venv
+    _remove(os.path.join(target_dir, DELTA_MEMBER))
+
+
+def read_metadata(delta_tarball):
+    """Return the contents of a delta package's META-INF/delta.yml
+
+    Returns None if there isn't one.
+    """
+    with tarfile.open(delta_tarball, 'r|*') as tar:
+        for member in tar:
+            if os.path.normpath(member.name) != DELTA_MEMBER:
+                continue
+            if not member.isfile():
+                return None
+            return yaml.safe_load(tar.extractfile(member))
+    return None
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _manifest(tarball):
+    """Map each member of a tarball onto what it holds
+
+    Ownership is ignored, since it's rewritten on installation.
+    """
+    manifest = {}
+    with tarfile.open(tarball, 'r|*') as tar:
+        for member in tar:
+            mode = stat.S_IMODE(member.mode)
+            if member.isreg():
+                h = util.hash_file(tar.extractfile(member))
+                signature = ('file', mode, h.hexdigest())
+            elif member.issym():
+                signature = ('symlink', member.linkname)
+            elif member.islnk():
+                signature = ('link', member.linkname)
+            elif member.isdir():
+                signature = ('dir', mode)
+            else:
+                signature = ('other', member.type, mode)
+            manifest[util.member_name(member.name)] = signature
+    return manifest
+
+
+if __name__ == '__main__':
+    main()
@@ -39,52 +39,76 @@ We are targeting the destination directories,
 
 with the contents of an exploded tarfile, whose contents are expanded
 *relative to that directory*.
+
+If dedup is turned on in the config, the files themselves are
+hard links into a content-addressed pool; see ardana_packager.pool.
+
+If the index lists a delta package from a version that is already
+exploded here, we build the new version from that instead of
+downloading the full tarball; see ardana_packager.delta.
 """
 
 import grp
+import logging
 import os
 import os.path
 import shutil
 import tarfile
+import time
 
 from ardana_packager.activate import active_version
 import ardana_packager.cache as cache
+import ardana_packager.delta
 from ardana_packager.error import InstallerError
+import ardana_packager.extract as extract
+import ardana_packager.pool as pool
+import ardana_packager.util as util
+
+
+LOG = logging.getLogger(__name__)
+
+_STAGING_SUFFIX = '.staging'
+
+# No explode takes this long, so a staging directory this old is
+# left over from one that was interrupted
+_STAGING_AGE = 60 * 60
+
+# The venv locations we've cleared of old staging directories
+_swept = set()
 
 
 def package_dir(config, spec):
     return os.path.join(config.VENV_LOCATION, spec.package + "-" + spec.suffix)
 
 
-def explode(config, spec):
+def explode(config, spec, index=None):
     """Take the package installed in cache_dir and expand it.
 
     This will be a no-op if there's already something
     at the target.
 
-    We require the source package to be present in
-    the cache_dir, with the name
+    The package is exploded into a staging directory alongside
+    the target, and renamed into place once it is complete; so
+    a package directory is never seen half-populated. A staging
+    directory left over from an earlier failure is cleared away, as
+    are any abandoned by interrupted runs, the first time round.
+
+    The source package is fetched into the cache_dir if it
+    isn't already there, with the name
     $(basename $location)-suffix.tgz
 
+    A caller handling many packages may pass in the PackageIndex,
+    to save it being loaded each time.
+
     Returns (True, spec) if it modified the filesystem.
     """
 
-    spec = cache.assert_package_present(config, spec)
-    cache_file = cache.cache_file(config, spec)
+    entry = cache.resolve(config, spec, index)
     target_dir = package_dir(config, spec)
 
-    if not os.path.isfile(cache_file):
-        raise InstallerError(
-            "{cache_file} not found"
-            .format(cache_file=cache_file))
-
-    if not tarfile.is_tarfile(cache_file):
-        raise InstallerError(
-            "{cache_file} is not in the correct format"
-            .format(cache_file=cache_file))
-
     if os.path.isdir(target_dir):
-        # We assume there's nothing to do
+        # Packages are only ever renamed into place once completely
+        # exploded, so there's nothing to do
         return (False, spec)
 
     if os.path.exists(target_dir):
@@ -92,42 +116,59 @@ def explode(config, spec):
             "{target_dir} already exists"
             .format(target_dir=target_dir))
 
-    try:
-        os.mkdir(target_dir, 0o755)
-
-        gname = config['group_name']
-        group = grp.getgrnam(gname)
-        gid = group.gr_gid
-
-        with tarfile.open(cache_file) as tar:
-            members = tar.getmembers()
-            for m in members:
-                m.uid = 0
-                m.gid = gid
-                m.uname = 'root'
-                m.gname = gname
-                m.mode |= config['extra_mode_bits']
-            def is_within_directory(directory, target):
-
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-
-                return prefix == abs_directory
-
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-
-                tar.extractall(path, members, numeric_owner=numeric_owner)
+    gname = config['group_name']
+    owner = {
+        'uid': 0,
+        'gid': grp.getgrnam(gname).gr_gid,
+        'uname': 'root',
+        'gname': gname,
+        'extra_mode_bits': config['extra_mode_bits'],
+        'pool_dir': None,
+    }
+    if config.dedup:
+        owner['pool_dir'] = config.POOL_LOCATION
+        pool.create(owner['pool_dir'])
+
+    _sweep(config.VENV_LOCATION)
+    staging_dir = _staging_dir(target_dir)
+
+    # A delta against a version we already have exploded is much
+    # less to fetch; if anything goes wrong with it, we fall back
+    # to the full tarball.
+    for delta in entry.get('deltas', []):
+        base_dir = os.path.join(config.VENV_LOCATION,
+                                spec.package + "-" + delta['base_suffix'])
+        if not os.path.isdir(base_dir):
+            LOG.info("Not using %s for %s: %s is not exploded here",
+                     delta['file'], target_dir, base_dir)
+            continue
+        try:
+            delta_file = cache.fetch(config, delta['file'], delta['sha256'])
+            _explode_into(staging_dir, target_dir, config,
+                          ardana_packager.delta.apply,
+                          delta_file, base_dir, **owner)
+        except Exception as e:
+            LOG.warning("Not using %s for %s: %s",
+                        delta['file'], target_dir, e)
+            continue
+        return (True, spec)
+
+    cache.fetch(config, spec.tarball, entry.get('sha256'))
+    cache_file = cache.cache_file(config, spec)
 
+    if not os.path.isfile(cache_file):
+        raise InstallerError(
+            "{cache_file} not found"
+            .format(cache_file=cache_file))
 
-            safe_extract(tar, path=target_dir, members=members)
+    if not tarfile.is_tarfile(cache_file):
+        raise InstallerError(
+            "{cache_file} is not in the correct format"
+            .format(cache_file=cache_file))
 
+    try:
+        _explode_into(staging_dir, target_dir, config,
+                      extract.extract, cache_file, **owner)
     except Exception as e:
         raise InstallerError(
             "{cache_file} could not be exploded to {target_dir}"
@@ -136,6 +177,79 @@ def explode(config, spec):
     return (True, spec)
 
 
+def _explode_into(staging_dir, target_dir, config, populate, *args,
+                  **kwargs):
+    """Fill staging_dir with populate(*args, staging_dir, **kwargs)
+
+    then rename it into place as target_dir. The staging directory is
+    removed if anything fails.
+    """
+    try:
+        if os.path.lexists(staging_dir):
+            # Left behind by an explode that didn't finish
+            shutil.rmtree(staging_dir)
+        os.mkdir(staging_dir, 0o755)
+
+        populate(*(args + (staging_dir,)), **kwargs)
+
+        # Make sure the contents are on disk before they appear
+        # under their real name.
+        _sync(staging_dir)
+        os.rename(staging_dir, target_dir)
+        _fsync_dir(config.VENV_LOCATION)
+
+    except Exception:
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+
+def _staging_dir(target_dir):
+    """Where a package is exploded before being renamed into place"""
+    return util.hidden_path(target_dir, _STAGING_SUFFIX)
+
+
+def _sweep(location):
+    """Remove staging directories that interrupted explodes left"""
+    if location in _swept:
+        return
+    _swept.add(location)
+    cutoff = time.time() - _STAGING_AGE
+    for name in os.listdir(location):
+        if not (name.startswith('.') and name.endswith(_STAGING_SUFFIX)):
+            continue
+        path = os.path.join(location, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if st.st_mtime < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _sync(staging_dir):
+    """Flush the files and directories under staging_dir to disk"""
+    for (dirpath, dirnames, filenames) in os.walk(staging_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                continue
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        _fsync_dir(dirpath)
+
+
+def _fsync_dir(dir):
+    fd = os.open(dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def remove(config, spec):
     """Remove an exploded version
 
@@ -163,8 +277,13 @@ def remove(config, spec):
         raise InstallerError(msg)
 
     try:
+        pooled = None
+        if config.dedup:
+            pooled = pool.used(config.POOL_LOCATION, [target])
         # Delete recursively
         shutil.rmtree(target)
+        if pooled is not None:
+            pool.prune(config.POOL_LOCATION, pooled)
     except Exception as e:
         raise InstallerError(
             "Could not delete {target}"
@@ -0,0 +1,206 @@
+#
+# (c) Copyright 2017-2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Single-pass tarball extraction.
+
+The tarball is read as a stream: each member is checked, has its
+ownership and mode adjusted, and is written out as it is reached,
+without first reading the whole member list.
+
+Where pigz is installed, gzip decompression is handed to it, so
+that it runs on another core alongside the extraction.
+"""
+
+import copy
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tarfile
+
+from ardana_packager.error import InstallerError
+import ardana_packager.pool as pool
+import ardana_packager.util as util
+
+
+_PIGZ_PATHS = ('/usr/bin/pigz', '/bin/pigz')
+
+_EXTRACT_ARGS = {}
+if sys.version_info >= (3, 5):
+    # We've done our own ownership mapping and path checks.
+    _EXTRACT_ARGS['numeric_owner'] = True
+if hasattr(tarfile, 'fully_trusted_filter'):
+    _EXTRACT_ARGS['filter'] = 'fully_trusted'
+
+
+def extract(tarball, target_dir, uid=None, gid=None,
+            uname=None, gname=None, extra_mode_bits=0, pool_dir=None,
+            replace=False):
+    """Extract tarball into the existing directory target_dir
+
+    If uid and gid are given, every member is owned by them (and
+    uname/gname); extra_mode_bits are or'ed into every member's mode.
+
+    Members that would land outside target_dir - by an absolute or
+    '..' path, a hard link out of it, or a path (or hard link) through
+    a symlink from earlier in the archive - are refused with an
+    InstallerError.
+
+    If pool_dir is given, regular files are stored in that
+    content-addressed pool and hard linked into target_dir.
+
+    If replace is set, target_dir may already be populated: whatever
+    is in the way of a member is removed before it is extracted, so
+    that a file sharing an inode with another tree is replaced rather
+    than overwritten in place.
+    """
+    target_dir = os.path.abspath(target_dir)
+    directories = []
+    symlinks = set()
+
+    with _open(tarball) as tar:
+        for member in tar:
+            name = _check_path(target_dir, member.name, tarball)
+            if _through_symlink(name, symlinks):
+                raise InstallerError(
+                    "{tarball}: {name} is beneath a symlink"
+                    .format(tarball=tarball, name=member.name))
+            if member.islnk():
+                link = _check_path(target_dir, member.linkname, tarball)
+                # Linking to a symlink links to what it points at
+                if link in symlinks or _through_symlink(link, symlinks):
+                    raise InstallerError(
+                        "{tarball}: {name} links through a symlink"
+                        .format(tarball=tarball, name=member.name))
+            elif member.issym():
+                symlinks.add(name)
+
+            if uid is not None:
+                member.uid = uid
+                member.gid = gid
+                member.uname = uname
+                member.gname = gname
+            member.mode |= extra_mode_bits
+
+            if replace:
+                _clear(os.path.join(target_dir, name), member)
+
+            if member.isdir():
+                # Keep directories writable until we're done with them
+                directories.append(member)
+                member = copy.copy(member)
+                member.mode = 0o700
+            elif member.isreg() and pool_dir is not None:
+                _extract_pooled(tar, member, target_dir, name, pool_dir)
+                continue
+            tar.extract(member, target_dir, **_EXTRACT_ARGS)
+
+    # Innermost directories first, as tarfile's extractall does
+    directories.sort(key=lambda m: m.name, reverse=True)
+    for member in directories:
+        path = os.path.join(target_dir, member.name)
+        if uid is not None and os.geteuid() == 0:
+            os.chown(path, member.uid, member.gid)
+        os.utime(path, (member.mtime, member.mtime))
+        os.chmod(path, member.mode & 0o7777)
+
+
+def _extract_pooled(tar, member, target_dir, name, pool_dir):
+    path = pool.add(pool_dir, tar.extractfile(member), member.mode & 0o7777,
+                    uid=member.uid, gid=member.gid, mtime=member.mtime)
+    target = os.path.join(target_dir, name)
+    parent = os.path.dirname(target)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    pool.link(path, target)
+
+
+def _clear(path, member):
+    """Remove whatever at path would stop member being written afresh"""
+    if not os.path.lexists(path):
+        return
+    if os.path.isdir(path) and not os.path.islink(path):
+        if not member.isdir():
+            shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def _check_path(target_dir, name, tarball):
+    """Return name, normalised, if it lies within target_dir"""
+    path = os.path.normpath(os.path.join(target_dir, name))
+    if path != target_dir and not path.startswith(target_dir + os.sep):
+        raise InstallerError(
+            "{tarball}: {name} is outside the target directory"
+            .format(tarball=tarball, name=name))
+    return os.path.relpath(path, target_dir)
+
+
+def _through_symlink(name, symlinks):
+    """Does any parent directory of name come from a symlink member?"""
+    if not symlinks:
+        return False
+    parent = os.path.dirname(name)
+    while parent:
+        if parent in symlinks:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+
+class _open(object):
+    """Open a tarball as a stream, decompressing with pigz if we can"""
+
+    def __init__(self, tarball):
+        self.tarball = tarball
+        self.proc = None
+        self.tar = None
+
+    def __enter__(self):
+        pigz = pigz_path()
+        if pigz is not None and self.tarball.endswith(('.tgz', '.gz')):
+            self.proc = subprocess.Popen([pigz, '-dc', self.tarball],
+                                         stdout=subprocess.PIPE)
+            self.tar = tarfile.open(fileobj=self.proc.stdout, mode='r|')
+        else:
+            self.tar = tarfile.open(self.tarball, 'r|*')
+        return self.tar
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tar.close()
+        if self.proc is None:
+            return False
+        if exc_type is not None:
+            self.proc.kill()
+        else:
+            # Let pigz finish writing any padding after the archive
+            while self.proc.stdout.read(util.CHUNK):
+                pass
+        self.proc.stdout.close()
+        if self.proc.wait() != 0 and exc_type is None:
+            raise InstallerError(
+                "pigz could not decompress {tarball}"
+                .format(tarball=self.tarball))
+        return False
+
+
+def pigz_path():
+    """The path to pigz, or None if it isn't installed"""
+    for path in _PIGZ_PATHS:
+        if os.access(path, os.X_OK):
+            return path
+    return None
@@ -28,89 +28,225 @@ The naming scheme is simple and explicit:
 
 package-version.tgz
 
+Delta packages, package-version.delta.tgz, hold just the
+changes from some earlier version (see ardana_packager.delta).
+They are listed under the version they produce, as 'deltas';
+a delta whose full tarball isn't present is left out.
+
 The package file is a textual index of those packages.
+The same index is also written as JSON, which is much
+quicker to parse; readers prefer that when it's present.
 
 TODO: Add the option to do package signing.
 """
 
 import argparse
+import bisect
 import collections
+import contextlib
+import json
 import multiprocessing
 import os
 import os.path
+import six
+import stat
 import yaml
 
-from ardana_packager.config import PACKAGE_FILE, TAR_FORMAT  # noqa
+from ardana_packager.config import (DELTA_FORMAT, PACKAGE_FILE,  # noqa
+                                    PACKAGE_JSON_FILE, STAT_CACHE_FILE,
+                                    TAR_FORMAT)
+import ardana_packager.delta
 from ardana_packager.error import InstallerError
+import ardana_packager.util as util
 import ardana_packager.version
 
 
+INDEX_FORMAT = 3
+
+# Below this many new tarballs, it's cheaper not to fork workers
+_INLINE_THRESHOLD = 4
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Create an ardana_packager index')
     parser.add_argument('--dir', type=str, default='.',
                         help='directory to process')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='maximum number of tarballs to examine in'
+                             ' parallel (default: number of CPUs)')
 
     args = parser.parse_args()
-    create_index(args.dir)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    create_index(args.dir, jobs=args.jobs)
 
 
-def create_index(dir):
+def create_index(dir, jobs=None, pool=None):
     """Create an index file from the contents of a directory
 
     Write it out, but also return it, in case it's useful.
-    """
-    packages = {}
 
-    existing_index_files = []
+    A stat cache is kept alongside the index. Tarballs whose
+    size, mtime and inode are unchanged since the last run are
+    not reopened; only new or rewritten files are examined.
+    The sha256 of each tarball is recorded in the index, so that
+    clients can verify what they download.
+
+    At most `jobs` worker processes are used to examine them
+    (by default, one per CPU); a handful of files is done inline.
+    Library callers indexing repeatedly may pass in their own
+    multiprocessing `pool`, which is used as-is and left open.
+    """
+    existing_index_files = {}
     try:
         existing_index = load_index(dir)
     except IOError:
         pass
     else:
-        packages.update(existing_index["packages"])
-
-        for package in existing_index["packages"].itervalues():
-            for package_version in package.itervalues():
-                existing_index_files.append(package_version["file"])
-
-    files = os.listdir(dir)
-    # Remove from `packages` the venvs for each service that is not
-    # there anymore
-    files_to_remove = set(existing_index_files) - set(files)
-    _packages = collections.defaultdict(dict)
-    _packages.update({
-        k: { _k: _v for _k, _v in v.iteritems()
-             if _v['file'] not in files_to_remove }
-        for k, v in packages.iteritems()
-    })
-    packages = _packages
-
-    # New files that potentially can be new venvs that we need to add
-    # to the index file
-    files_to_add = set(files) - set(existing_index_files)
-    files = [os.path.join(dir, file) for file in files_to_add]
-
-    pool = multiprocessing.Pool(multiprocessing.cpu_count() * 4)
-    file_to_version = pool.map(get_version, files)
-
-    for file, version, package, suffix in file_to_version:
-        if version is None:
+        for package, versions in six.iteritems(existing_index["packages"]):
+            for version, package_version in six.iteritems(versions):
+                existing_index_files[package_version["file"]] = {
+                    'version': version,
+                    'package': package,
+                    'suffix': package_version["suffix"],
+                    'sha256': package_version.get("sha256"),
+                }
+
+    old_stat_cache = load_stat_cache(dir)
+    stat_cache = {}
+
+    # Files that are new, or that have changed since we last looked
+    # at them, need their version extracting again.
+    files_to_scan = {}
+    for file in os.listdir(dir):
+        if not (TAR_FORMAT.match(file) or DELTA_FORMAT.match(file)):
             continue
-        packages[package][str(version)] = {
-            'file': file,
+        try:
+            st = os.stat(os.path.join(dir, file))
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+
+        key = _stat_key(st)
+        cached = old_stat_cache.get(file)
+        if cached is not None:
+            # Entries from before we recorded checksums are redone
+            if cached['stat'] == key and 'sha256' in cached:
+                stat_cache[file] = cached
+                continue
+        elif existing_index_files.get(file, {}).get('sha256'):
+            # Indexed before we kept a stat cache: trust the index.
+            stat_cache[file] = dict(existing_index_files[file], stat=key)
+            continue
+        files_to_scan[os.path.join(dir, file)] = key
+
+    paths = list(files_to_scan)
+    file_to_version = _map_versions(paths, jobs, pool)
+
+    for (path, (file, version, package, suffix, sha256, base)) in zip(
+            paths, file_to_version):
+        # Remember failures too, so that we don't retry them every run
+        entry = {
+            'version': None if version is None else str(version),
+            'package': package,
             'suffix': suffix,
+            'sha256': sha256,
+            'stat': files_to_scan[path],
+        }
+        if base is not None:
+            entry.update(base)
+        stat_cache[os.path.basename(path)] = entry
+
+    packages = collections.defaultdict(dict)
+    deltas = []
+    for file, entry in six.iteritems(stat_cache):
+        if entry['version'] is None:
+            continue
+        if 'base' in entry:
+            deltas.append((file, entry))
+            continue
+        packages[entry['package']][entry['version']] = {
+            'file': file,
+            'suffix': entry['suffix'],
+            'sha256': entry['sha256'],
             # Might put more metadata in here later
         }
 
+    for file, entry in sorted(deltas):
+        target = packages.get(entry['package'], {}).get(entry['version'])
+        if target is None:
+            continue
+        target.setdefault('deltas', []).append({
+            'file': file,
+            'base': entry['base'],
+            'base_suffix': entry['base_suffix'],
+            'sha256': entry['sha256'],
+        })
+
+    # Precompute each package's versions in order, so that clients
+    # needn't parse and sort them to find the latest.
+    versions = {}
+    for package, available in six.iteritems(packages):
+        versions[package] = [
+            str(v) for v in sorted(ardana_packager.version.from_str(v)
+                                   for v in available)]
+
     index = {
-        'index_format': 2,
-        'packages': dict(packages)
+        'index_format': INDEX_FORMAT,
+        'packages': dict(packages),
+        'versions': versions,
+        'latest': dict((package, vs[-1])
+                       for package, vs in six.iteritems(versions)),
     }
     write_index(index, dir)
+    write_stat_cache(stat_cache, dir)
     return index
 
 
+def _pool_size(count, jobs=None):
+    """How many worker processes to use for `count` tarballs.
+
+    Returns 0 if it's not worth forking at all.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if count < _INLINE_THRESHOLD or jobs <= 1:
+        return 0
+    return min(jobs, count)
+
+
+@contextlib.contextmanager
+def _worker_pool(size):
+    """A process pool that is always cleaned up on exit"""
+    pool = multiprocessing.Pool(size)
+    try:
+        yield pool
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _map_versions(paths, jobs=None, pool=None):
+    """Examine each of paths, in parallel if that's worthwhile"""
+    size = _pool_size(len(paths), jobs)
+    if size == 0:
+        return [_examine(path) for path in paths]
+    if pool is not None:
+        return pool.map(_examine, paths)
+    with _worker_pool(size) as pool:
+        return pool.map(_examine, paths)
+
+
+def _stat_key(st):
+    """The parts of a stat result that tell us a file has been rewritten"""
+    return [st.st_size, util.mtime_ns(st), st.st_ino]
+
+
 def get_version(tarfile):
     """Map a tarball filename onto a tuple:
 
@@ -130,23 +266,164 @@ def get_version(tarfile):
         return None, None, None, None
 
 
-def write_index(index, dir, file=PACKAGE_FILE):
-    """Write an index out to a file."""
+def _examine(tarfile):
+    """get_version, with the tarball's sha256 appended to the tuple
+
+    Then, for a delta package, a dict of its base and base_suffix;
+    otherwise None.
+    """
+    if DELTA_FORMAT.match(os.path.basename(tarfile)):
+        return _examine_delta(tarfile)
+    result = get_version(tarfile)
+    if result[1] is None:
+        return result + (None, None)
+    return result + (util.checksum(tarfile), None)
+
+
+def _examine_delta(tarfile):
+    failed = (None, None, None, None, None, None)
+    match = DELTA_FORMAT.match(os.path.basename(tarfile))
+    try:
+        metadata = ardana_packager.delta.read_metadata(tarfile)
+        if not metadata or 'base' not in metadata:
+            return failed
+        version = ardana_packager.version.from_tarball(tarfile)
+    except InstallerError:
+        return failed
+    return (os.path.basename(tarfile), version,
+            match.group(1), match.group(2), util.checksum(tarfile),
+            {'base': str(metadata['base']),
+             'base_suffix': str(metadata['base_suffix'])})
+
+
+def write_index(index, dir, file=PACKAGE_FILE, json_file=PACKAGE_JSON_FILE):
+    """Write an index out to a file.
+
+    The JSON copy is written too, unless json_file is None.
+    """
     target = os.path.join(dir, file)
     with open(target, 'w') as f:
-        yaml.dump(index, f)
+        # Entries from the stat cache or JSON index hold unicode on
+        # python 2; keep !!python/unicode tags out of the file.
+        yaml.safe_dump(index, f)
+    if json_file is not None:
+        target = os.path.join(dir, json_file)
+        with open(target, 'w') as f:
+            json.dump(index, f, separators=(',', ':'), sort_keys=True)
 
 
-def load_index(dir, file=PACKAGE_FILE):
+def load_index(dir, file=PACKAGE_FILE, json_file=PACKAGE_JSON_FILE):
     """Load an index from a file
 
-    TODO: This really wants wrapping up in a class,
-    but for the moment there are more pressing things to do.
+    The JSON copy is preferred, if there is one and it's no older
+    than the YAML; otherwise we fall back to the YAML.
+
+    This returns the raw index; see PackageIndex for a wrapper
+    that answers questions about it.
     """
     target = os.path.join(dir, file)
+    if json_file is not None:
+        json_target = os.path.join(dir, json_file)
+        try:
+            json_mtime = os.stat(json_target).st_mtime
+        except OSError:
+            pass
+        else:
+            try:
+                stale = os.stat(target).st_mtime > json_mtime
+            except OSError:
+                stale = False
+            if not stale:
+                with open(json_target) as f:
+                    return json.load(f)
+
     with open(target) as f:
         return yaml.load(f)
 
 
+class PackageIndex(object):
+    """An index, loaded into memory, for answering version queries
+
+    Indexes written by this version of create_index carry each
+    package's versions ready-sorted, and its latest version; for
+    older ones we work them out (once per package) on demand.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.packages = index.get('packages')
+        self._latest = index.get('latest') or {}
+        self._sorted = index.get('versions') or {}
+        self._versions = {}
+
+    @classmethod
+    def load(cls, dir, file=PACKAGE_FILE, json_file=PACKAGE_JSON_FILE):
+        return cls(load_index(dir, file, json_file))
+
+    def __contains__(self, package):
+        return package in self.packages
+
+    def available(self, package):
+        """The index entries of a package, keyed by version string"""
+        return self.packages[package]
+
+    def versions(self, package):
+        """A package's Versions, oldest first"""
+        try:
+            return self._versions[package]
+        except KeyError:
+            pass
+        from_str = ardana_packager.version.from_str
+        if package in self._sorted:
+            versions = [from_str(v) for v in self._sorted[package]]
+        else:
+            versions = sorted(from_str(v) for v in self.packages[package])
+        self._versions[package] = versions
+        return versions
+
+    def latest(self, package):
+        """A package's newest Version, or None if it has none"""
+        if package in self._latest:
+            return ardana_packager.version.from_str(self._latest[package])
+        versions = self.versions(package)
+        return versions[-1] if versions else None
+
+    def range(self, package, lower=None, upper=None):
+        """A package's Versions v with lower <= v <= upper, oldest first
+
+        Either bound may be omitted.
+        """
+        versions = self.versions(package)
+        start = 0 if lower is None else bisect.bisect_left(versions, lower)
+        end = (len(versions) if upper is None
+               else bisect.bisect_right(versions, upper))
+        return versions[start:end]
+
+    def entry(self, package, version):
+        """The index entry for a package's version, or None"""
+        return self.packages.get(package, {}).get(str(version))
+
+
+def write_stat_cache(stat_cache, dir, file=STAT_CACHE_FILE):
+    """Write out the stat cache that accompanies an index."""
+    target = os.path.join(dir, file)
+    with open(target, 'w') as f:
+        json.dump(stat_cache, f)
+
+
+def load_stat_cache(dir, file=STAT_CACHE_FILE):
+    """Load the stat cache for an index.
+
+    A missing or unreadable cache is not an error; it just means
+    every tarball will be examined again.
+    """
+    target = os.path.join(dir, file)
+    try:
+        with open(target) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
 if __name__ == '__main__':
     main()
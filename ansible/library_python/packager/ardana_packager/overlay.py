@@ -0,0 +1,278 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Patch a venv tarball without unpacking it.
+
+The new content is installed into a scratch prefix laid out like a
+venv (bin/, lib/pythonX.Y/site-packages/, META-INF/). The patched
+tarball is then written in one pass over the original:
+
+  - members that the scratch prefix doesn't touch are copied across
+    byte-for-byte (optionally rewritten, for bin/ scripts);
+  - members it replaces with identical content are copied too;
+  - members it changes are taken from the scratch prefix;
+  - members superseded by an upgraded distribution - its old
+    .dist-info, and the files its RECORD lists that the new one
+    doesn't have - and bytecode for changed sources are dropped;
+  - anything new in the scratch prefix is appended, in sorted order.
+
+Reading the original's member list and metadata takes one more
+streaming pass, which never touches the disk. Only the members that
+the scratch prefix provides are ever checksummed, as they're reached
+in the write pass; bytecode that comes before its source in the
+original is held back until we know whether the source changed.
+"""
+
+import io
+import os
+import os.path
+import re
+import tarfile
+
+import ardana_packager.util as util
+
+
+_SITE_PACKAGES = re.compile(r'^\./lib/python(\d+\.\d+)/site-packages/')
+_DIST_INFO = re.compile(r'^(\./lib/python\d+\.\d+/site-packages/)'
+                        r'([^/-]+)-[^/]*\.dist-info$')
+_VERSION_MEMBER = './META-INF/version.yml'
+_ACTIVATE_MEMBER = './bin/activate'
+
+
+class Overlay(object):
+    """What we need to know about the venv tarball being patched"""
+
+    def __init__(self, src):
+        self.src = src
+        self.members = set()
+        self.symlinks = {}
+        self.records = {}
+        self.metadata = None
+        self.activate = None
+        self._installed_digests = {}
+        self.python_version = None
+
+        with tarfile.open(src, 'r|*') as tar:
+            for member in tar:
+                name = util.member_name(member.name)
+                self.members.add(name)
+                if member.issym():
+                    self.symlinks[name] = member.linkname
+                if self.python_version is None:
+                    match = _SITE_PACKAGES.match(name + '/')
+                    if match:
+                        self.python_version = match.group(1)
+                if not member.isreg():
+                    continue
+                if name == _VERSION_MEMBER:
+                    self.metadata = tar.extractfile(member).read()
+                elif name == _ACTIVATE_MEMBER:
+                    self.activate = tar.extractfile(member).read()
+                elif name.endswith('.dist-info/RECORD'):
+                    data = tar.extractfile(member).read()
+                    self.records[os.path.dirname(name)] = data.decode('utf-8')
+
+    def write(self, tarball, scratch, rewrite=None):
+        """Write the patched venv to the open tarfile tarball
+
+        rewrite(name), if given, is asked about each regular file
+        that is kept from the original. It returns None to leave the
+        file be, or a function from its old contents to its new.
+
+        Returns the names of the members changed, added and removed.
+        """
+        installed = self._installed(scratch)
+        removed = self._superseded(installed)
+        bytecode = self._bytecode(installed)
+        changed = set()
+        done = set()
+        # Installed sources whose bytecode in the original still holds
+        unchanged = set()
+        held = []
+
+        with tarfile.open(self.src, 'r|*') as tar:
+            for member in tar:
+                name = util.member_name(member.name)
+                if name in removed:
+                    continue
+                source = bytecode.get(name)
+                if source is not None and member.isreg():
+                    if source in done:
+                        if source in unchanged:
+                            _copy(tarball, tar, member, None)
+                        else:
+                            removed.add(name)
+                    else:
+                        held.append(
+                            (member, tar.extractfile(member).read()))
+                    continue
+                fix = None
+                if rewrite is not None and member.isreg():
+                    fix = rewrite(name)
+                path = installed.get(name)
+                if path is None:
+                    _copy(tarball, tar, member, fix)
+                    continue
+                done.add(name)
+                if os.path.isdir(path) and not os.path.islink(path) and \
+                   member.isdir():
+                    tarball.addfile(member)
+                elif _same_file(tarball, tar, member, path, fix,
+                                self._file_digest):
+                    unchanged.add(name)
+                else:
+                    tarball.add(path, name, recursive=False)
+                    changed.add(name)
+
+        for (member, data) in held:
+            name = util.member_name(member.name)
+            if bytecode[name] in unchanged:
+                tarball.addfile(member, io.BytesIO(data))
+            else:
+                removed.add(name)
+
+        added = sorted(set(installed) - done)
+        for name in added:
+            tarball.add(installed[name], name, recursive=False)
+
+        return {'changed': sorted(changed),
+                'added': added,
+                'removed': sorted(removed)}
+
+    def _installed(self, scratch):
+        """Map member names onto the paths in scratch that provide them"""
+        installed = {}
+        for (dirpath, dirnames, filenames) in os.walk(scratch):
+            for entry in dirnames + filenames:
+                path = os.path.join(dirpath, entry)
+                name = self._resolve(
+                    util.member_name(os.path.relpath(path, scratch)))
+                installed[name] = path
+        return installed
+
+    def _resolve(self, name):
+        """Follow the original's relative symlinks (eg, lib64 -> lib)"""
+        parts = name.split('/')
+        for i in range(2, len(parts) + 1):
+            prefix = '/'.join(parts[:i])
+            target = self.symlinks.get(prefix)
+            if target is None or os.path.isabs(target):
+                continue
+            resolved = util.member_name(
+                os.path.join(os.path.dirname(prefix), target))
+            return self._resolve('/'.join([resolved] + parts[i:]))
+        return name
+
+    def _superseded(self, installed):
+        """Members of the original that the new content makes obsolete"""
+        removed = set()
+
+        projects = {}
+        for name in installed:
+            match = _DIST_INFO.match(name)
+            if match:
+                projects[(match.group(1), _project(match.group(2)))] = name
+
+        for member in self.members:
+            match = _DIST_INFO.match(member)
+            if not match or member in installed:
+                continue
+            key = (match.group(1), _project(match.group(2)))
+            if key not in projects:
+                continue
+            # An older version of something we've reinstalled
+            removed.update(m for m in self.members
+                           if m == member or m.startswith(member + '/'))
+            for line in self.records.get(member, '').splitlines():
+                path = line.split(',')[0]
+                if path:
+                    removed.add(util.member_name(
+                        os.path.join(match.group(1), path)))
+
+        return set(m for m in removed
+                   if m in self.members and m not in installed)
+
+    def _bytecode(self, installed):
+        """Map the original's bytecode onto the installed sources for it
+
+        That bytecode is stale unless the source is unchanged.
+        """
+        bytecode = {}
+        for member in self.members:
+            if member in installed:
+                continue
+            (dirname, basename) = os.path.split(member)
+            if basename.endswith('.pyc') and \
+               os.path.basename(dirname) == '__pycache__':
+                source = os.path.join(os.path.dirname(dirname),
+                                      basename.split('.')[0] + '.py')
+            elif basename.endswith('.pyc'):
+                source = member[:-1]
+            else:
+                continue
+            path = installed.get(source)
+            if path is not None and os.path.isfile(path):
+                bytecode[member] = source
+        return bytecode
+
+    def _file_digest(self, path):
+        try:
+            return self._installed_digests[path]
+        except KeyError:
+            pass
+        digest = util.checksum(path)
+        self._installed_digests[path] = digest
+        return digest
+
+
+def _project(name):
+    return name.lower().replace('_', '-')
+
+
+def _copy(tarball, tar, member, fix):
+    """Copy member across from the original tarball"""
+    if not member.isreg():
+        tarball.addfile(member)
+        return
+    f = tar.extractfile(member)
+    if fix is None:
+        tarball.addfile(member, f)
+        return
+    data = fix(f.read())
+    member.size = len(data)
+    tarball.addfile(member, io.BytesIO(data))
+
+
+def _same_file(tarball, tar, member, path, fix, file_digest):
+    """Copy member across, if path would give it the same content
+
+    file_digest gives the sha256 of a file. Returns whether member
+    was copied.
+    """
+    if not member.isreg() or os.path.islink(path) or \
+       not os.path.isfile(path):
+        return False
+    if fix is None and member.size != os.path.getsize(path):
+        return False
+
+    data = tar.extractfile(member).read()
+    if fix is not None:
+        data = fix(data)
+    if util.hash_file(io.BytesIO(data)).hexdigest() != file_digest(path):
+        return False
+    member.size = len(data)
+    tarball.addfile(member, io.BytesIO(data))
+    return True
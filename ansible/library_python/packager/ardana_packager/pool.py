@@ -0,0 +1,203 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+A content-addressed pool of files, for deduplicating exploded venvs.
+
+Scheme: there's a pool directory, by default
+  /opt/stack/venv/.pool
+
+Each distinct file is stored there once, named for the sha256 of its
+contents plus the mode and ownership it should have (since hard links
+share those):
+
+  /opt/stack/venv/.pool/3f/3f0c...9a-100755-0-0
+
+Venv directories hold hard links to the pool. A pool file whose link
+count has dropped back to one is no longer used by any venv.
+
+Since the links share an inode, a venv file must never be modified in
+place once it has been exploded into a pooled venv.
+"""
+
+import os
+import os.path
+import stat
+import tempfile
+import time
+
+from ardana_packager.error import InstallerError
+import ardana_packager.util as util
+
+
+_TMP_PREFIX = '.tmp-'
+
+# An add() can't take this long, so its temporary file is abandoned
+_TMP_AGE = 60 * 60
+
+
+def add(pool_dir, f, mode, uid=None, gid=None, mtime=None):
+    """Store the contents of file object f in the pool
+
+    Returns the path of the pool file, which has the given mode,
+    ownership (if we are root) and mtime.
+    """
+    (fd, tmp) = tempfile.mkstemp(dir=pool_dir, prefix=_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            digest = util.hash_file(f, out=out).hexdigest()
+
+        name = "{digest}-{mode:o}-{uid}-{gid}".format(
+            digest=digest, mode=mode, uid=uid, gid=gid)
+        subdir = os.path.join(pool_dir, digest[:2])
+        path = os.path.join(subdir, name)
+        if os.path.exists(path):
+            os.unlink(tmp)
+            return path
+
+        if uid is not None and os.geteuid() == 0:
+            os.chown(tmp, uid, gid)
+        os.chmod(tmp, mode)
+        if mtime is not None:
+            os.utime(tmp, (mtime, mtime))
+        if not os.path.isdir(subdir):
+            try:
+                os.mkdir(subdir, 0o755)
+            except OSError:
+                # Someone else got there first
+                if not os.path.isdir(subdir):
+                    raise
+        os.rename(tmp, path)
+        return path
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def link(path, target):
+    """Hard link the pool file at path into place at target"""
+    if os.path.lexists(target):
+        os.unlink(target)
+    try:
+        os.link(path, target)
+    except OSError as e:
+        raise InstallerError(
+            "Cannot link {target} to {path}; the pool must be on the"
+            " same filesystem as the venvs"
+            .format(target=target, path=path), e)
+
+
+def create(pool_dir):
+    if not os.path.isdir(pool_dir):
+        os.makedirs(pool_dir, 0o755)
+
+
+def used(pool_dir, venv_dirs):
+    """The pool files that nothing but venv_dirs links to
+
+    These are what removing venv_dirs would leave unused. Only files
+    with no other links are looked up in the pool, by their sha256,
+    so the rest of the pool isn't touched.
+    """
+    links = {}
+    for venv_dir in venv_dirs:
+        for (dirpath, dirnames, filenames) in os.walk(venv_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode) or st.st_nlink == 1:
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if key in links:
+                    links[key][1] += 1
+                else:
+                    links[key] = [path, 1, st.st_nlink]
+
+    found = []
+    listings = {}
+    for ((dev, ino), (path, count, nlink)) in links.items():
+        if nlink != count + 1:
+            continue
+        digest = util.checksum(path)
+        subdir = os.path.join(pool_dir, digest[:2])
+        if subdir not in listings:
+            try:
+                listings[subdir] = os.listdir(subdir)
+            except OSError:
+                listings[subdir] = []
+        for name in listings[subdir]:
+            if not name.startswith(digest + "-"):
+                continue
+            candidate = os.path.join(subdir, name)
+            try:
+                st = os.lstat(candidate)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) == (dev, ino):
+                found.append(candidate)
+                break
+    return found
+
+
+def prune(pool_dir, paths=None):
+    """Remove pool files that no venv links to any more
+
+    If paths is given, only those pool files (see used()) are
+    considered; otherwise the whole pool is scanned. Temporary files
+    left in the pool by an add() that was interrupted are removed
+    too, once they are old enough not to be from one in progress.
+
+    Returns the number of files removed.
+    """
+    removed = 0
+    if not os.path.isdir(pool_dir):
+        return removed
+
+    if paths is None:
+        paths = []
+        for subdir in os.listdir(pool_dir):
+            subdir = os.path.join(pool_dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            paths.extend(os.path.join(subdir, name)
+                         for name in os.listdir(subdir))
+
+    for path in paths:
+        try:
+            if os.lstat(path).st_nlink == 1:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            continue
+
+    return removed + _sweep(pool_dir)
+
+
+def _sweep(pool_dir):
+    """Remove stale temporary files from the pool"""
+    removed = 0
+    cutoff = time.time() - _TMP_AGE
+    for name in os.listdir(pool_dir):
+        if not name.startswith(_TMP_PREFIX):
+            continue
+        path = os.path.join(pool_dir, name)
+        try:
+            if os.lstat(path).st_mtime < cutoff:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
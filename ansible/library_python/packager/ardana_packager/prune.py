@@ -0,0 +1,220 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Remove superseded versions of every service and package at once.
+
+Activating a new version leaves the old service directory (and its
+venv) in place, so that we can roll back. Pruning removes those that
+are no longer wanted:
+
+  - for each service, every versioned directory except the active
+    one and the newest `keep` versions (the active one counts);
+  - then every exploded venv that no remaining service directory
+    refers to, except the newest `keep` versions of each package.
+
+The directories are removed in parallel. With `aside`, they are
+instead renamed out of the way - to .<name>.trash, which no longer
+matches DIR_FORMAT - and a background process deletes them, so the
+call returns as soon as the renames are done. Trash left by earlier
+runs is removed too. Either way, pool files that only the removed
+venvs used are then removed from the pool.
+"""
+
+import multiprocessing.pool
+import os
+import os.path
+import shutil
+import subprocess
+
+from ardana_packager.config import DIR_FORMAT
+from ardana_packager.error import InstallerError
+import ardana_packager.pool as pool
+import ardana_packager.scan as scan
+import ardana_packager.util as util
+import ardana_packager.version as version
+
+
+_TRASH_SUFFIX = '.trash'
+
+_JOBS = 8
+
+
+def prune(conf, keep=None, aside=False, jobs=_JOBS):
+    """Remove superseded service directories and venvs
+
+    Returns a dict listing the 'services' and 'venvs' directories
+    removed (or set aside for removal).
+    """
+    if keep is None:
+        keep = conf.prune_keep
+
+    services = _prune_services(conf.SERVICE_LOCATION, keep)
+    referenced = _referenced(conf.SERVICE_LOCATION, services)
+    venvs = _prune_venvs(conf.VENV_LOCATION, keep, referenced)
+
+    doomed = ([os.path.join(conf.SERVICE_LOCATION, d) for d in services] +
+              [os.path.join(conf.VENV_LOCATION, d) for d in venvs])
+    trash = (_trash(conf.SERVICE_LOCATION) + _trash(conf.VENV_LOCATION))
+
+    # What the pool will no longer need, found while it's still linked
+    pooled = None
+    if conf.dedup:
+        pooled = pool.used(conf.POOL_LOCATION,
+                           [os.path.join(conf.VENV_LOCATION, d)
+                            for d in venvs] + _trash(conf.VENV_LOCATION))
+
+    if aside:
+        for path in doomed:
+            target = util.hidden_path(path, _TRASH_SUFFIX)
+            try:
+                os.rename(path, target)
+            except OSError as e:
+                raise InstallerError(
+                    "Could not move {path} aside".format(path=path), e)
+            trash.append(target)
+        _remove_in_background(trash, conf.POOL_LOCATION, pooled)
+    else:
+        _remove_all(doomed + trash, jobs)
+        if pooled:
+            pool.prune(conf.POOL_LOCATION, pooled)
+
+    scan.invalidate(conf.SERVICE_LOCATION)
+    return {'services': sorted(services), 'venvs': sorted(venvs)}
+
+
+def _prune_services(location, keep):
+    """The service directories to remove"""
+    if not os.path.isdir(location):
+        return []
+
+    snapshot = scan.snapshot(location)
+    doomed = []
+    for (service, suffixes) in snapshot.services.items():
+        active = snapshot.active(service)
+        versions = []
+        for (suffix, name) in suffixes.items():
+            if name in snapshot.links or suffix == active:
+                continue
+            try:
+                versions.append((snapshot.version(name), name))
+            except InstallerError:
+                # Leave alone anything we can't place in order
+                continue
+        versions.sort()
+        if active is not None:
+            keep_others = max(keep - 1, 0)
+        else:
+            keep_others = keep
+        if keep_others:
+            versions = versions[:-keep_others]
+        doomed.extend(name for (_, name) in versions)
+    return doomed
+
+
+def _referenced(location, removed):
+    """The venvs referred to by service directories we're keeping"""
+    if not os.path.isdir(location):
+        return set()
+    removed = set(removed)
+    snapshot = scan.snapshot(location)
+    return set(target for (target, names) in snapshot.refs.items()
+               if any(name not in removed for name in names))
+
+
+def _prune_venvs(location, keep, referenced):
+    """The venv directories to remove"""
+    if not os.path.isdir(location):
+        return []
+
+    packages = {}
+    for (name, path, is_dir, is_link) in scan.entries(location):
+        match = DIR_FORMAT.match(name)
+        if not match or not is_dir or is_link:
+            continue
+        try:
+            v = version.from_dir(path)
+        except InstallerError:
+            continue
+        packages.setdefault(match.group(1), []).append((v, name, path))
+
+    doomed = []
+    for versions in packages.values():
+        versions.sort()
+        if keep:
+            versions = versions[:-keep]
+        doomed.extend(name for (_, name, path) in versions
+                      if path not in referenced)
+    return doomed
+
+
+def _trash(location):
+    """Anything set aside by an earlier prune that's still there"""
+    if not os.path.isdir(location):
+        return []
+    return [os.path.join(location, name) for name in os.listdir(location)
+            if name.startswith('.') and name.endswith(_TRASH_SUFFIX)]
+
+
+def _remove_all(paths, jobs):
+    if not paths:
+        return
+
+    def remove(path):
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            return "{path}: {e}".format(path=path, e=e)
+        return None
+
+    workers = multiprocessing.pool.ThreadPool(min(jobs, len(paths)))
+    try:
+        errors = [e for e in workers.map(remove, paths) if e is not None]
+    finally:
+        workers.close()
+        workers.join()
+
+    if errors:
+        raise InstallerError(
+            "Could not remove {errors}".format(errors="; ".join(errors)))
+
+
+def _remove_in_background(paths, pool_dir=None, pooled=None):
+    """Remove paths, then pooled files, in a process that outlives us
+
+    The process is detached from our session and stdio, and we don't
+    wait for it.
+    """
+    if not paths:
+        return
+    pid = os.fork()
+    if pid:
+        # The intermediate child exits as soon as it has forked
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            return
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        subprocess.call(['rm', '-rf', '--'] + paths, close_fds=True)
+        if pooled:
+            pool.prune(pool_dir, pooled)
+    except Exception:
+        pass
+    finally:
+        os._exit(0)
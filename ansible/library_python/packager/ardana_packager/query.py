@@ -0,0 +1,174 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Report what is installed on this node.
+
+One pass over each of VENV_LOCATION, SERVICE_LOCATION and CACHE_DIR
+gives a single document:
+
+  packages:
+    nova:
+      20170101T000000Z:
+        version: 4.0.0:20170101T000000Z
+        referrers: [nova-api-20170101T000000Z, ...]
+  services:
+    nova-api:
+      active: 20170101T000000Z
+      active_version: 4.0.0:20170101T000000Z
+      versions:
+        20170101T000000Z:
+          version: 4.0.0:20170101T000000Z
+          venv: /opt/stack/venv/nova-20170101T000000Z
+  cache:
+    dir: /var/cache/ardana_packager
+    files: 12
+    bytes: 1234567
+    tarballs: [nova-20170101T000000Z.tgz, ...]
+    deltas: [...]
+    partial: [...]
+
+This is the `state: query` of install_package, and is also available
+from the command line as packager_query.
+"""
+
+import argparse
+import collections
+import json
+import os
+import os.path
+
+import ardana_packager.cache as cache
+import ardana_packager.config as config
+from ardana_packager.error import InstallerError
+import ardana_packager.scan as scan
+import ardana_packager.version as version
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report the packages installed on this node')
+    parser.add_argument('--config', type=str, default=config.CONFIG,
+                        help='packager configuration file')
+
+    args = parser.parse_args()
+    print(json.dumps(report(config.Config(args.config)),
+                     indent=2, sort_keys=True))
+
+
+def report(conf):
+    """Return the installed state of this node as a dict"""
+    services = _services(conf.SERVICE_LOCATION)
+    return {
+        'packages': _packages(conf.VENV_LOCATION, services),
+        'services': services,
+        'cache': _cache(conf.CACHE_DIR),
+    }
+
+
+def _version(get, path):
+    try:
+        return str(get(path))
+    except (InstallerError, IOError, OSError):
+        return None
+
+
+def _services(location):
+    if not os.path.isdir(location):
+        return {}
+
+    snapshot = scan.snapshot(location)
+    venvs = dict((name, target)
+                 for (target, names) in snapshot.refs.items()
+                 for name in names)
+    services = {}
+    for (service, suffixes) in snapshot.services.items():
+        versions = {}
+        for (suffix, name) in suffixes.items():
+            if name in snapshot.links:
+                # That's an active version pointer, not a version
+                continue
+            versions[suffix] = {
+                'version': _version(snapshot.version, name),
+                'venv': venvs.get(name),
+            }
+        if not versions:
+            continue
+        active = snapshot.active(service)
+        services[service] = {
+            'active': active,
+            'active_version': versions.get(active, {}).get('version'),
+            'versions': versions,
+        }
+    return services
+
+
+def _packages(location, services):
+    if not os.path.isdir(location):
+        return {}
+
+    referrers = collections.defaultdict(list)
+    for (service, info) in services.items():
+        for (suffix, v) in info['versions'].items():
+            if v['venv'] is not None:
+                referrers[v['venv']].append(service + "-" + suffix)
+
+    packages = collections.defaultdict(dict)
+    for (name, path, is_dir, is_link) in scan.entries(location):
+        match = config.DIR_FORMAT.match(name)
+        if not match or not is_dir or is_link:
+            continue
+        packages[match.group(1)][match.group(2)] = {
+            'version': _version(version.from_dir, path),
+            'referrers': sorted(referrers.get(path, [])),
+        }
+    return dict(packages)
+
+
+def _cache(location):
+    result = {
+        'dir': location,
+        'files': 0,
+        'bytes': 0,
+        'tarballs': [],
+        'deltas': [],
+        'partial': [],
+    }
+    if not os.path.isdir(location):
+        return result
+
+    for (name, path, is_dir, is_link) in scan.entries(location):
+        if is_dir:
+            continue
+        try:
+            size = os.lstat(path).st_size
+        except OSError:
+            continue
+        result['files'] += 1
+        result['bytes'] += size
+        if config.TAR_FORMAT.match(name):
+            result['tarballs'].append(name)
+        elif config.DELTA_FORMAT.match(name):
+            result['deltas'].append(name)
+        elif name.endswith(cache.PARTIAL_SUFFIX):
+            result['partial'].append(name)
+
+    for key in ('tarballs', 'deltas', 'partial'):
+        result[key].sort()
+    return result
+
+
+if __name__ == '__main__':
+    main()
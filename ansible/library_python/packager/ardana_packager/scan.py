@@ -0,0 +1,149 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+Scan-once snapshots of a service (or venv) directory.
+
+Looking up the suffix of a service version, or which service
+directories refer to a venv, means walking every entry of the
+directory. A Snapshot does that walk once and remembers the answers:
+
+  services: service -> {suffix -> entry name}
+  refs:     venv target -> [entry names whose venv links to it]
+  links:    entry name -> symlink target, for the entries that are
+            symlinks (such as the active version pointers)
+
+Versions are read from each versioned directory's version.yml only
+when they're first asked for, and then remembered.
+
+Snapshots are kept per process, and thrown away as soon as the
+directory's mtime (or link count) changes. Code that changes the
+directory itself also calls invalidate(), since mtimes are coarse.
+"""
+
+import collections
+import os
+import os.path
+
+from ardana_packager.config import DIR_FORMAT
+import ardana_packager.util as util
+from ardana_packager.version import from_service_dir
+
+
+_VENV_DIR = "venv"
+
+_SNAPSHOTS = {}
+
+
+def snapshot(location):
+    """Return an up-to-date Snapshot of the directory at location"""
+    location = os.path.abspath(location)
+    key = _dir_key(os.stat(location))
+    cached = _SNAPSHOTS.get(location)
+    if cached is not None and cached.key == key:
+        return cached
+    cached = Snapshot(location, key)
+    _SNAPSHOTS[location] = cached
+    return cached
+
+
+def invalidate(location=None):
+    """Forget the snapshot of location, or of everything"""
+    if location is None:
+        _SNAPSHOTS.clear()
+    else:
+        _SNAPSHOTS.pop(os.path.abspath(location), None)
+
+
+def _dir_key(st):
+    return (util.mtime_ns(st), st.st_ino, st.st_nlink)
+
+
+class Snapshot(object):
+    """The entries of one directory, as they were when we scanned it"""
+
+    def __init__(self, location, key=None):
+        self.location = location
+        self.key = key
+        self.services = collections.defaultdict(dict)
+        self.refs = collections.defaultdict(list)
+        self.links = {}
+        self._versions = {}
+
+        for (name, path, is_dir, is_link) in entries(location):
+            if is_link:
+                try:
+                    self.links[name] = os.readlink(path)
+                except OSError:
+                    pass
+            match = DIR_FORMAT.match(name)
+            if match:
+                self.services[match.group(1)][match.group(2)] = name
+            if not is_dir:
+                continue
+            try:
+                target = os.readlink(os.path.join(path, _VENV_DIR))
+            except OSError:
+                continue
+            self.refs[target].append(name)
+
+    def version(self, name):
+        """The Version of the entry called name"""
+        try:
+            return self._versions[name]
+        except KeyError:
+            pass
+        version = from_service_dir(os.path.join(self.location, name))
+        self._versions[name] = version
+        return version
+
+    def suffix(self, service, version):
+        """The suffix of service's directory for version, or None"""
+        suffixes = self.services.get(service, {})
+        for suffix in sorted(suffixes):
+            if self.version(suffixes[suffix]) == version:
+                return suffix
+        return None
+
+    def referrers(self, target):
+        """The entries whose venv symlink points at target"""
+        return list(self.refs.get(target, []))
+
+    def active(self, service):
+        """The suffix that service's pointer links to, or None"""
+        target = self.links.get(service)
+        if target is None or not target.startswith(service + "-"):
+            return None
+        return target[len(service) + 1:]
+
+
+def entries(location):
+    """Yield (name, path, is_dir, is_link) for each entry in location
+
+    is_dir follows symlinks, as os.path.isdir does.
+    """
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(location):
+            try:
+                is_dir = entry.is_dir()
+                is_link = entry.is_symlink()
+            except OSError:
+                is_dir = is_link = False
+            yield (entry.name, entry.path, is_dir, is_link)
+        return
+
+    for name in os.listdir(location):
+        path = os.path.join(location, name)
+        yield (name, path, os.path.isdir(path), os.path.islink(path))
@@ -54,6 +54,7 @@ import shutil
 from ardana_packager.activate import active_version, ensure_suffix  # noqa
 from ardana_packager.error import InstallerError
 import ardana_packager.expand as expand
+import ardana_packager.scan as scan
 
 
 _VENV_DIR = "venv"
@@ -96,6 +97,7 @@ def refer(conf, spec):
         os.mkdir(target_dir, 0o755)
         os.symlink(package_dir, os.path.join(target_dir, _VENV_DIR))
         os.mkdir(os.path.join(target_dir, _ETC_DIR), 0o755)
+        scan.invalidate(conf.SERVICE_LOCATION)
 
     except Exception as e:
         raise InstallerError(
@@ -135,6 +137,7 @@ def remove(config, spec):
     try:
         # Delete recursively
         shutil.rmtree(target)
+        scan.invalidate(config.SERVICE_LOCATION)
     except Exception as e:
         raise InstallerError(
             "Could not delete {target}"
@@ -147,23 +150,9 @@ def count_refs(conf, spec):
     """Return the versioned service names that refer to this package
 
     We look through any subdirectories of the service directory, searching
-    for venv symlinks that point to the specified package.
+    for venv symlinks that point to the specified package. The scan is
+    done once and reused until the service directory changes.
     """
 
-    dirs = []
-
     target = expand.package_dir(conf, spec)
-
-    for file in os.listdir(conf.SERVICE_LOCATION):
-        topdir = os.path.join(conf.SERVICE_LOCATION, file)
-        if not os.path.isdir(topdir):
-            continue
-
-        venv = os.path.join(topdir, _VENV_DIR)
-        if not os.path.islink(venv):
-            continue
-
-        if os.readlink(venv) == target:
-            dirs.append(file)
-
-    return dirs
+    return scan.snapshot(conf.SERVICE_LOCATION).referrers(target)
@@ -21,11 +21,17 @@ import subprocess
 
 from ardana_packager.ansible import AnsibleModule
 #  Args to this module
-#    Required:
+#    Required (unless units is given):
 #      service:  The name of the service (e.g. nova-api, swift-proxy, etc.)
 #      cmd:  The command to use to invoke the service (e.g. keystone-all)
 #
 #    Optional:
+#      units:  A list of dicts, each taking the args described here, to set
+#              up several services in one go. Args that a unit leaves out
+#              are taken from the module's own args. All the unit files are
+#              written first, then systemd is reloaded once if any of them
+#              changed, and enable/disable is done in one systemctl call
+#              for each.
 #      name: The systemd unit name
 #            Default: service
 #      install_dir:  The directory where the service is installed
@@ -43,12 +49,22 @@ from ardana_packager.ansible import AnsibleModule
 SYSTEMD_DIR = "/etc/systemd/system"
 SYSTEMCTL = "/bin/systemctl"
 
+# is-enabled states for which `systemctl is-enabled` exits 0
+ENABLED_STATES = frozenset(["enabled", "enabled-runtime", "static",
+                            "indirect", "generated", "alias", "transient"])
+
+# The args a unit in units can give, and the defaults for them
+UNIT_ARGS = ("service", "cmd", "name", "install_dir", "install_path", "user",
+             "group", "args", "env", "type", "restart", "restart_sec",
+             "stdout", "stderr", "enable", "before", "after", "wants",
+             "wanted_by", "limit_open_files")
+
 
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            service=dict(required=True),
-            cmd=dict(required=True),
+            service=dict(default=None),
+            cmd=dict(default=None),
             name=dict(default=None),
             install_dir=dict(default="/opt/stack/service"),
             install_path=dict(default=None),
@@ -68,11 +84,19 @@ def main():
             wants=dict(default=""),
             wanted_by=dict(default=""),
             limit_open_files=dict(default=""),
+            units=dict(default=None, type='list'),
         ),
+        mutually_exclusive=[['service', 'units']],
+        required_one_of=[['service', 'units']],
+        required_together=[['service', 'cmd']],
         supports_check_mode=False
     )
 
     params = module.params
+    if params['units'] is not None:
+        setup_units(module, params)
+        return
+
     service = params['service']
     cmd = params['cmd']
     name = params['name'] or service
@@ -130,7 +154,7 @@ def main():
                          exception=str(e))
         return
 
-    if systemd_daemon_reload() != 0:
+    if changed and systemd_daemon_reload() != 0:
         module.fail_json(msg="systemctl daemon-reload failed",
                          service=service,
                          cmd=cmd,
@@ -178,6 +202,72 @@ def main():
                      changed=changed)
 
 
+def setup_units(module, params):
+    units = []
+    for unit in params['units']:
+        if not isinstance(unit, dict):
+            module.fail_json(msg="Each of units must be a dict", unit=unit)
+            return
+        unknown = sorted(set(unit) - set(UNIT_ARGS))
+        if unknown:
+            module.fail_json(msg="Unknown args in unit: %s"
+                             % ", ".join(unknown),
+                             unit=unit)
+            return
+        unit_params = dict((k, params[k]) for k in UNIT_ARGS)
+        unit_params.update(unit)
+        if not unit_params['service'] or not unit_params['cmd']:
+            module.fail_json(msg="Each of units needs a service and cmd",
+                             unit=unit)
+            return
+        units.append(unit_params)
+
+    written = []
+    enables = {}
+    for p in units:
+        service = p['service']
+        name = p['name'] or service
+        install_path = p['install_path']
+        if install_path is None:
+            install_path = "%s/%s/venv/bin" % (p['install_dir'], service)
+        try:
+            if write_systemd(service, p['cmd'], name,
+                             install_path, p['user'], p['group'] or p['user'],
+                             args=p['args'], startup_type=p['type'],
+                             env=p['env'], restart=p['restart'],
+                             restart_sec=p['restart_sec'],
+                             before=p['before'], after=p['after'],
+                             wants=p['wants'], wanted_by=p['wanted_by'],
+                             stdout=p['stdout'], stderr=p['stderr'],
+                             limit_open_files=p['limit_open_files']):
+                written.append(name)
+        except Exception as e:
+            module.fail_json(msg="Write systemd failed",
+                             unit=p,
+                             written=written,
+                             exception=str(e))
+            return
+        if type(p['enable']) is bool:
+            enables[name] = p['enable']
+
+    if written and systemd_daemon_reload() != 0:
+        module.fail_json(msg="systemctl daemon-reload failed",
+                         written=written)
+        return
+
+    retcode, enabled, disabled = systemd_daemon_enable_all(enables)
+    if retcode != 0:
+        module.fail_json(msg="systemctl enable failed",
+                         written=written,
+                         enabled=enabled,
+                         disabled=disabled)
+        return
+
+    module.exit_json(units=[p['name'] or p['service'] for p in units],
+                     written=written, enabled=enabled, disabled=disabled,
+                     changed=bool(written or enabled or disabled))
+
+
 def write_systemd(service, cmd, name, install_path, user, group,
                   args="", startup_type="", env={}, restart="",
                   restart_sec="", before="", after="",
@@ -278,3 +368,43 @@ def systemd_daemon_enable(name, enable):
         return subprocess.call([SYSTEMCTL, "disable", name]), True
     else:
         return 0, False
+
+
+def systemd_is_enabled(names):
+    """Ask systemd which of names are enabled, in one call if we can"""
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen([SYSTEMCTL, "is-enabled"] + names,
+                                stdout=subprocess.PIPE, stderr=devnull)
+        states = proc.communicate()[0].decode("utf-8").split()
+        if len(states) == len(names):
+            return dict((name, state in ENABLED_STATES)
+                        for (name, state) in zip(names, states))
+
+        # systemctl gives no state for a unit it can't find, so we
+        # can't tell which line is whose
+        return dict((name, subprocess.call([SYSTEMCTL, "is-enabled", name],
+                                           stdout=devnull,
+                                           stderr=devnull) == 0)
+                    for name in names)
+
+
+def systemd_daemon_enable_all(enables):
+    """Enable or disable units, as the dict enables says, in bulk
+
+    Returns the systemctl return code, and the names of the units
+    enabled and disabled.
+    """
+    names = sorted(enables)
+    if not names:
+        return 0, [], []
+    enabled = systemd_is_enabled(names)
+    to_enable = [name for name in names if enables[name] and not enabled[name]]
+    to_disable = [name for name in names
+                  if not enables[name] and enabled[name]]
+
+    retcode = 0
+    if to_enable:
+        retcode = subprocess.call([SYSTEMCTL, "enable"] + to_enable)
+    if to_disable and retcode == 0:
+        retcode = subprocess.call([SYSTEMCTL, "disable"] + to_disable)
+    return retcode, to_enable, to_disable
@@ -0,0 +1,119 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+"""
+File handling shared between the packager modules.
+"""
+
+import hashlib
+import os
+import os.path
+import shutil
+
+
+# How much of a file we read or write at a time
+CHUNK = 1024 * 1024
+
+
+def hash_file(f, h=None, out=None):
+    """Feed the rest of file object f into a sha256 hash
+
+    Carries on with h, if given. If out is given, everything read
+    is written to it as well. Returns the hash object.
+    """
+    if h is None:
+        h = hashlib.sha256()
+    for chunk in iter(lambda: f.read(CHUNK), b''):
+        h.update(chunk)
+        if out is not None:
+            out.write(chunk)
+    return h
+
+
+def checksum(path):
+    """Return the hex sha256 of a file's contents"""
+    with open(path, 'rb') as f:
+        return hash_file(f).hexdigest()
+
+
+def mtime_ns(st):
+    """A stat result's mtime in nanoseconds, even on python 2"""
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        return int(st.st_mtime * 1000000000)
+
+
+def member_name(name):
+    """Normalise a tarball member's name to the './path' form"""
+    return os.path.join('.', os.path.normpath(name))
+
+
+def hidden_path(path, suffix):
+    """A name alongside path for work in progress on it
+
+    The leading '.' keeps it from matching DIR_FORMAT, so nothing
+    takes it for an installed venv or service.
+    """
+    return os.path.join(os.path.dirname(path),
+                        "." + os.path.basename(path) + suffix)
+
+
+def clone(base_dir, target_dir, extra_mode_bits=0):
+    """Populate target_dir with hard links to everything in base_dir
+
+    Directories and symlinks are recreated, with the same mode,
+    ownership and times. extra_mode_bits are or'ed into the mode of
+    everything but the symlinks; for files, that's the mode of the
+    inode they share with base_dir.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(base_dir):
+        rel = os.path.relpath(dirpath, base_dir)
+        dest_dir = os.path.normpath(os.path.join(target_dir, rel))
+        if rel != '.':
+            os.mkdir(dest_dir)
+            _copy_attrs(dirpath, dest_dir, extra_mode_bits)
+
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dest = os.path.join(dest_dir, name)
+            if not os.path.islink(src):
+                if name in filenames:
+                    os.link(src, dest)
+                    _add_mode_bits(dest, extra_mode_bits)
+                continue
+            # os.walk doesn't descend into symlinked directories
+            os.symlink(os.readlink(src), dest)
+            st = os.lstat(src)
+            if os.geteuid() == 0:
+                os.lchown(dest, st.st_uid, st.st_gid)
+
+    _copy_attrs(base_dir, target_dir, extra_mode_bits)
+
+
+def _copy_attrs(src, dest, extra_mode_bits=0):
+    st = os.stat(src)
+    if os.geteuid() == 0:
+        os.chown(dest, st.st_uid, st.st_gid)
+    shutil.copystat(src, dest)
+    _add_mode_bits(dest, extra_mode_bits)
+
+
+def _add_mode_bits(path, extra_mode_bits):
+    if not extra_mode_bits:
+        return
+    mode = os.stat(path).st_mode & 0o7777
+    if mode | extra_mode_bits != mode:
+        os.chmod(path, mode | extra_mode_bits)
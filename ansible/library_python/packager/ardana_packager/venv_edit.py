@@ -20,13 +20,43 @@
 """venv_edit ansible module."""
 
 import os
+import contextlib
+import fcntl
+import gzip
+import hashlib
 import re
 import shutil
+import subprocess
 import tarfile
+import tempfile
 from time import strftime
 
 import yaml
 
+import ardana_packager.extract as extract
+import ardana_packager.overlay as overlay
+import ardana_packager.util as util
+
+_COMPRESS_LEVEL = 6
+
+_INSTALL_DIR = "/opt/stack/venv"
+_TEMPLATE_CACHE = os.path.join(_INSTALL_DIR, ".venv_templates")
+
+# Bumped when templates built by older versions of this module can't
+# be used; it goes into their names.
+_TEMPLATE_FORMAT = 2
+
+# A template is built here, alongside where it will end up, so that
+# we know the prefix that virtualenv wrote into it.
+_BUILD_SUFFIX = ".build"
+_LOCK_SUFFIX = ".lock"
+
+# Files in bin/ with a NUL byte this near the start are binaries
+_BINARY_BYTES = 8192
+
+# lsb_release's view of the platform, which won't change under us
+_platform = None
+
 DOCUMENTATION = '''
 ---
 module: venv_edit
@@ -75,6 +105,31 @@ options:
               If this is not defined, the current patch number is incremented.
         required: false
         default: null
+    compress_level:
+        description:
+            - The gzip compression level (1-9) for the produced tarball.
+              pigz is used to compress on all cores, if it is installed.
+        required: false
+        default: 6
+    overlay:
+        description:
+            - Patch src without unpacking it. The wheels are installed
+              into a scratch prefix with the python that src was built
+              for, and only what they change is written into the new
+              tarball; everything else is copied from src as it is.
+              Requires src.
+        required: false
+        default: false
+    template_cache:
+        description:
+            - Where to keep the empty venvs that venvs built from
+              scratch are cloned from, one for each interpreter and
+              virtualenv version. It should be on the same filesystem
+              as /opt/stack/venv, so that clones can be hard linked;
+              if it isn't, or is set to an empty string, virtualenv
+              is run for every build.
+        required: false
+        default: /opt/stack/venv/.venv_templates
 '''
 
 EXAMPLES = '''
@@ -99,66 +154,346 @@ EXAMPLES = '''
     wheels: /home/wheelman/my_wheel.whl
     version: 4.0.1
     patch: 27
-'''
 
+- venv_edit:
+    src: /home/wheelman/source_venv.tgz
+    wheelhouse: /home/wheelman/my_wheelhouse
+    wheels: /home/wheelman/my_wheel.whl
+    version: 4.0.0
+    overlay: true
+'''
 
-def create_venv(module, dest):
-    """Create a virtualenv at the specified location."""
-    virtualenv_bin = module.get_bin_path('virtualenv')
-    virtual_env_cmd = [virtualenv_bin, dest]
-    return module.run_command(virtual_env_cmd)
-
-
-def unpack_venv(tarball_path, target_dir):
-    """Explode tarball at target_dir."""
-    with tarfile.open(tarball_path) as tarball:
-        def is_within_directory(directory, target):
-
-            abs_directory = os.path.abspath(directory)
-            abs_target = os.path.abspath(target)
-
-            prefix = os.path.commonprefix([abs_directory, abs_target])
 
-            return prefix == abs_directory
+def create_venv(module, dest, template_cache=None):
+    """Create a virtualenv at the specified location.
 
-        def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+    If template_cache is given, an empty venv is built there once for
+    each interpreter and virtualenv version; dest is then a hard-linked
+    clone of that, relocated. If the template turns out not to mention
+    the prefix it was built at, virtualenv is run for dest after all.
+    """
+    virtualenv_bin = module.get_bin_path('virtualenv', required=True)
+    virtual_env_cmd = [virtualenv_bin, dest]
+    if not template_cache or not _same_filesystem(template_cache, dest):
+        return module.run_command(virtual_env_cmd)
+
+    template = _venv_template(module, virtualenv_bin, template_cache)
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    os.mkdir(dest)
+    util.clone(template, dest)
+    if not _relocate_clone(dest, template + _BUILD_SUFFIX):
+        cleanup(dest)
+        return module.run_command(virtual_env_cmd)
+    return (0, "", "")
+
+
+def _same_filesystem(template_cache, dest):
+    """Can venvs in template_cache be hard linked to dest?
+
+    Neither need exist yet: each will be on the filesystem of its
+    nearest existing ancestor.
+    """
+    return _device(template_cache) == _device(os.path.dirname(dest))
+
+
+def _device(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def _venv_template(module, virtualenv_bin, template_cache):
+    """The path to an empty venv from virtualenv_bin, built if need be
+
+    The venv is built at the template's path plus _BUILD_SUFFIX, and
+    renamed into place once it's complete. Only one build of each
+    template runs at a time.
+    """
+    template = os.path.join(template_cache,
+                            _template_key(module, virtualenv_bin))
+    if os.path.isdir(template):
+        return template
+
+    if not os.path.isdir(template_cache):
+        os.makedirs(template_cache)
+    with _locked(template + _LOCK_SUFFIX):
+        if os.path.isdir(template):
+            # Built while we waited for the lock
+            return template
+
+        building = template + _BUILD_SUFFIX
+        cleanup(building)
+        try:
+            os.mkdir(building)
+            os.chmod(building, 0o755)
+            rc, out, err = module.run_command([virtualenv_bin, building])
+            if rc != 0:
+                module.fail_json(msg=out,
+                                 changed=False,
+                                 results="",
+                                 errors=err)
+            os.rename(building, template)
+        finally:
+            cleanup(building)
+    return template
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Hold an exclusive lock on path, creating it if need be"""
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
-            for member in tar.getmembers():
-                member_path = os.path.join(path, member.name)
-                if not is_within_directory(path, member_path):
-                    raise Exception("Attempted Path Traversal in Tar File")
 
-            tar.extractall(path, members, numeric_owner=numeric_owner)
+def _template_key(module, virtualenv_bin):
+    """Name a template by virtualenv's version and interpreter"""
+    rc, out, err = module.run_command([virtualenv_bin, '--version'])
+    if rc != 0:
+        module.fail_json(msg="Cannot run {0} --version"
+                         .format(virtualenv_bin),
+                         changed=False,
+                         results="",
+                         errors=err)
+    # eg, "15.1.0" or "virtualenv 20.0.1 from ..."
+    match = re.search(r'\d[\w.]*', out)
+    virtualenv_version = match.group(0) if match else out.strip()
+
+    # virtualenv builds venvs for the python it runs under
+    with open(virtualenv_bin, 'rb') as f:
+        head = f.read(_SHEBANG_BYTES)
+    interpreter = virtualenv_bin
+    if _interpreter(head) is not None:
+        words = head.split(b'\n', 1)[0][2:].decode('utf-8').split()
+        interpreter = words[0]
+        if os.path.basename(interpreter) == "env" and len(words) > 1:
+            interpreter = module.get_bin_path(words[1], required=True)
+    interpreter = os.path.realpath(interpreter)
+    st = os.stat(interpreter)
+
+    key = hashlib.sha1(repr((interpreter, st.st_size, int(st.st_mtime),
+                             virtualenv_version,
+                             _TEMPLATE_FORMAT)).encode('utf-8'))
+    return "{python}-{version}-{key}".format(
+        python=os.path.basename(interpreter),
+        version=re.sub(r'[^A-Za-z0-9.]', '_', virtualenv_version),
+        key=key.hexdigest()[:12])
 
 
-        safe_extract(tarball, path=target_dir)
+def unpack_venv(tarball_path, target_dir):
+    """Explode tarball at target_dir."""
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    extract.extract(tarball_path, target_dir)
 
 
 def relocate_venv(target_dir):
-    """Relocate target venv shebang lines and fix up activate script."""
+    """Relocate target venv shebang lines and activation scripts.
+
+    Only the head of each file in bin/ is read: a file is rewritten
+    only if it's an activation script, or its first line is a #!
+    naming an interpreter under the venv's old prefix (taken from
+    bin/activate). Binaries and anything else are left untouched.
+    In an activation script, every mention of the old prefix is
+    replaced; if it isn't known, just the VIRTUAL_ENV setting.
+    """
+    venv_bin = os.path.join(target_dir, "bin")
+    old_prefix = None
+    activate_file_loc = os.path.join(venv_bin, "activate")
+    if os.path.isfile(activate_file_loc):
+        with open(activate_file_loc, 'rb') as f:
+            old_prefix = _virtual_env(f.read())
+
+    for filename in os.listdir(venv_bin):
+        file_path = os.path.join(venv_bin, filename)
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+        if filename in _ACTIVATE_SCRIPTS:
+            with open(file_path, 'rb') as f:
+                file_contents = f.read()
+            new_contents = _relocate_activate(filename, file_contents,
+                                              target_dir, old_prefix)
+        else:
+            with open(file_path, 'rb') as f:
+                head = f.read(_SHEBANG_BYTES)
+                if not _relocatable(head, old_prefix):
+                    continue
+                file_contents = head + f.read()
+            new_contents = _relocate_script(file_contents, target_dir,
+                                            old_prefix)
+        if new_contents != file_contents:
+            _replace(file_path, new_contents)
+
+
+def _relocate_clone(target_dir, built_at):
+    """Point a clone of a template that was built at built_at at target_dir
+
+    Every mention of built_at in the text files in bin/ - shebang
+    lines, and however each activation script spells its VIRTUAL_ENV -
+    is replaced, as is the start of any symlink in the clone that
+    points under built_at. Binaries are left alone. Returns False if
+    no file in bin/ mentions built_at.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(target_dir):
+        for entry in dirnames + filenames:
+            path = os.path.join(dirpath, entry)
+            if not os.path.islink(path):
+                continue
+            link = os.readlink(path)
+            if link == built_at or link.startswith(built_at + os.sep):
+                # The clone's symlinks are its own, not the template's
+                os.unlink(path)
+                os.symlink(target_dir + link[len(built_at):], path)
+
+    old_prefix = built_at.encode('utf-8')
+    target = target_dir.encode('utf-8')
     venv_bin = os.path.join(target_dir, "bin")
+    found = False
     for filename in os.listdir(venv_bin):
         file_path = os.path.join(venv_bin, filename)
-        with open(file_path, 'r') as f:
-            file_contents = f.read()
-        with open(file_path, 'w') as f:
-            new_shebang = re.sub(r'^#!.*',
-                                 r'#!{0}/bin/python'.format(target_dir),
-                                 file_contents)
-            f.write(new_shebang)
-
-    # Fix up activate script
-    activate_file_loc = os.path.join(target_dir, "bin/activate")
-    with open(activate_file_loc, 'r') as f:
-        activate_file = f.read()
-    with open(activate_file_loc, 'w') as f:
-        new_line = re.sub(r'^VIRTUAL_ENV=".*?"',
-                          r'VIRTUAL_ENV="{0}"'.format(target_dir),
-                          activate_file,
-                          1,
-                          re.MULTILINE)
-        f.seek(0)
-        f.write(new_line)
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'rb') as f:
+            head = f.read(_BINARY_BYTES)
+            if b'\0' in head:
+                continue
+            file_contents = head + f.read()
+        if old_prefix not in file_contents:
+            continue
+        found = True
+        _replace(file_path, file_contents.replace(old_prefix, target))
+    return found
+
+
+def _replace(file_path, data):
+    """Give file_path new contents, without touching its old inode"""
+    (fd, tmp) = tempfile.mkstemp(prefix="." + os.path.basename(file_path),
+                                 dir=os.path.dirname(file_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        shutil.copymode(file_path, tmp)
+        os.rename(tmp, file_path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+# The longest shebang line we'll look at; the kernel's limit is lower
+_SHEBANG_BYTES = 512
+
+_PYTHON = re.compile(br'^python[0-9.]*$')
+
+# Activation scripts, and how each sets VIRTUAL_ENV; the value may be
+# quoted or not, and the line indented.
+_ACTIVATE_SCRIPTS = {
+    "activate": br'VIRTUAL_ENV=',
+    "activate.csh": br'setenv VIRTUAL_ENV ',
+    "activate.fish": br'set -gx VIRTUAL_ENV ',
+    "activate.nu": br'let virtual-env = ',
+    "activate.xsh": br'$VIRTUAL_ENV = r',
+}
+
+
+def _setting(setting):
+    """A regex matching a line that assigns a path with setting"""
+    return re.compile(br'^(\s*' + re.escape(setting) +
+                      br')(["\']?)(/.*?)\2[ \t]*$', re.MULTILINE)
+
+
+def _virtual_env(data):
+    """The VIRTUAL_ENV that the activate script data sets, as bytes"""
+    if data is None:
+        return None
+    match = _setting(_ACTIVATE_SCRIPTS["activate"]).search(data)
+    if not match:
+        return None
+    return match.group(3).rstrip(b'/')
+
+
+def _interpreter(head):
+    """The interpreter in the #! line at the start of head, if any"""
+    if not head.startswith(b'#!'):
+        return None
+    line = head.split(b'\n', 1)
+    if len(line) == 1 and len(head) >= _SHEBANG_BYTES:
+        # Not a shebang line we'd know what to do with
+        return None
+    words = line[0][2:].split()
+    if not words:
+        return None
+    return words[0]
+
+
+def _relocatable(head, old_prefix):
+    """Does the script starting with head run an interpreter we move?
+
+    That's one under old_prefix's bin/ or, if we don't know the old
+    prefix, any python.
+    """
+    interpreter = _interpreter(head)
+    if interpreter is None:
+        return False
+    if old_prefix is not None:
+        return interpreter.startswith(old_prefix.rstrip(b'/') + b'/bin/')
+    return bool(_PYTHON.match(os.path.basename(interpreter)))
+
+
+def _relocate_script(data, target_dir, old_prefix=None):
+    """Point a script's shebang line at target_dir's interpreter.
+
+    If old_prefix is given, only a shebang under it is changed, and
+    the interpreter's name and arguments are kept; otherwise any
+    python shebang becomes target_dir's python.
+    """
+    if not _relocatable(data[:_SHEBANG_BYTES], old_prefix):
+        return data
+    target = target_dir.encode('utf-8')
+    if old_prefix is None:
+        return re.sub(br'^#!.*', b'#!' + target + b'/bin/python', data,
+                      count=1)
+    old_prefix = old_prefix.rstrip(b'/')
+    start = data.index(old_prefix)
+    return data[:2] + target + data[start + len(old_prefix):]
+
+
+def _relocate_activate(filename, data, target_dir, old_prefix=None):
+    """Point an activation script's VIRTUAL_ENV at target_dir.
+
+    If old_prefix is given and the script mentions it, every mention
+    is replaced; otherwise just the VIRTUAL_ENV setting is.
+    """
+    target = target_dir.encode('utf-8')
+    if old_prefix is not None:
+        # The whole prefix, not the start of a longer path
+        mention = re.compile(re.escape(old_prefix) + br'(?![^/\s"\'])')
+        if mention.search(data):
+            return mention.sub(lambda m: target, data)
+    setting = _ACTIVATE_SCRIPTS.get(filename)
+    if setting is None:
+        return data
+    return _setting(setting).sub(
+        lambda m: m.group(1) + m.group(2) + target + m.group(2),
+        data,
+        count=1)
+
+
+def _bin_rewriter(target_dir, old_prefix=None):
+    """What relocate_venv does, for members of a tarball."""
+    def rewrite(name):
+        if os.path.dirname(name) != "./bin":
+            return None
+        filename = os.path.basename(name)
+        if filename in _ACTIVATE_SCRIPTS:
+            return lambda data: _relocate_activate(filename, data,
+                                                   target_dir, old_prefix)
+        return lambda data: _relocate_script(data, target_dir, old_prefix)
+    return rewrite
 
 
 def add_to_venv(module, target_dir, wheels, wheelhouse):
@@ -188,6 +523,64 @@ def add_to_venv(module, target_dir, wheels, wheelhouse):
                          errors=err_pip)
 
 
+def overlay_venv(module, src, new_tarball, target_dir, wheels, wheelhouse,
+                 patch, derived, level=_COMPRESS_LEVEL):
+    """Patch src into new_tarball, without unpacking it.
+
+    The wheels (and their dependencies) go into a scratch prefix;
+    only what differs from src is taken from there. See
+    ardana_packager.overlay.
+    """
+    base = overlay.Overlay(src)
+    if base.python_version is None:
+        module.fail_json(msg="Cannot find site-packages in {0}".format(src))
+    python = module.get_bin_path("python" + base.python_version,
+                                 required=True)
+
+    scratch = tempfile.mkdtemp(prefix="venv_edit-")
+    try:
+        pip_command = ("{python} -m pip install {wheels} --no-index "
+                       "--find-links {wh} --prefix {scratch} "
+                       "--ignore-installed --no-compile"
+                       .format(python=python, wheels=wheels, wh=wheelhouse,
+                               scratch=scratch))
+        rc, out_pip, err_pip = module.run_command(pip_command)
+        if (rc != 0):
+            module.fail_json(msg=out_pip,
+                             changed=False,
+                             results="",
+                             errors=err_pip)
+
+        scratch_bin = os.path.join(scratch, "bin")
+        if os.path.isdir(scratch_bin):
+            for filename in os.listdir(scratch_bin):
+                file_path = os.path.join(scratch_bin, filename)
+                if os.path.islink(file_path) or \
+                   not os.path.isfile(file_path):
+                    continue
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                with open(file_path, 'wb') as f:
+                    f.write(_relocate_script(data, target_dir))
+
+        if base.metadata is not None:
+            os.mkdir(os.path.join(scratch, "META-INF"))
+            with open(os.path.join(scratch, "META-INF", "version.yml"),
+                      'wb') as f:
+                f.write(base.metadata)
+            update_version(scratch, patch, derived)
+
+        with _compressed(new_tarball, level) as out:
+            with tarfile.open(fileobj=out, mode="w|",
+                              format=tarfile.GNU_FORMAT) as tarball:
+                base.write(tarball, scratch,
+                           _bin_rewriter(target_dir,
+                                         _virtual_env(base.activate)))
+
+    finally:
+        cleanup(scratch)
+
+
 def create_metadata(module, target_dir, timestamp, version, patch):
     """Create new metadata files."""
     # Create metadata directory
@@ -208,20 +601,28 @@ def create_metadata(module, target_dir, timestamp, version, patch):
         yaml.dump(version_yaml, stream=f)
 
     # Create manifest
-    lsb_release_bin = module.get_bin_path('lsb_release')
-    lsb_release_cmd = [lsb_release_bin, '-idrc']
-    rc, lsb_out, err = module.run_command(lsb_release_cmd)
-    lsb_out = lsb_out.lower()
-    lsb_out = lsb_out.replace("\t", " ")
-    lsb_out = lsb_out.replace("distributor id", "distributor_id")
     manifest_file = os.path.join(metadata_dir, "manifest.yml")
-    lsb_yaml = yaml.load(lsb_out)
+    lsb_yaml = _platform_manifest(module)
     manifest_yaml = yaml.load("environment: %s" % yaml.dump(lsb_yaml))
 
     with open(manifest_file, 'w') as f:
         yaml.dump(manifest_yaml, stream=f)
 
 
+def _platform_manifest(module):
+    """What lsb_release says about this platform, asked only once."""
+    global _platform
+    if _platform is None:
+        lsb_release_bin = module.get_bin_path('lsb_release')
+        lsb_release_cmd = [lsb_release_bin, '-idrc']
+        rc, lsb_out, err = module.run_command(lsb_release_cmd)
+        lsb_out = lsb_out.lower()
+        lsb_out = lsb_out.replace("\t", " ")
+        lsb_out = lsb_out.replace("distributor id", "distributor_id")
+        _platform = yaml.load(lsb_out)
+    return _platform
+
+
 def update_version(target_dir, patch, derived=False):
     """Update venv patch number."""
     version_file = os.path.join(target_dir, "META-INF", "version.yml")
@@ -251,10 +652,77 @@ def update_version(target_dir, patch, derived=False):
         yaml.dump(version, stream=f)
 
 
-def repackage_venv(new_tarball, target_dir):
-    """Repackage venv as a new tarball."""
-    with tarfile.open(new_tarball, "w:gz") as tarball:
-        tarball.add(target_dir, ".")
+def repackage_venv(new_tarball, target_dir, level=_COMPRESS_LEVEL):
+    """Repackage venv as a new tarball.
+
+    META-INF is written first, so that the version metadata can be
+    read without decompressing the rest of the archive. Everything
+    else follows in sorted order, and the gzip header carries no
+    name or timestamp, so the same tree always gives the same bytes.
+
+    The tar stream is compressed at the given level by pigz, on all
+    cores, if it is installed; otherwise by gzip in-process.
+    """
+    with _compressed(new_tarball, level) as out:
+        with tarfile.open(fileobj=out, mode="w|",
+                          format=tarfile.GNU_FORMAT) as tarball:
+            for (path, arcname) in _venv_members(target_dir):
+                tarball.add(path, arcname, recursive=False)
+
+
+def _venv_members(target_dir):
+    """Yield (path, arcname) for target_dir and everything under it
+
+    Each directory's entries come in sorted order, with META-INF
+    first at the top level.
+    """
+    yield (target_dir, ".")
+    for (dirpath, dirnames, filenames) in os.walk(target_dir):
+        key = None
+        if dirpath == target_dir:
+            key = lambda entry: (entry != "META-INF", entry)  # noqa
+        # Sorting in place makes os.walk descend in the same order
+        dirnames.sort(key=key)
+        for entry in sorted(dirnames + filenames, key=key):
+            path = os.path.join(dirpath, entry)
+            yield (path,
+                   os.path.join(".", os.path.relpath(path, target_dir)))
+
+
+class _compressed(object):
+    """A file object whose contents are gzipped into path"""
+
+    def __init__(self, path, level):
+        self.path = path
+        self.level = level
+        self.target = None
+        self.proc = None
+        self.out = None
+
+    def __enter__(self):
+        self.target = open(self.path, "wb")
+        pigz = extract.pigz_path()
+        if pigz is not None:
+            self.proc = subprocess.Popen(
+                [pigz, "-c", "-n", "-{0}".format(self.level)],
+                stdin=subprocess.PIPE, stdout=self.target)
+            self.out = self.proc.stdin
+        else:
+            self.out = gzip.GzipFile(filename="", mode="wb",
+                                     fileobj=self.target,
+                                     compresslevel=self.level, mtime=0)
+        return self.out
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.out.close()
+            if self.proc is not None and self.proc.wait() != 0 and \
+               exc_type is None:
+                raise IOError("pigz could not compress {0}"
+                              .format(self.path))
+        finally:
+            self.target.close()
+        return False
 
 
 def cleanup(target_dir):
@@ -273,7 +741,10 @@ def main():
             wheelhouse=dict(required=True),
             wheels=dict(required=True),
             version=dict(required=True),
-            patch=dict(default=None)
+            patch=dict(default=None),
+            compress_level=dict(default=_COMPRESS_LEVEL, type='int'),
+            overlay=dict(default=False, type='bool'),
+            template_cache=dict(default=_TEMPLATE_CACHE),
         ),
         required_one_of=[['src', 'dest']]
     )
@@ -286,6 +757,9 @@ def main():
     wheels = params['wheels']
     version = params['version']
     patch = params['patch']
+    compress_level = params['compress_level']
+    use_overlay = params['overlay']
+    template_cache = params['template_cache']
 
     derived = False
     if name is not None and src is not None:
@@ -298,15 +772,22 @@ def main():
             name = "-".join(os.path.basename(src).split('-')[:-1])
     suffix = strftime('%Y%m%dT%H%M%SZ')
     venv_name = name + "-" + suffix
-    install_dir = "/opt/stack/venv"
+    install_dir = _INSTALL_DIR
     target_dir = os.path.join(install_dir, venv_name)
     if dest is None:
         dest = os.path.dirname(src)
     dest_full = os.path.join(dest, venv_name + ".tgz")
 
+    if src is not None and use_overlay:
+        # Patching an existing venv without unpacking it
+        overlay_venv(module, src, dest_full, target_dir, wheels, wheelhouse,
+                     patch, derived and not patch, compress_level)
+        module.exit_json(changed=True, rc=0)
+        return
+
     try:
         if src is None:  # Creating a venv from scratch
-            create_venv(module, target_dir)
+            create_venv(module, target_dir, template_cache)
             add_to_venv(module, target_dir, wheels, wheelhouse)
             create_metadata(module, target_dir, suffix, version, patch)
         else:  # Using an existing venv as a base
@@ -315,7 +796,7 @@ def main():
             add_to_venv(module, target_dir, wheels, wheelhouse)
             update_version(target_dir, patch, derived and not patch)
 
-        repackage_venv(dest_full, target_dir)
+        repackage_venv(dest_full, target_dir, compress_level)
 
     finally:
         cleanup(target_dir)
@@ -26,50 +26,112 @@ import os.path
 import tarfile
 import yaml
 
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2 has no lru_cache; a bounded memo does the job here.
+    import functools
+
+    def lru_cache(maxsize=128):
+        def decorator(fn):
+            memo = {}
+
+            @functools.wraps(fn)
+            def wrapper(arg):
+                try:
+                    return memo[arg]
+                except KeyError:
+                    pass
+                if len(memo) >= maxsize:
+                    memo.clear()
+                result = memo[arg] = fn(arg)
+                return result
+            return wrapper
+        return decorator
+
 from ardana_packager.config import DIR_FORMAT, TAR_FORMAT, VERSION_LATEST  # noqa
 from ardana_packager.error import InstallerError
 
 
+_VERSION_MEMBER = os.path.join('META-INF', 'version.yml')
+
+# Distinct version strings seen in one run are few; remember them all.
+_CACHE_SIZE = 4096
+
+
 class Version(object):
+    """An immutable, hashable version.
+
+        The parts are held as a tuple of tuples, eg
+        ((3, 0, 0), ('20160501T120000Z',)), so that comparison
+        is plain tuple comparison.
+    """
+
+    __slots__ = ('_parts',)
+
     def __init__(self, parts=None):
         if parts is None:
-            parts = [[0]]
+            parts = ((0,),)
+
+        object.__setattr__(self, '_parts', tuple(tuple(p) for p in parts))
 
-        self._parts = parts
+    def __setattr__(self, name, value):
+        raise AttributeError("Version objects are immutable")
+
+    def __reduce__(self):
+        return (Version, (self._parts,))
+
+    def __hash__(self):
+        return hash(self._parts)
 
     def __eq__(self, other):
-        return other is not None and self._parts == other._parts
+        if not isinstance(other, Version):
+            return False
+        return self._parts == other._parts
 
     def __ne__(self, other):
-        return other is None or self._parts != other._parts
+        return not self == other
 
     def __le__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._parts <= other._parts
 
     def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._parts < other._parts
 
     def __ge__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._parts >= other._parts
 
     def __gt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
         return self._parts > other._parts
 
     def __str__(self):
         return ':'.join('.'.join(str(n) for n in p) for p in self._parts)
 
+    def __repr__(self):
+        return 'Version({parts!r})'.format(parts=self._parts)
+
 
+@lru_cache(maxsize=_CACHE_SIZE)
 def from_str(s):
     """Given a plain string version, return the Version object"""
     return Version(
-        [[int(n) if n.isdigit() else n for n in p.split('.')]
-         for p in s.split(':')])
+        tuple(int(n) if n.isdigit() else n for n in p.split('.'))
+        for p in s.split(':'))
 
 
 with open(os.path.join(os.path.dirname(__file__), 'versions.yml')) as f:
     _BEST_GUESS = yaml.safe_load(f)
 
 
+@lru_cache(maxsize=_CACHE_SIZE)
 def best_guess(s):
     try:
         return _BEST_GUESS[s]
@@ -86,26 +148,40 @@ def from_tarball(fn):
         If that file does not exist, use your best guess from the
         suffix (which *must* work).
     """
-    with tarfile.open(fn) as tf:
-        version_file = os.path.join('.',
-                                    'META-INF',
-                                    'version.yml')
-        try:
-            f = tf.extractfile(version_file)
-            if f is not None:
-                version_metadata = yaml.safe_load(f)
-                version_string = (str(version_metadata['version']) + ":" +
-                                  str(version_metadata['timestamp']))
-                if 'patch' in version_metadata:
-                    version_string += ":" + str(version_metadata['patch'])
-                return from_str(version_string)
-        except KeyError:
-            pass
+    version_metadata = _read_tarball_metadata(fn)
+    if version_metadata is not None:
+        return _from_metadata(version_metadata)
 
     # Guess from the suffix
     return guess_from_suffix(fn, TAR_FORMAT)
 
 
+def _read_tarball_metadata(fn):
+    """Stream through a tarball looking for META-INF/version.yml.
+
+        We stop reading (and decompressing) as soon as it's been
+        found; packages that put META-INF first are cheap to inspect.
+        Returns None if the tarball has no version metadata.
+    """
+    with tarfile.open(fn, 'r|*') as tf:
+        for member in tf:
+            if os.path.normpath(member.name) != _VERSION_MEMBER:
+                continue
+            if not member.isfile():
+                return None
+            return yaml.safe_load(tf.extractfile(member))
+    return None
+
+
+def _from_metadata(version_metadata):
+    """Turn the contents of a version.yml into a Version"""
+    version_string = (str(version_metadata['version']) + ":" +
+                      str(version_metadata['timestamp']))
+    if 'patch' in version_metadata:
+        version_string += ":" + str(version_metadata['patch'])
+    return from_str(version_string)
+
+
 def guess_from_suffix(file_name, format, group=2):
     """Return a best guess, given a directory or tarball name"""
 
@@ -133,12 +209,7 @@ def from_dir(dir):
     version_file = os.path.join(dir, 'META-INF', 'version.yml')
     if os.path.exists(version_file):
         with open(version_file) as f:
-            version_metadata = yaml.safe_load(f)
-            version_string = (str(version_metadata['version']) + ":" +
-                              str(version_metadata['timestamp']))
-            if 'patch' in version_metadata:
-                version_string += ":" + str(version_metadata['patch'])
-            return from_str(version_string)
+            return _from_metadata(yaml.safe_load(f))
 
     # Guess from the suffix
     return guess_from_suffix(dir, DIR_FORMAT)
@@ -153,12 +224,7 @@ def from_service_dir(dir):
     version_file = os.path.join(dir, 'venv', 'META-INF', 'version.yml')
     if os.path.exists(version_file):
         with open(version_file) as f:
-            version_metadata = yaml.safe_load(f)
-            version_string = (str(version_metadata['version']) + ":" +
-                              str(version_metadata['timestamp']))
-            if 'patch' in version_metadata:
-                version_string += ":" + str(version_metadata['patch'])
-            return from_str(version_string)
+            return _from_metadata(yaml.safe_load(f))
 
     # Guess from the suffix
     return guess_from_suffix(dir, DIR_FORMAT)
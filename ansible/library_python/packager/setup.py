@@ -53,6 +53,8 @@ setuptools.setup(
         'console_scripts': [
             'install_package = ardana_packager.cmd:main',
             'create_index = ardana_packager.indexer:main',
+            'create_delta = ardana_packager.delta:main',
+            'packager_query = ardana_packager.query:main',
             'setup_systemd = ardana_packager.setup_systemd:main',
             'venv_edit = ardana_packager.venv_edit:main',
             'config_symlinks = ardana_packager.symlinks:main',
@@ -0,0 +1,60 @@
+#
+# (c) Copyright 2017 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import io
+import os
+import sys
+import tarfile
+
+# add the packager library to import paths
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__),
+                 "../ansible/library_python/packager")))
+
+
+VERSION_YML = "file_format: 1\nversion: {version}\ntimestamp: {timestamp}\n"
+
+
+def write_tarball(path, members, version=None, timestamp=None):
+    """Write a gzipped tarball holding members, in order
+
+    members is a list of (name, content) pairs: content is the bytes of
+    a regular file, None for a directory, or a (type, linkname) pair for
+    a link, such as (tarfile.SYMTYPE, 'target'). If version is given, a
+    ./META-INF/version.yml for it goes first.
+    """
+    members = list(members)
+    if version is not None:
+        data = VERSION_YML.format(version=version, timestamp=timestamp)
+        members[:0] = [('./META-INF', None),
+                       ('./META-INF/version.yml', data.encode('utf-8'))]
+    with tarfile.open(path, 'w:gz') as tar:
+        for (name, content) in members:
+            info = tarfile.TarInfo(name)
+            info.mtime = 1500000000
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            elif isinstance(content, tuple):
+                (info.type, info.linkname) = content
+                info.mode = 0o777
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(content))
+    return path
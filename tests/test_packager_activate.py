@@ -0,0 +1,95 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from ardana_packager import activate
+from ardana_packager.error import InstallerError
+from ardana_packager import scan
+from ardana_packager import util
+from ardana_packager.version import Spec
+from oslotest import base
+
+
+SUFFIXES = ['20170101T000000Z', '20170201T000000Z']
+
+
+class TestSwitch(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSwitch, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.addCleanup(scan.invalidate)
+        for suffix in SUFFIXES:
+            os.mkdir(os.path.join(self.dir, 'nova-api-' + suffix))
+        self.location = os.path.join(self.dir, 'nova-api')
+
+        # Nothing should ever take the service's link away
+        self.unlinked = []
+        unlink = os.unlink
+
+        def recording(path):
+            self.unlinked.append(path)
+            unlink(path)
+        self.useFixture(fixtures.MonkeyPatch('os.unlink', recording))
+
+    def _switch(self, suffix):
+        activate.switch(self.dir, Spec(service='nova-api', suffix=suffix,
+                                       version='4.0.0:' + suffix))
+
+    def test_creates_link(self):
+        self._switch(SUFFIXES[0])
+
+        self.assertEqual(os.readlink(self.location), 'nova-api-' + SUFFIXES[0])
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['nova-api'] + ['nova-api-' + s for s in SUFFIXES])
+
+    def test_replaces_link(self):
+        os.symlink('nova-api-' + SUFFIXES[0], self.location)
+
+        self._switch(SUFFIXES[1])
+
+        self.assertEqual(os.readlink(self.location), 'nova-api-' + SUFFIXES[1])
+        self.assertEqual(self.unlinked, [])
+        # No temporary link is left behind
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['nova-api'] + ['nova-api-' + s for s in SUFFIXES])
+
+    def test_stale_temporary_link_replaced(self):
+        os.symlink('nova-api-' + SUFFIXES[0], self.location)
+        temp = util.hidden_path(self.location, activate._SWITCH_SUFFIX)
+        # Left by a run that was interrupted
+        os.symlink('nova-api-gone', temp)
+
+        self._switch(SUFFIXES[1])
+
+        self.assertEqual(os.readlink(self.location), 'nova-api-' + SUFFIXES[1])
+        self.assertEqual(self.unlinked, [temp])
+        self.assertFalse(os.path.lexists(temp))
+
+    def test_missing_version(self):
+        os.symlink('nova-api-' + SUFFIXES[0], self.location)
+
+        self.assertRaises(InstallerError, self._switch, '20170301T000000Z')
+
+        self.assertEqual(os.readlink(self.location), 'nova-api-' + SUFFIXES[0])
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['nova-api'] + ['nova-api-' + s for s in SUFFIXES])
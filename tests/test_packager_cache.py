@@ -0,0 +1,496 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import hashlib
+import json
+import os
+import os.path
+import time
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from ardana_packager import cache
+from ardana_packager import config
+from ardana_packager.error import InstallerError
+from ardana_packager.version import Spec
+from oslotest import base
+
+
+VERSIONS = [('4.0.0:20170101T000000Z', '20170101T000000Z'),
+            ('4.0.1:20170201T000000Z', '20170201T000000Z'),
+            ('4.0.2:20170301T000000Z', '20170301T000000Z'),
+            ('4.0.3:20170401T000000Z', '20170401T000000Z')]
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=b'', headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.data.decode('utf-8')
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """Serves one file, honouring Range requests as a server would"""
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def get(self, url, stream=False, headers=None, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        if 'Range' not in headers:
+            return FakeResponse(200, self.data)
+        offset = int(headers['Range'][len('bytes='):-1])
+        if offset >= len(self.data):
+            return FakeResponse(416, headers={
+                'Content-Range': 'bytes */{0}'.format(len(self.data))})
+        return FakeResponse(206, self.data[offset:], headers={
+            'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                offset, len(self.data) - 1, len(self.data))})
+
+
+class FakeRepo(object):
+    """Serves several files, by name, as FakeSession serves one
+
+    A file given an ETag in etags is served with it, and its
+    Last-Modified; a conditional GET that still matches gets a 304.
+    """
+
+    def __init__(self, files, etags=None):
+        self.files = files
+        self.etags = etags or {}
+        self.fetched = []
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        name = url.rsplit('/', 1)[1]
+        self.fetched.append(name)
+        self.requests.append(dict(headers or {}))
+        if name not in self.files:
+            return FakeResponse(404)
+        etag = self.etags.get(name)
+        if etag is None:
+            return FakeSession(self.files[name]).get(url, headers=headers,
+                                                     **kwargs)
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.files[name], headers={
+            'ETag': etag, 'Last-Modified': 'Sun, 01 Jan 2017 00:00:00 GMT'})
+
+
+class CacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(CacheTestCase, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.venv_dir = os.path.join(self.dir, 'venv')
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        os.mkdir(self.venv_dir)
+        os.mkdir(self.cache_dir)
+
+        self.conf_file = os.path.join(self.dir, 'packager.conf')
+        self._configure()
+
+    def _configure(self, **install):
+        install.setdefault('dir', self.venv_dir)
+        install.setdefault('cache', self.cache_dir)
+        with open(self.conf_file, 'w') as f:
+            f.write("[repo]\nurl = http://repo.invalid/\n[install]\n")
+            for (key, value) in sorted(install.items()):
+                f.write("{key} = {value}\n".format(key=key, value=value))
+        self.conf = config.Config(self.conf_file)
+
+
+class TestClean(CacheTestCase):
+
+    def setUp(self):
+        super(TestClean, self).setUp()
+        index = {'packages': {'nova': {}}}
+        # Oldest first, and least recently used first
+        for (i, (v, suffix)) in enumerate(VERSIONS):
+            tarball = 'nova-{suffix}.tgz'.format(suffix=suffix)
+            index['packages']['nova'][v] = {'file': tarball,
+                                            'suffix': suffix}
+            self._cached(tarball, age=len(VERSIONS) - i)
+        self._write_index(json.dumps(index))
+
+    def _write_index(self, data):
+        with open(os.path.join(self.cache_dir, 'packages.json'), 'w') as f:
+            f.write(data)
+
+    def _cached(self, file, size=100, age=0):
+        path = os.path.join(self.cache_dir, file)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        when = time.time() - 3600 * age
+        os.utime(path, (when, when))
+
+    def _tarballs(self):
+        return sorted(f for f in os.listdir(self.cache_dir)
+                      if f != 'packages.json')
+
+    def test_default_budget_keeps_small_cache(self):
+        self.assertEqual(cache.clean(self.conf), [])
+        self.assertEqual(len(self._tarballs()), len(VERSIONS))
+
+    def test_zero_budget_keeps_newest_and_expanded(self):
+        os.mkdir(os.path.join(self.venv_dir, 'nova-20170101T000000Z'))
+
+        removed = cache.clean(self.conf, keep=2, budget=0)
+
+        self.assertEqual(removed, ['nova-20170201T000000Z.tgz'])
+        self.assertEqual(self._tarballs(),
+                         ['nova-20170101T000000Z.tgz',
+                          'nova-20170301T000000Z.tgz',
+                          'nova-20170401T000000Z.tgz'])
+
+    def test_budget_evicts_least_recently_used(self):
+        removed = cache.clean(self.conf, keep=0, budget=250)
+
+        self.assertEqual(sorted(removed), ['nova-20170101T000000Z.tgz',
+                                           'nova-20170201T000000Z.tgz'])
+
+    def test_budget_from_config(self):
+        self._configure(cache_keep=0, cache_budget=150)
+
+        removed = cache.clean(self.conf)
+
+        self.assertEqual(len(removed), 3)
+        self.assertEqual(self._tarballs(), ['nova-20170401T000000Z.tgz'])
+
+    def test_partial_downloads_removed(self):
+        self._cached('nova-20170401T000000Z.tgz' + cache.PARTIAL_SUFFIX,
+                     age=2)
+
+        removed = cache.clean(self.conf, keep=4, budget=0)
+
+        self.assertEqual(removed,
+                         ['nova-20170401T000000Z.tgz' + cache.PARTIAL_SUFFIX])
+
+    def test_recent_partial_downloads_kept(self):
+        # Another run may still be writing these
+        self._cached('nova-20170401T000000Z.tgz' + cache.PARTIAL_SUFFIX)
+        self._cached('nova-20170501T000000Z.tgz' + cache.PARTIAL_SUFFIX)
+
+        removed = cache.clean(self.conf, keep=0, budget=0)
+
+        self.assertEqual(len(removed), len(VERSIONS))
+        self.assertEqual(self._tarballs(),
+                         ['nova-20170401T000000Z.tgz' + cache.PARTIAL_SUFFIX,
+                          'nova-20170501T000000Z.tgz' + cache.PARTIAL_SUFFIX])
+
+    def test_corrupt_index_removes_only_partials(self):
+        self._write_index('{"packages": ')
+        self._cached('nova-20170501T000000Z.tgz' + cache.PARTIAL_SUFFIX,
+                     age=2)
+        self._cached('nova-20170601T000000Z.tgz' + cache.PARTIAL_SUFFIX)
+
+        removed = cache.clean(self.conf, keep=0, budget=0)
+
+        self.assertEqual(removed,
+                         ['nova-20170501T000000Z.tgz' + cache.PARTIAL_SUFFIX])
+        self.assertEqual(len(self._tarballs()), len(VERSIONS) + 1)
+
+
+class TestDownload(CacheTestCase):
+
+    DATA = b'0123456789' * 1000
+
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.session = FakeSession(self.DATA)
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cache.session',
+            lambda config, jobs=None: self.session))
+        self.target = os.path.join(self.cache_dir, 'nova.tgz')
+        self.partial = self.target + cache.PARTIAL_SUFFIX
+        self.sha256 = hashlib.sha256(self.DATA).hexdigest()
+
+    def _download(self, sha256=None):
+        return cache._download(self.conf, 'http://repo.invalid/nova.tgz',
+                               self.target, sha256)
+
+    def _partial(self, data):
+        with open(self.partial, 'wb') as f:
+            f.write(data)
+
+    def _assert_downloaded(self):
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.DATA)
+        self.assertFalse(os.path.exists(self.partial))
+
+    def test_download(self):
+        self.assertEqual(self._download(self.sha256), len(self.DATA))
+        self._assert_downloaded()
+
+    def test_resume(self):
+        self._partial(self.DATA[:4000])
+
+        self.assertEqual(self._download(self.sha256), 6000)
+
+        self.assertEqual(self.session.requests, [{'Range': 'bytes=4000-'}])
+        self._assert_downloaded()
+
+    def test_complete_partial(self):
+        self._partial(self.DATA)
+
+        self.assertEqual(self._download(), 0)
+
+        self._assert_downloaded()
+
+    def test_partial_longer_than_file_discarded(self):
+        self._partial(self.DATA + b'stale')
+
+        self.assertEqual(self._download(), len(self.DATA))
+
+        self.assertEqual(self.session.requests,
+                         [{'Range': 'bytes={0}-'.format(len(self.DATA) + 5)},
+                          {}])
+        self._assert_downloaded()
+
+    def test_checksum_mismatch(self):
+        self.assertRaises(InstallerError, self._download,
+                          hashlib.sha256(b'other').hexdigest())
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.partial))
+
+    def test_resumed_checksum_mismatch(self):
+        self._partial(b'X' * 4000)
+
+        self.assertRaises(InstallerError, self._download, self.sha256)
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.partial))
+
+
+class TestSession(CacheTestCase):
+
+    def setUp(self):
+        super(TestSession, self).setUp()
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cache._SESSIONS', {}))
+
+    def _pool_maxsize(self, s):
+        return s.get_adapter('http://repo.invalid/')._pool_maxsize
+
+    def test_shared(self):
+        self.assertIs(cache.session(self.conf), cache.session(self.conf))
+
+    def test_sized_for_jobs(self):
+        default = cache.session(self.conf)
+        wide = cache.session(self.conf, jobs=32)
+
+        self.assertIsNot(default, wide)
+        self.assertEqual(self._pool_maxsize(default), cache._PREFETCH_JOBS)
+        self.assertEqual(self._pool_maxsize(wide), 32)
+
+
+class TestPrefetch(CacheTestCase):
+
+    FILES = {
+        'nova-20170101T000000Z.tgz': b'nova one',
+        'nova-20170201T000000Z.tgz': b'nova two',
+        'nova-20170201T000000Z.delta.tgz': b'nova one to two',
+        'swift-20170101T000000Z.tgz': b'swift one',
+    }
+
+    def setUp(self):
+        super(TestPrefetch, self).setUp()
+        self.repo = FakeRepo(dict(self.FILES))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cache.session',
+            lambda config, jobs=None: self.repo))
+
+        def entry(file, suffix, **kwargs):
+            entry = {'file': file, 'suffix': suffix,
+                     'sha256': hashlib.sha256(self.FILES[file]).hexdigest()}
+            entry.update(kwargs)
+            return entry
+
+        index = {'packages': {
+            'nova': {
+                '4.0.0:20170101T000000Z': entry(
+                    'nova-20170101T000000Z.tgz', '20170101T000000Z'),
+                '4.0.1:20170201T000000Z': entry(
+                    'nova-20170201T000000Z.tgz', '20170201T000000Z',
+                    deltas=[entry('nova-20170201T000000Z.delta.tgz',
+                                  '20170201T000000Z',
+                                  base='4.0.0:20170101T000000Z',
+                                  base_suffix='20170101T000000Z')]),
+            },
+            'swift': {
+                '2.0.0:20170101T000000Z': entry(
+                    'swift-20170101T000000Z.tgz', '20170101T000000Z'),
+            },
+        }}
+        with open(os.path.join(self.cache_dir, 'packages.json'), 'w') as f:
+            json.dump(index, f)
+
+    def _specs(self, *packages):
+        return [Spec(package=package, version=cache.VERSION_LATEST)
+                for package in packages]
+
+    def _cached(self, file):
+        return os.path.isfile(os.path.join(self.cache_dir, file))
+
+    def test_missing_fetched(self):
+        with open(os.path.join(self.cache_dir,
+                               'swift-20170101T000000Z.tgz'), 'wb') as f:
+            f.write(self.FILES['swift-20170101T000000Z.tgz'])
+
+        report = cache.prefetch(self.conf, self._specs('nova', 'swift'))
+
+        self.assertEqual([r['file'] for r in report],
+                         ['nova-20170201T000000Z.tgz'])
+        self.assertEqual(report[0]['bytes'], len(b'nova two'))
+        self.assertEqual(self.repo.fetched, ['nova-20170201T000000Z.tgz'])
+        self.assertTrue(self._cached('nova-20170201T000000Z.tgz'))
+
+    def test_nothing_fetched_for_exploded(self):
+        os.mkdir(os.path.join(self.venv_dir, 'swift-20170101T000000Z'))
+
+        self.assertEqual(cache.prefetch(self.conf, self._specs('swift')),
+                         [])
+        self.assertEqual(self.repo.fetched, [])
+
+    def test_delta_fetched_when_base_exploded(self):
+        os.mkdir(os.path.join(self.venv_dir, 'nova-20170101T000000Z'))
+
+        report = cache.prefetch(self.conf, self._specs('nova'))
+
+        self.assertEqual([r['file'] for r in report],
+                         ['nova-20170201T000000Z.delta.tgz'])
+        self.assertTrue(self._cached('nova-20170201T000000Z.delta.tgz'))
+        self.assertFalse(self._cached('nova-20170201T000000Z.tgz'))
+
+    def test_falls_back_from_missing_delta(self):
+        os.mkdir(os.path.join(self.venv_dir, 'nova-20170101T000000Z'))
+        del self.repo.files['nova-20170201T000000Z.delta.tgz']
+
+        report = cache.prefetch(self.conf, self._specs('nova'))
+
+        self.assertEqual([r['file'] for r in report],
+                         ['nova-20170201T000000Z.tgz'])
+        self.assertEqual(self.repo.fetched,
+                         ['nova-20170201T000000Z.delta.tgz',
+                          'nova-20170201T000000Z.tgz'])
+        self.assertTrue(self._cached('nova-20170201T000000Z.tgz'))
+
+    def test_failure_reported(self):
+        del self.repo.files['swift-20170101T000000Z.tgz']
+
+        e = self.assertRaises(InstallerError, cache.prefetch, self.conf,
+                              self._specs('nova', 'swift'))
+
+        self.assertIn('swift-20170101T000000Z.tgz', str(e))
+        self.assertTrue(self._cached('nova-20170201T000000Z.tgz'))
+
+
+class TestUpdate(CacheTestCase):
+
+    JSON_INDEX = b'{"packages":{}}'
+    YAML_INDEX = b'packages: {}\n'
+
+    def setUp(self):
+        super(TestUpdate, self).setUp()
+        self.repo = FakeRepo({'packages.json': self.JSON_INDEX},
+                             etags={'packages.json': '"v1"'})
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cache.session',
+            lambda config, jobs=None: self.repo))
+
+    def _read(self, file):
+        with open(os.path.join(self.cache_dir, file), 'rb') as f:
+            return f.read()
+
+    def _validators(self, file):
+        with open(os.path.join(self.cache_dir,
+                               file + cache._VALIDATORS_SUFFIX)) as f:
+            return json.load(f)
+
+    def test_fetched_then_not_modified(self):
+        self.assertTrue(cache.update(self.conf))
+        self.assertEqual(self._read('packages.json'), self.JSON_INDEX)
+        self.assertEqual(self._validators('packages.json'),
+                         {'etag': '"v1"',
+                          'last_modified': 'Sun, 01 Jan 2017 00:00:00 GMT'})
+        self.assertEqual(self.repo.requests[0], {})
+
+        self.assertFalse(cache.update(self.conf))
+
+        self.assertEqual(self.repo.requests[1],
+                         {'If-None-Match': '"v1"',
+                          'If-Modified-Since':
+                              'Sun, 01 Jan 2017 00:00:00 GMT'})
+        self.assertEqual(self.repo.fetched, ['packages.json'] * 2)
+        self.assertEqual(self._read('packages.json'), self.JSON_INDEX)
+
+    def test_changed_index_fetched(self):
+        cache.update(self.conf)
+        self.repo.files['packages.json'] = b'{"packages":{"nova":{}}}'
+        self.repo.etags['packages.json'] = '"v2"'
+
+        self.assertTrue(cache.update(self.conf))
+
+        self.assertEqual(self._read('packages.json'),
+                         b'{"packages":{"nova":{}}}')
+        self.assertEqual(self._validators('packages.json')['etag'], '"v2"')
+
+    def test_validators_need_cached_index(self):
+        cache.update(self.conf)
+        os.unlink(os.path.join(self.cache_dir, 'packages.json'))
+
+        self.assertTrue(cache.update(self.conf))
+
+        self.assertEqual(self.repo.requests[1], {})
+        self.assertEqual(self._read('packages.json'), self.JSON_INDEX)
+
+    def test_falls_back_to_yaml(self):
+        cache.update(self.conf)
+        # The repo only publishes the YAML index now
+        self.repo.files = {'packages': self.YAML_INDEX}
+
+        self.assertTrue(cache.update(self.conf))
+
+        self.assertEqual(self.repo.fetched[1:], ['packages.json', 'packages'])
+        self.assertEqual(self._read('packages'), self.YAML_INDEX)
+        # The JSON copy we had would be preferred, so it's gone
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['packages'])
+        self.assertFalse(cache.update(self.conf))
+
+    def test_no_index(self):
+        self.repo.files = {}
+
+        e = self.assertRaises(InstallerError, cache.update, self.conf)
+
+        self.assertIn('packages', str(e))
+        self.assertIn('404', str(e))
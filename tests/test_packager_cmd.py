@@ -0,0 +1,214 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os.path
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from ardana_packager import config
+from ardana_packager.error import InstallerError
+from ardana_packager.version import from_str
+from oslotest import base
+
+try:
+    from ardana_packager import cmd
+except SyntaxError:
+    # ardana_packager.ansible only compiles on python 2
+    cmd = None
+
+
+class FakeModule(object):
+
+    def __init__(self):
+        self.failed = None
+        self.exited = None
+
+    def fail_json(self, **kwargs):
+        self.failed = kwargs
+
+    def exit_json(self, **kwargs):
+        self.exited = kwargs
+
+
+class CmdTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(CmdTestCase, self).setUp()
+        if cmd is None:
+            self.skipTest("cmd needs python 2")
+
+
+class TestPackageSpecs(CmdTestCase):
+
+    def test_names(self):
+        (nova, swift) = cmd.package_specs(['nova', 'swift'])
+
+        self.assertEqual(nova.package, 'nova')
+        self.assertIs(nova.version, config.VERSION_LATEST)
+        self.assertFalse(hasattr(nova, 'suffix'))
+        self.assertFalse(hasattr(nova, 'service'))
+        self.assertEqual(swift.package, 'swift')
+
+    def test_dicts(self):
+        (nova, swift) = cmd.package_specs([
+            {'name': 'nova', 'service': 'nova-api',
+             'version': '4.0.1:20170201T000000Z'},
+            {'name': 'swift', 'suffix': '20170101T000000Z'}])
+
+        self.assertEqual(nova.service, 'nova-api')
+        self.assertEqual(nova.version, from_str('4.0.1:20170201T000000Z'))
+        self.assertIs(swift.version, config.VERSION_LATEST)
+        self.assertEqual(swift.suffix, '20170101T000000Z')
+
+    def test_version_dict(self):
+        version = {'v': 1, 'version': '4.0.1:20170201T000000Z',
+                   'suffix': '20170201T000000Z'}
+
+        (nova,) = cmd.package_specs([{'name': 'nova', 'version': version}])
+
+        self.assertEqual(nova.version, from_str('4.0.1:20170201T000000Z'))
+        self.assertEqual(nova.suffix, '20170201T000000Z')
+
+    def test_suffix_overrides_version_dict(self):
+        version = {'v': 1, 'version': '4.0.1:20170201T000000Z',
+                   'suffix': '20170201T000000Z'}
+
+        (nova,) = cmd.package_specs([{'name': 'nova', 'version': version,
+                                      'suffix': '20170301T000000Z'}])
+
+        self.assertEqual(nova.version, from_str('4.0.1:20170201T000000Z'))
+        self.assertEqual(nova.suffix, '20170301T000000Z')
+
+    def test_none(self):
+        self.assertEqual(cmd.package_specs(None), [])
+
+    def test_split_version(self):
+        self.assertEqual(cmd._split_version('4.0.1', None), ('4.0.1', None))
+        self.assertEqual(cmd._split_version('4.0.1', 'x'), ('4.0.1', 'x'))
+        self.assertEqual(
+            cmd._split_version({'v': 1, 'version': None, 'suffix': 'x'},
+                               None),
+            (None, 'x'))
+
+
+class TestBulk(CmdTestCase):
+
+    def setUp(self):
+        super(TestBulk, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        conf_file = os.path.join(self.dir, 'packager.conf')
+        with open(conf_file, 'w') as f:
+            f.write("[install]\ncache = {0}\n".format(self.dir))
+        self.conf = config.Config(conf_file)
+
+        self.calls = []
+        self.failing = set()
+
+        def installer(name, changed=True):
+            def run(spec, conf, *args):
+                self.calls.append((name, spec.package) + args)
+                if spec.package in self.failing:
+                    raise InstallerError(
+                        "{0} of {1} failed".format(name, spec.package))
+                spec.version = from_str('4.0.0:20170101T000000Z')
+                return (changed, spec)
+            return run
+
+        def load(dir):
+            self.calls.append(('load', dir))
+            return 'index'
+
+        def update(conf):
+            self.calls.append(('update',))
+            return True
+
+        for (name, fake) in [('install', installer('install')),
+                             ('uninstall', installer('uninstall')),
+                             ('activate_install',
+                              installer('activate', changed=False)),
+                             ('cache.update', update),
+                             ('indexer.PackageIndex.load',
+                              staticmethod(load))]:
+            self.useFixture(fixtures.MonkeyPatch(
+                'ardana_packager.cmd.' + name, fake))
+
+    def _bulk(self, state, packages, **kwargs):
+        module = FakeModule()
+        cmd.bulk(module, self.conf, state, cmd.package_specs(packages),
+                 **kwargs)
+        return module
+
+    def test_installs_each(self):
+        module = self._bulk('present',
+                            ['nova', {'name': 'swift',
+                                      'service': 'swift-proxy'}],
+                            cache_op='update')
+
+        self.assertIsNone(module.failed)
+        # The cache is updated and its index loaded once, for them all
+        self.assertEqual(self.calls,
+                         [('update',),
+                          ('load', self.dir),
+                          ('install', 'nova', 'index'),
+                          ('install', 'swift', 'index'),
+                          ('activate', 'swift')])
+        self.assertEqual(module.exited['packages'],
+                         [{'name': 'nova', 'service': None,
+                           'package_version': '4.0.0:20170101T000000Z',
+                           'suffix': None, 'changed': True},
+                          {'name': 'swift', 'service': 'swift-proxy',
+                           'package_version': '4.0.0:20170101T000000Z',
+                           'suffix': None, 'changed': True}])
+        self.assertTrue(module.exited['changed'])
+
+    def test_stops_at_first_failure(self):
+        self.failing.add('swift')
+
+        module = self._bulk('present', ['nova', 'swift', 'glance'])
+
+        self.assertIsNone(module.exited)
+        self.assertEqual(module.failed['msg'], "Installation failed")
+        self.assertEqual(module.failed['name'], 'swift')
+        self.assertIn('install of swift failed', module.failed['exception'])
+        # What was done before the failure is reported
+        self.assertEqual([p['name'] for p in module.failed['packages']],
+                         ['nova'])
+        self.assertNotIn(('install', 'glance', 'index'), self.calls)
+
+    def test_activation_failure(self):
+        self.failing.add('nova')
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cmd.install',
+            lambda spec, conf, index: (True, spec)))
+
+        module = self._bulk('present',
+                            [{'name': 'nova', 'service': 'nova-api'}])
+
+        self.assertEqual(module.failed['msg'], "Activation failed")
+        self.assertEqual(module.failed['service'], 'nova-api')
+        self.assertEqual(module.failed['packages'], [])
+
+    def test_uninstalls_each(self):
+        module = self._bulk('absent', ['nova', 'swift'])
+
+        self.assertIsNone(module.failed)
+        # No index is needed to remove packages
+        self.assertEqual(self.calls, [('uninstall', 'nova'),
+                                      ('uninstall', 'swift')])
+        self.assertEqual([p['name'] for p in module.exited['packages']],
+                         ['nova', 'swift'])
@@ -0,0 +1,247 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import grp
+import json
+import os
+import os.path
+import tarfile
+
+import fixtures
+
+import tests.packager_base as packager_base
+
+from ardana_packager import config
+from ardana_packager import delta
+from ardana_packager.error import InstallerError
+from ardana_packager import expand
+from ardana_packager import extract
+from ardana_packager import util
+from ardana_packager.version import from_str
+from ardana_packager.version import Spec
+from oslotest import base
+
+
+BASE = [
+    ('./bin', None),
+    ('./bin/tool', b'version one'),
+    ('./lib', None),
+    ('./lib/same.py', b'unchanged'),
+    ('./lib/old.py', b'going away'),
+    ('./lib64', (tarfile.SYMTYPE, 'lib')),
+]
+
+NEW = [
+    ('./bin', None),
+    ('./bin/tool', b'version two'),
+    ('./lib', None),
+    ('./lib/same.py', b'unchanged'),
+    ('./lib/new.py', b'arriving'),
+    ('./lib64', (tarfile.SYMTYPE, 'lib')),
+]
+
+BASE_TARBALL = 'nova-20170101T000000Z.tgz'
+NEW_TARBALL = 'nova-20170201T000000Z.tgz'
+
+
+def _tree(top):
+    """What's under top, for comparing two trees"""
+    tree = {}
+    for (dirpath, dirnames, filenames) in os.walk(top):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, top)
+            if os.path.islink(path):
+                tree[rel] = ('link', os.readlink(path))
+            elif os.path.isdir(path):
+                tree[rel] = ('dir',)
+            else:
+                with open(path, 'rb') as f:
+                    tree[rel] = ('file', f.read())
+    return tree
+
+
+class DeltaTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(DeltaTestCase, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.repo = os.path.join(self.dir, 'repo')
+        os.mkdir(self.repo)
+        self.base = packager_base.write_tarball(
+            os.path.join(self.repo, BASE_TARBALL), BASE,
+            version='4.0.0', timestamp='20170101T000000Z')
+        self.new = packager_base.write_tarball(
+            os.path.join(self.repo, NEW_TARBALL), NEW,
+            version='4.0.1', timestamp='20170201T000000Z')
+        self.delta = os.path.join(self.repo, delta.delta_name(self.new))
+        delta.create(self.base, self.new, self.delta)
+
+    def _extract(self, tarball, name):
+        target = os.path.join(self.dir, name)
+        os.mkdir(target)
+        extract.extract(tarball, target)
+        return target
+
+
+class TestDelta(DeltaTestCase):
+
+    def test_metadata(self):
+        metadata = delta.read_metadata(self.delta)
+        self.assertEqual(metadata['base'], '4.0.0:20170101T000000Z')
+        self.assertEqual(metadata['base_suffix'], '20170101T000000Z')
+        self.assertEqual(metadata['removed'], ['./lib/old.py'])
+
+    def test_round_trip(self):
+        base_dir = self._extract(self.base, 'base')
+        expected = _tree(self._extract(self.new, 'expected'))
+        before = _tree(base_dir)
+
+        target = os.path.join(self.dir, 'target')
+        os.mkdir(target)
+        delta.apply(self.delta, base_dir, target)
+
+        self.assertEqual(_tree(target), expected)
+        self.assertEqual(_tree(base_dir), before)
+        self.assertTrue(os.path.samefile(
+            os.path.join(target, 'lib', 'same.py'),
+            os.path.join(base_dir, 'lib', 'same.py')))
+        self.assertFalse(os.path.samefile(
+            os.path.join(target, 'bin', 'tool'),
+            os.path.join(base_dir, 'bin', 'tool')))
+
+    def test_hard_link_follows_changed_target(self):
+        base = packager_base.write_tarball(
+            os.path.join(self.repo, 'tool-20170101T000000Z.tgz'),
+            [('./bin', None),
+             ('./bin/a', b'old'),
+             ('./bin/b', (tarfile.LNKTYPE, './bin/a'))],
+            version='1.0.0', timestamp='20170101T000000Z')
+        new = packager_base.write_tarball(
+            os.path.join(self.repo, 'tool-20170201T000000Z.tgz'),
+            [('./bin', None),
+             ('./bin/a', b'new'),
+             ('./bin/b', (tarfile.LNKTYPE, './bin/a'))],
+            version='1.0.1', timestamp='20170201T000000Z')
+        delta_tarball = os.path.join(self.repo, delta.delta_name(new))
+        delta.create(base, new, delta_tarball)
+
+        base_dir = self._extract(base, 'base')
+        target = os.path.join(self.dir, 'target')
+        os.mkdir(target)
+        delta.apply(delta_tarball, base_dir, target)
+
+        self.assertEqual(_tree(target), _tree(self._extract(new, 'full')))
+        self.assertTrue(os.path.samefile(os.path.join(target, 'bin', 'a'),
+                                         os.path.join(target, 'bin', 'b')))
+        with open(os.path.join(base_dir, 'bin', 'b'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+
+    def test_extra_mode_bits_reach_cloned_files(self):
+        base_dir = self._extract(self.base, 'base')
+        target = os.path.join(self.dir, 'target')
+        os.mkdir(target)
+        delta.apply(self.delta, base_dir, target, extra_mode_bits=0o020)
+
+        for name in ('lib/same.py', 'lib/new.py', 'lib'):
+            mode = os.stat(os.path.join(target, name)).st_mode
+            self.assertTrue(mode & 0o020, name)
+
+    def test_not_a_delta(self):
+        target = os.path.join(self.dir, 'target')
+        os.mkdir(target)
+        self.assertRaises(InstallerError, delta.apply,
+                          self.new, self.dir, target)
+
+
+class TestExplodeWithDelta(DeltaTestCase):
+
+    def setUp(self):
+        super(TestExplodeWithDelta, self).setUp()
+        self.venv_dir = os.path.join(self.dir, 'venv')
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        os.mkdir(self.venv_dir)
+        os.mkdir(self.cache_dir)
+
+        conf_file = os.path.join(self.dir, 'packager.conf')
+        with open(conf_file, 'w') as f:
+            f.write("[repo]\nurl = http://repo.invalid/\n"
+                    "[install]\ndir = {venv}\ncache = {cache}\n"
+                    .format(venv=self.venv_dir, cache=self.cache_dir))
+        self.conf = config.Config(
+            conf_file, group_name=grp.getgrgid(os.getgid()).gr_name,
+            extra_mode_bits=0)
+
+        delta_name = os.path.basename(self.delta)
+        index = {'packages': {'nova': {
+            '4.0.0:20170101T000000Z': {
+                'file': BASE_TARBALL, 'suffix': '20170101T000000Z',
+                'sha256': util.checksum(self.base)},
+            '4.0.1:20170201T000000Z': {
+                'file': NEW_TARBALL, 'suffix': '20170201T000000Z',
+                'sha256': util.checksum(self.new),
+                'deltas': [{'file': delta_name,
+                            'base': '4.0.0:20170101T000000Z',
+                            'base_suffix': '20170101T000000Z',
+                            'sha256': util.checksum(self.delta)}]},
+        }}}
+        with open(os.path.join(self.cache_dir, 'packages.json'), 'w') as f:
+            json.dump(index, f)
+
+        self.base_dir = os.path.join(self.venv_dir,
+                                     'nova-20170101T000000Z')
+        os.mkdir(self.base_dir)
+        extract.extract(self.base, self.base_dir)
+        self.target = os.path.join(self.venv_dir, 'nova-20170201T000000Z')
+        self.expected = _tree(self._extract(self.new, 'expected'))
+
+    def _cache(self, file):
+        os.link(os.path.join(self.repo, file),
+                os.path.join(self.cache_dir, file))
+
+    def _explode(self):
+        spec = Spec(package='nova',
+                    version=from_str('4.0.1:20170201T000000Z'))
+        return expand.explode(self.conf, spec)
+
+    def test_built_from_delta(self):
+        self._cache(os.path.basename(self.delta))
+        (changed, spec) = self._explode()
+
+        self.assertTrue(changed)
+        self.assertEqual(_tree(self.target), self.expected)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.target, 'lib', 'same.py'),
+            os.path.join(self.base_dir, 'lib', 'same.py')))
+
+    def test_bad_delta_falls_back_and_says_why(self):
+        self._cache(NEW_TARBALL)
+        logger = self.useFixture(fixtures.FakeLogger(name=expand.__name__))
+
+        def download(config, url, target, sha256=None):
+            raise InstallerError("{url} failed verification".format(url=url))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.cache._download', download))
+
+        (changed, spec) = self._explode()
+
+        self.assertTrue(changed)
+        self.assertEqual(_tree(self.target), self.expected)
+        self.assertFalse(os.path.samefile(
+            os.path.join(self.target, 'lib', 'same.py'),
+            os.path.join(self.base_dir, 'lib', 'same.py')))
+        self.assertIn(os.path.basename(self.delta), logger.output)
+        self.assertIn('failed verification', logger.output)
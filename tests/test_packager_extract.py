@@ -0,0 +1,131 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+import tarfile
+
+import fixtures
+
+import tests.packager_base as packager_base
+
+from ardana_packager.error import InstallerError
+from ardana_packager import extract
+from oslotest import base
+
+
+class TestExtract(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestExtract, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        # nova-X2 is a sibling whose name starts with the target's
+        self.target = os.path.join(self.dir, 'nova-X')
+        self.sibling = os.path.join(self.dir, 'nova-X2')
+        os.mkdir(self.target)
+        os.mkdir(self.sibling)
+
+    def _tarball(self, members):
+        return packager_base.write_tarball(
+            os.path.join(self.dir, 'test.tgz'), members)
+
+    def _assert_refused(self, members):
+        tarball = self._tarball(members)
+        self.assertRaises(InstallerError,
+                          extract.extract, tarball, self.target)
+        self.assertEqual(os.listdir(self.sibling), [])
+
+    def test_extracts(self):
+        tarball = self._tarball([
+            ('./lib', None),
+            ('./lib/a.py', b'a'),
+            ('./lib64', (tarfile.SYMTYPE, 'lib')),
+            ('./lib/b.py', (tarfile.LNKTYPE, './lib/a.py')),
+        ])
+        extract.extract(tarball, self.target, extra_mode_bits=0o020)
+
+        with open(os.path.join(self.target, 'lib64', 'a.py'), 'rb') as f:
+            self.assertEqual(f.read(), b'a')
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.target, 'lib', 'a.py'),
+            os.path.join(self.target, 'lib', 'b.py')))
+        mode = os.stat(os.path.join(self.target, 'lib', 'a.py')).st_mode
+        self.assertTrue(mode & 0o020)
+
+    def test_dot_dot_refused(self):
+        self._assert_refused([('./../escaped', b'x')])
+
+    def test_dot_dot_into_sibling_refused(self):
+        self._assert_refused([('../nova-X2/escaped', b'x')])
+
+    def test_absolute_path_refused(self):
+        self._assert_refused([
+            (os.path.join(self.sibling, 'escaped'), b'x')])
+
+    def test_write_through_symlink_refused(self):
+        self._assert_refused([
+            ('./out', (tarfile.SYMTYPE, self.sibling)),
+            ('./out/escaped', b'x'),
+        ])
+
+    def test_write_through_relative_symlink_refused(self):
+        self._assert_refused([
+            ('./out', (tarfile.SYMTYPE, '../nova-X2')),
+            ('./out/escaped', b'x'),
+        ])
+
+    def test_hard_link_outside_refused(self):
+        outside = os.path.join(self.sibling, 'secret')
+        with open(outside, 'w') as f:
+            f.write('secret')
+        tarball = self._tarball([
+            ('./leak', (tarfile.LNKTYPE, '../nova-X2/secret'))])
+        self.assertRaises(InstallerError,
+                          extract.extract, tarball, self.target)
+        self.assertFalse(os.path.lexists(os.path.join(self.target, 'leak')))
+
+    def test_hard_link_absolute_refused(self):
+        outside = os.path.join(self.sibling, 'secret')
+        with open(outside, 'w') as f:
+            f.write('secret')
+        tarball = self._tarball([('./leak', (tarfile.LNKTYPE, outside))])
+        self.assertRaises(InstallerError,
+                          extract.extract, tarball, self.target)
+        self.assertFalse(os.path.lexists(os.path.join(self.target, 'leak')))
+
+    def test_hard_link_through_symlink_refused(self):
+        outside = os.path.join(self.sibling, 'secret')
+        with open(outside, 'w') as f:
+            f.write('secret')
+        os.chmod(outside, 0o600)
+        tarball = self._tarball([
+            ('./out', (tarfile.SYMTYPE, self.sibling)),
+            ('./leak', (tarfile.LNKTYPE, './out/secret'))])
+        self.assertRaises(InstallerError,
+                          extract.extract, tarball, self.target)
+        self.assertFalse(os.path.lexists(os.path.join(self.target, 'leak')))
+        self.assertEqual(os.stat(outside).st_mode & 0o777, 0o600)
+
+    def test_hard_link_to_symlink_refused(self):
+        outside = os.path.join(self.sibling, 'secret')
+        with open(outside, 'w') as f:
+            f.write('secret')
+        tarball = self._tarball([
+            ('./out', (tarfile.SYMTYPE, outside)),
+            ('./leak', (tarfile.LNKTYPE, './out'))])
+        self.assertRaises(InstallerError,
+                          extract.extract, tarball, self.target)
+        self.assertFalse(os.path.lexists(os.path.join(self.target, 'leak')))
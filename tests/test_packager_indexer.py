@@ -0,0 +1,195 @@
+#
+# (c) Copyright 2017 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+
+import fixtures
+import yaml
+
+import tests.packager_base as packager_base
+
+from ardana_packager import config
+from ardana_packager import indexer
+from ardana_packager.version import from_str
+from oslotest import base
+
+
+PACKAGES = {
+    'nova': {
+        '4.0.1:20170201T000000Z': {'file': 'nova-20170201T000000Z.tgz',
+                                   'suffix': '20170201T000000Z'},
+        '4.0.0:20170101T000000Z': {'file': 'nova-20170101T000000Z.tgz',
+                                   'suffix': '20170101T000000Z'},
+        '4.0.2:20170301T000000Z': {'file': 'nova-20170301T000000Z.tgz',
+                                   'suffix': '20170301T000000Z'},
+    },
+}
+
+
+class TestPackageIndex(base.BaseTestCase):
+
+    def test_latest_without_precomputed_data(self):
+        index = indexer.PackageIndex({'packages': PACKAGES})
+        self.assertEqual(index.latest('nova'),
+                         from_str('4.0.2:20170301T000000Z'))
+
+    def test_latest_uses_precomputed_data(self):
+        index = indexer.PackageIndex({
+            'packages': PACKAGES,
+            'latest': {'nova': '4.0.1:20170201T000000Z'},
+        })
+        self.assertEqual(index.latest('nova'),
+                         from_str('4.0.1:20170201T000000Z'))
+
+    def test_versions_sorted(self):
+        index = indexer.PackageIndex({'packages': PACKAGES})
+        self.assertEqual([str(v) for v in index.versions('nova')],
+                         ['4.0.0:20170101T000000Z',
+                          '4.0.1:20170201T000000Z',
+                          '4.0.2:20170301T000000Z'])
+
+    def test_range(self):
+        index = indexer.PackageIndex({'packages': PACKAGES})
+        self.assertEqual(
+            index.range('nova', lower=from_str('4.0.1:20170201T000000Z')),
+            [from_str('4.0.1:20170201T000000Z'),
+             from_str('4.0.2:20170301T000000Z')])
+        self.assertEqual(
+            index.range('nova', upper=from_str('4.0.1:20170101T000000Z')),
+            [from_str('4.0.0:20170101T000000Z')])
+
+    def test_entry(self):
+        index = indexer.PackageIndex({'packages': PACKAGES})
+        entry = index.entry('nova', from_str('4.0.0:20170101T000000Z'))
+        self.assertEqual(entry['file'], 'nova-20170101T000000Z.tgz')
+        self.assertIsNone(index.entry('nova', from_str('5.0.0:x')))
+        self.assertIsNone(index.entry('glance', from_str('5.0.0:x')))
+
+
+class TestCreateIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestCreateIndex, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        for (i, suffix) in enumerate(['20170101T000000Z',
+                                      '20170201T000000Z']):
+            self._tarball('nova', suffix, '4.0.{0}'.format(i))
+        self._tarball('glance', '20170101T000000Z', '5.0.0')
+
+        self.examined = []
+        examine = indexer._examine
+
+        def counting(path):
+            self.examined.append(os.path.basename(path))
+            return examine(path)
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.indexer._examine', counting))
+
+    def _tarball(self, package, suffix, version):
+        path = os.path.join(self.dir,
+                            '{0}-{1}.tgz'.format(package, suffix))
+        return packager_base.write_tarball(
+            path, [('./bin', None)], version=version, timestamp=suffix)
+
+    def _index(self):
+        del self.examined[:]
+        index = indexer.create_index(self.dir, jobs=1)
+        # What's on disk is what we were given, as plain YAML
+        with open(os.path.join(self.dir, config.PACKAGE_FILE)) as f:
+            data = f.read()
+        self.assertNotIn('!!python', data)
+        self.assertEqual(yaml.safe_load(data), index)
+        return index
+
+    def _files(self, index):
+        return sorted(entry['file']
+                      for versions in index['packages'].values()
+                      for entry in versions.values())
+
+    def test_unchanged_not_reexamined(self):
+        first = self._index()
+        self.assertEqual(sorted(self.examined),
+                         ['glance-20170101T000000Z.tgz',
+                          'nova-20170101T000000Z.tgz',
+                          'nova-20170201T000000Z.tgz'])
+
+        second = self._index()
+
+        self.assertEqual(self.examined, [])
+        self.assertEqual(second, first)
+
+    def test_changed_reexamined(self):
+        self._index()
+        # Rewritten, so a new size...
+        self._tarball('nova', '20170201T000000Z', '4.0.10')
+        # ... or just touched
+        path = os.path.join(self.dir, 'glance-20170101T000000Z.tgz')
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+        index = self._index()
+
+        self.assertEqual(sorted(self.examined),
+                         ['glance-20170101T000000Z.tgz',
+                          'nova-20170201T000000Z.tgz'])
+        self.assertEqual(index['latest']['nova'], '4.0.10:20170201T000000Z')
+        self.assertEqual(index['versions']['nova'],
+                         ['4.0.0:20170101T000000Z',
+                          '4.0.10:20170201T000000Z'])
+
+    def test_removed_dropped(self):
+        self._index()
+        os.unlink(os.path.join(self.dir, 'nova-20170201T000000Z.tgz'))
+
+        index = self._index()
+
+        self.assertEqual(self.examined, [])
+        self.assertEqual(self._files(index),
+                         ['glance-20170101T000000Z.tgz',
+                          'nova-20170101T000000Z.tgz'])
+        self.assertEqual(index['latest']['nova'], '4.0.0:20170101T000000Z')
+        self.assertNotIn('nova-20170201T000000Z.tgz',
+                         indexer.load_stat_cache(self.dir))
+
+    def test_corrupt_stat_cache(self):
+        first = self._index()
+        stat_file = os.path.join(self.dir, config.STAT_CACHE_FILE)
+        with open(stat_file, 'w') as f:
+            f.write('{"nova-20170101T000000Z.tgz": ')
+        # Without an index to fall back on, everything is looked at again
+        os.unlink(os.path.join(self.dir, config.PACKAGE_FILE))
+        os.unlink(os.path.join(self.dir, config.PACKAGE_JSON_FILE))
+
+        index = self._index()
+
+        self.assertEqual(len(self.examined), 3)
+        self.assertEqual(index, first)
+        self.assertEqual(sorted(indexer.load_stat_cache(self.dir)),
+                         self._files(index))
+
+    def test_corrupt_stat_cache_trusts_index(self):
+        first = self._index()
+        with open(os.path.join(self.dir, config.STAT_CACHE_FILE), 'w') as f:
+            f.write('not json')
+
+        index = self._index()
+
+        self.assertEqual(self.examined, [])
+        self.assertEqual(index, first)
+        # ... and the stat cache is good again
+        self._index()
+        self.assertEqual(self.examined, [])
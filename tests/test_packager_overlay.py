@@ -0,0 +1,161 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import io
+import os
+import os.path
+import tarfile
+
+import fixtures
+
+import tests.packager_base as packager_base
+
+from ardana_packager import overlay
+from ardana_packager import util
+from oslotest import base
+
+
+SITE = './lib/python2.7/site-packages'
+
+SRC = [
+    ('./bin', None),
+    ('./bin/activate', b'VIRTUAL_ENV="/opt/stack/venv/nova-1"\n'),
+    ('./bin/nova', b'#!/opt/stack/venv/nova-1/bin/python\nimport nova\n'),
+    ('./lib', None),
+    ('./lib/python2.7', None),
+    (SITE, None),
+    (SITE + '/foo', None),
+    # Bytecode that comes before its source is held back
+    (SITE + '/foo/__init__.pyc', b'old foo bytecode'),
+    (SITE + '/foo/__init__.py', b'old foo'),
+    (SITE + '/foo/gone.py', b'dropped in foo 2.0'),
+    (SITE + '/foo-1.0.dist-info', None),
+    (SITE + '/foo-1.0.dist-info/RECORD',
+     b'foo/__init__.py,,\nfoo/gone.py,,\nfoo-1.0.dist-info/RECORD,,\n'),
+    (SITE + '/bar.py', b'bar'),
+    (SITE + '/bar.pyc', b'bar bytecode'),
+    (SITE + '/untouched.py', b'untouched'),
+    ('./lib64', (tarfile.SYMTYPE, 'lib')),
+]
+
+SCRATCH = {
+    'lib/python2.7/site-packages/foo/__init__.py': b'new foo, longer',
+    'lib/python2.7/site-packages/foo-2.0.dist-info/RECORD':
+        b'foo/__init__.py,,\nfoo-2.0.dist-info/RECORD,,\n',
+    'lib/python2.7/site-packages/bar.py': b'bar',
+    # Installed through the lib64 symlink
+    'lib64/python2.7/site-packages/baz.py': b'baz',
+}
+
+
+class TestOverlay(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOverlay, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.src = packager_base.write_tarball(
+            os.path.join(self.dir, 'nova-20170101T000000Z.tgz'), SRC,
+            version='4.0.0', timestamp='20170101T000000Z')
+        self.scratch = os.path.join(self.dir, 'scratch')
+        for (name, data) in SCRATCH.items():
+            path = os.path.join(self.scratch, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def _overlay(self, rewrite=None):
+        base = overlay.Overlay(self.src)
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w') as tarball:
+            result = base.write(tarball, self.scratch, rewrite)
+        out.seek(0)
+        contents = {}
+        with tarfile.open(fileobj=out, mode='r') as tar:
+            for member in tar:
+                name = util.member_name(member.name)
+                self.assertNotIn(name, contents)
+                if member.isreg():
+                    contents[name] = tar.extractfile(member).read()
+                else:
+                    contents[name] = None
+        return (result, contents)
+
+    def test_metadata(self):
+        base = overlay.Overlay(self.src)
+        self.assertEqual(base.python_version, '2.7')
+        self.assertIn(b'version: 4.0.0', base.metadata)
+        self.assertEqual(base.activate, SRC[1][1])
+
+    def test_patched(self):
+        (result, contents) = self._overlay()
+
+        self.assertEqual(result['changed'], [SITE + '/foo/__init__.py'])
+        self.assertEqual(result['added'],
+                         [SITE + '/baz.py',
+                          SITE + '/foo-2.0.dist-info',
+                          SITE + '/foo-2.0.dist-info/RECORD'])
+        self.assertEqual(result['removed'],
+                         [SITE + '/foo-1.0.dist-info',
+                          SITE + '/foo-1.0.dist-info/RECORD',
+                          SITE + '/foo/__init__.pyc',
+                          SITE + '/foo/gone.py'])
+
+        self.assertEqual(contents[SITE + '/foo/__init__.py'],
+                         b'new foo, longer')
+        self.assertEqual(contents[SITE + '/baz.py'], b'baz')
+        for name in result['removed']:
+            self.assertNotIn(name, contents)
+        # Unchanged source, so its bytecode still holds
+        self.assertEqual(contents[SITE + '/bar.py'], b'bar')
+        self.assertEqual(contents[SITE + '/bar.pyc'], b'bar bytecode')
+        # Everything else is as it was
+        for (name, data) in SRC:
+            if name not in result['removed'] and \
+               name not in result['changed'] and \
+               isinstance(data, bytes):
+                self.assertEqual(contents[name], data, name)
+        self.assertIsNone(contents['./lib64'])
+        self.assertIn('./META-INF/version.yml', contents)
+
+    def test_rewrite(self):
+        def rewrite(name):
+            if name == './bin/nova':
+                return lambda data: data.replace(b'nova-1', b'nova-2')
+            return None
+
+        (result, contents) = self._overlay(rewrite)
+
+        self.assertEqual(contents['./bin/nova'],
+                         b'#!/opt/stack/venv/nova-2/bin/python\nimport nova\n')
+        self.assertEqual(contents['./bin/activate'], SRC[1][1])
+
+    def test_only_candidates_checksummed(self):
+        checksummed = []
+        checksum = util.checksum
+
+        def counting(path):
+            checksummed.append(os.path.relpath(path, self.scratch))
+            return checksum(path)
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.util.checksum', counting))
+
+        self._overlay()
+
+        # foo/__init__.py changed size, and nothing else was installed
+        # over an existing file, so only bar.py needed its checksum
+        self.assertEqual(checksummed,
+                         ['lib/python2.7/site-packages/bar.py'])
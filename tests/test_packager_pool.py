@@ -0,0 +1,92 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import io
+import os
+import os.path
+import shutil
+import time
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from ardana_packager import pool
+from oslotest import base
+
+
+class TestPool(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPool, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.pool_dir = os.path.join(self.dir, '.pool')
+        pool.create(self.pool_dir)
+
+    def _venv(self, name, files):
+        venv = os.path.join(self.dir, name)
+        os.mkdir(venv)
+        for (file, data) in files.items():
+            path = pool.add(self.pool_dir, io.BytesIO(data), 0o644)
+            pool.link(path, os.path.join(venv, file))
+        return venv
+
+    def _pool_files(self):
+        return sorted(name
+                      for (dirpath, dirnames, filenames)
+                      in os.walk(self.pool_dir)
+                      for name in filenames)
+
+    def test_identical_files_stored_once(self):
+        self._venv('nova-1', {'a': b'shared', 'b': b'shared'})
+        self._venv('nova-2', {'a': b'shared'})
+        self.assertEqual(len(self._pool_files()), 1)
+
+    def test_prune_removes_only_what_removed_venv_used(self):
+        old = self._venv('nova-1', {'a': b'shared', 'b': b'old only',
+                                    'c': b'old only'})
+        self._venv('nova-2', {'a': b'shared', 'b': b'new only'})
+        self.assertEqual(len(self._pool_files()), 3)
+
+        used = pool.used(self.pool_dir, [old])
+        self.assertEqual(len(used), 1)
+        shutil.rmtree(old)
+        self.assertEqual(pool.prune(self.pool_dir, used), 1)
+
+        self.assertEqual(len(self._pool_files()), 2)
+        with open(os.path.join(self.dir, 'nova-2', 'a'), 'rb') as f:
+            self.assertEqual(f.read(), b'shared')
+
+    def test_files_shared_only_by_removed_venvs(self):
+        first = self._venv('nova-1', {'a': b'shared'})
+        second = self._venv('nova-2', {'a': b'shared'})
+
+        used = pool.used(self.pool_dir, [first, second])
+        self.assertEqual(len(used), 1)
+        self.assertEqual(pool.used(self.pool_dir, [first]), [])
+
+    def test_stale_temporary_files_swept(self):
+        stale = os.path.join(self.pool_dir, '.tmp-stale')
+        fresh = os.path.join(self.pool_dir, '.tmp-fresh')
+        for path in (stale, fresh):
+            with open(path, 'w') as f:
+                f.write('partial')
+        old = time.time() - 2 * pool._TMP_AGE
+        os.utime(stale, (old, old))
+
+        self.assertEqual(pool.prune(self.pool_dir, []), 1)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
@@ -0,0 +1,211 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import io
+import os
+import os.path
+import time
+
+import fixtures
+
+import tests.packager_base as packager_base
+
+from ardana_packager import config
+from ardana_packager import pool
+from ardana_packager import prune
+from ardana_packager import scan
+from oslotest import base
+
+
+SUFFIXES = ['20170101T000000Z', '20170201T000000Z',
+            '20170301T000000Z', '20170401T000000Z']
+
+
+class TestPrune(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPrune, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.venv_dir = os.path.join(self.dir, 'venv')
+        self.service_dir = os.path.join(self.dir, 'service')
+        os.mkdir(self.venv_dir)
+        os.mkdir(self.service_dir)
+        self.addCleanup(scan.invalidate)
+
+        self.conf_file = os.path.join(self.dir, 'packager.conf')
+        self._configure()
+
+        # Every version of nova, each with a nova-api service directory
+        self.venvs = {}
+        for (i, suffix) in enumerate(SUFFIXES):
+            self.venvs[suffix] = self._venv('nova', suffix,
+                                            '4.0.{0}'.format(i))
+            self._service('nova-api', suffix, self.venvs[suffix])
+
+    def _configure(self, extra=""):
+        with open(self.conf_file, 'w') as f:
+            f.write("[install]\ndir = {venv}\n{extra}"
+                    "[components]\ndir = {service}\n"
+                    .format(venv=self.venv_dir, service=self.service_dir,
+                            extra=extra))
+        self.conf = config.Config(self.conf_file)
+
+    def _venv(self, package, suffix, version):
+        venv = os.path.join(self.venv_dir, package + '-' + suffix)
+        os.makedirs(os.path.join(venv, 'META-INF'))
+        with open(os.path.join(venv, 'META-INF', 'version.yml'), 'w') as f:
+            f.write(packager_base.VERSION_YML.format(version=version,
+                                                     timestamp=suffix))
+        return venv
+
+    def _service(self, service, suffix, venv):
+        target = os.path.join(self.service_dir, service + '-' + suffix)
+        os.mkdir(target)
+        os.symlink(venv, os.path.join(target, 'venv'))
+
+    def _activate(self, service, suffix):
+        os.symlink(service + '-' + suffix,
+                   os.path.join(self.service_dir, service))
+
+    def _services(self):
+        return sorted(os.listdir(self.service_dir))
+
+    def _venvs(self):
+        return sorted(os.listdir(self.venv_dir))
+
+    def test_keeps_active_and_newest(self):
+        self._activate('nova-api', SUFFIXES[0])
+
+        pruned = prune.prune(self.conf, keep=2)
+
+        self.assertEqual(pruned['services'],
+                         ['nova-api-' + s for s in SUFFIXES[1:3]])
+        self.assertEqual(self._services(),
+                         ['nova-api',
+                          'nova-api-' + SUFFIXES[0],
+                          'nova-api-' + SUFFIXES[3]])
+        self.assertEqual(
+            os.readlink(os.path.join(self.service_dir, 'nova-api')),
+            'nova-api-' + SUFFIXES[0])
+        # The active version's venv is the oldest, but it stays
+        self.assertEqual(pruned['venvs'], ['nova-' + SUFFIXES[1]])
+        self.assertIn('nova-' + SUFFIXES[0], self._venvs())
+
+    def test_keep_one_keeps_only_active(self):
+        self._activate('nova-api', SUFFIXES[1])
+
+        prune.prune(self.conf, keep=1)
+
+        self.assertEqual(self._services(),
+                         ['nova-api', 'nova-api-' + SUFFIXES[1]])
+        # The active service's venv, and the newest one
+        self.assertEqual(self._venvs(),
+                         ['nova-' + SUFFIXES[1], 'nova-' + SUFFIXES[3]])
+
+    def test_never_removes_referenced_venv(self):
+        self._activate('nova-api', SUFFIXES[3])
+        # Another service still runs from the oldest venv
+        self._service('nova-conductor', SUFFIXES[0], self.venvs[SUFFIXES[0]])
+        self._activate('nova-conductor', SUFFIXES[0])
+
+        pruned = prune.prune(self.conf, keep=1)
+
+        self.assertNotIn('nova-' + SUFFIXES[0], pruned['venvs'])
+        self.assertIn('nova-' + SUFFIXES[0], self._venvs())
+        self.assertIn('nova-conductor-' + SUFFIXES[0], self._services())
+        for suffix in SUFFIXES[:3]:
+            self.assertNotIn('nova-api-' + suffix, self._services())
+
+    def _wait_for_trash(self):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            if not prune._trash(self.service_dir) and \
+               not prune._trash(self.venv_dir):
+                return
+            time.sleep(0.05)
+
+    def _pool(self, data):
+        """Put data in each venv, from the pool; return its pool files"""
+        paths = []
+        for (suffix, venv) in sorted(self.venvs.items()):
+            path = pool.add(self.conf.POOL_LOCATION,
+                            io.BytesIO(data + suffix.encode('utf-8')), 0o644)
+            pool.link(path, os.path.join(venv, 'only'))
+            path = pool.add(self.conf.POOL_LOCATION, io.BytesIO(data),
+                            0o644)
+            pool.link(path, os.path.join(venv, 'shared'))
+            paths.append(path)
+        return paths
+
+    def _pool_files(self):
+        return sorted(os.path.join(dirpath, name)
+                      for (dirpath, dirnames, filenames)
+                      in os.walk(self.conf.POOL_LOCATION)
+                      for name in filenames)
+
+    def _assert_pool_pruned(self):
+        # Only what the remaining venvs link to is left in the pool
+        self.assertEqual(self._venvs(), ['.pool', 'nova-' + SUFFIXES[0],
+                                         'nova-' + SUFFIXES[3]])
+        linked = set(os.stat(os.path.join(self.venvs[suffix], name)).st_ino
+                     for suffix in (SUFFIXES[0], SUFFIXES[3])
+                     for name in ('only', 'shared'))
+        self.assertEqual(set(os.stat(path).st_ino
+                             for path in self._pool_files()), linked)
+        self.assertEqual(len(linked), 3)
+
+    def test_pool_pruned(self):
+        self._configure("dedup = true\n")
+        pool.create(self.conf.POOL_LOCATION)
+        self._pool(b'data')
+        self._activate('nova-api', SUFFIXES[0])
+
+        prune.prune(self.conf, keep=1)
+
+        self._assert_pool_pruned()
+
+    def test_pool_pruned_aside(self):
+        self._configure("dedup = true\n")
+        pool.create(self.conf.POOL_LOCATION)
+        self._pool(b'data')
+        self._activate('nova-api', SUFFIXES[0])
+
+        prune.prune(self.conf, keep=1, aside=True)
+
+        deadline = time.time() + 10
+        while time.time() < deadline and len(self._pool_files()) > 3:
+            time.sleep(0.05)
+        self._wait_for_trash()
+        self._assert_pool_pruned()
+
+    def test_aside(self):
+        self._activate('nova-api', SUFFIXES[0])
+
+        pruned = prune.prune(self.conf, keep=1, aside=True)
+
+        self.assertEqual(pruned['services'],
+                         ['nova-api-' + s for s in SUFFIXES[1:]])
+        # Renamed out of the way at once...
+        self.assertEqual([s for s in self._services()
+                          if not s.startswith('.')],
+                         ['nova-api', 'nova-api-' + SUFFIXES[0]])
+        self.assertIn('nova-' + SUFFIXES[0], self._venvs())
+
+        # ... and deleted in the background
+        self._wait_for_trash()
+        self.assertEqual(self._services(),
+                         ['nova-api', 'nova-api-' + SUFFIXES[0]])
+        self.assertIn('nova-' + SUFFIXES[0], self._venvs())
@@ -0,0 +1,72 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from ardana_packager import scan
+from ardana_packager.version import from_str
+from oslotest import base
+
+
+VERSION_YML = "file_format: 1\nversion: {version}\ntimestamp: {timestamp}\n"
+
+
+class TestSnapshot(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        self.venv_dir = os.path.join(self.dir, 'venv')
+        self.service_dir = os.path.join(self.dir, 'service')
+        os.mkdir(self.venv_dir)
+        os.mkdir(self.service_dir)
+        self.addCleanup(scan.invalidate)
+
+    def _service(self, service, package, suffix, version):
+        venv = os.path.join(self.venv_dir, package + '-' + suffix)
+        os.makedirs(os.path.join(venv, 'META-INF'))
+        with open(os.path.join(venv, 'META-INF', 'version.yml'), 'w') as f:
+            f.write(VERSION_YML.format(version=version, timestamp=suffix))
+        target = os.path.join(self.service_dir, service + '-' + suffix)
+        os.mkdir(target)
+        os.symlink(venv, os.path.join(target, 'venv'))
+        return venv
+
+    def test_suffix_and_referrers(self):
+        venv = self._service('nova-api', 'nova', '20170101T000000Z', '4.0.0')
+        self._service('nova-api', 'nova', '20170201T000000Z', '4.0.1')
+
+        snapshot = scan.snapshot(self.service_dir)
+        self.assertEqual(
+            snapshot.suffix('nova-api', from_str('4.0.1:20170201T000000Z')),
+            '20170201T000000Z')
+        self.assertIsNone(
+            snapshot.suffix('nova-api', from_str('4.0.2:20170301T000000Z')))
+        self.assertEqual(snapshot.referrers(venv),
+                         ['nova-api-20170101T000000Z'])
+
+    def test_reused_until_directory_changes(self):
+        self._service('nova-api', 'nova', '20170101T000000Z', '4.0.0')
+        snapshot = scan.snapshot(self.service_dir)
+        self.assertIs(scan.snapshot(self.service_dir), snapshot)
+
+        scan.invalidate(self.service_dir)
+        self.assertIsNot(scan.snapshot(self.service_dir), snapshot)
@@ -0,0 +1,192 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from oslotest import base
+
+try:
+    from ardana_packager import setup_systemd
+except SyntaxError:
+    # ardana_packager.ansible only compiles on python 2
+    setup_systemd = None
+
+
+DEFAULTS = {
+    'service': None,
+    'cmd': None,
+    'name': None,
+    'install_dir': '/opt/stack/service',
+    'install_path': None,
+    'user': 'stack',
+    'group': None,
+    'args': None,
+    'env': {},
+    'type': 'simple',
+    'restart': '',
+    'restart_sec': '',
+    'stdout': 'journal',
+    'stderr': 'inherit',
+    'enable': None,
+    'before': '',
+    'after': '',
+    'wants': '',
+    'wanted_by': '',
+    'limit_open_files': '',
+}
+
+
+class FakeModule(object):
+
+    def __init__(self):
+        self.failed = None
+        self.exited = None
+
+    def fail_json(self, **kwargs):
+        self.failed = kwargs
+
+    def exit_json(self, **kwargs):
+        self.exited = kwargs
+
+
+class TestSetupUnits(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSetupUnits, self).setUp()
+        if setup_systemd is None:
+            self.skipTest("setup_systemd needs python 2")
+        self.systemd_dir = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.setup_systemd.SYSTEMD_DIR', self.systemd_dir))
+
+        self.reloads = 0
+        self.enabled = {}
+        self.calls = []
+
+        def reload():
+            self.reloads += 1
+            return 0
+
+        def is_enabled(names):
+            return dict((name, self.enabled.get(name, False))
+                        for name in names)
+
+        def call(args, **kwargs):
+            self.calls.append(args)
+            return 0
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.setup_systemd.systemd_daemon_reload', reload))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.setup_systemd.systemd_is_enabled', is_enabled))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_packager.setup_systemd.subprocess.call', call))
+
+    def _setup(self, units, **params):
+        module = FakeModule()
+        args = dict(DEFAULTS, units=units)
+        args.update(params)
+        setup_systemd.setup_units(module, args)
+        return module
+
+    def _unit_file(self, name):
+        with open(os.path.join(self.systemd_dir, name + '.service')) as f:
+            return f.read()
+
+    def test_units_written_with_one_reload(self):
+        module = self._setup([
+            {'service': 'nova-api', 'cmd': 'nova-api'},
+            {'service': 'nova-conductor', 'cmd': 'nova-conductor',
+             'user': 'nova'},
+        ], user='stack')
+
+        self.assertIsNone(module.failed)
+        self.assertEqual(module.exited['written'],
+                         ['nova-api', 'nova-conductor'])
+        self.assertTrue(module.exited['changed'])
+        self.assertEqual(self.reloads, 1)
+        # Module args fill in what a unit leaves out
+        self.assertIn("User=stack\n", self._unit_file('nova-api'))
+        self.assertIn("User=nova\n", self._unit_file('nova-conductor'))
+        self.assertIn(
+            "ExecStart=/opt/stack/service/nova-api/venv/bin/nova-api",
+            self._unit_file('nova-api'))
+
+    def test_unchanged_units_not_reloaded(self):
+        units = [{'service': 'nova-api', 'cmd': 'nova-api'},
+                 {'service': 'nova-conductor', 'cmd': 'nova-conductor'}]
+        self._setup(units)
+
+        module = self._setup(units)
+
+        self.assertEqual(module.exited['written'], [])
+        self.assertFalse(module.exited['changed'])
+        self.assertEqual(self.reloads, 1)
+
+    def test_only_changed_units_rewritten(self):
+        self._setup([{'service': 'nova-api', 'cmd': 'nova-api'},
+                     {'service': 'nova-conductor', 'cmd': 'nova-conductor'}])
+
+        module = self._setup([
+            {'service': 'nova-api', 'cmd': 'nova-api', 'args': '--debug'},
+            {'service': 'nova-conductor', 'cmd': 'nova-conductor'}])
+
+        self.assertEqual(module.exited['written'], ['nova-api'])
+        self.assertEqual(self.reloads, 2)
+
+    def test_enable_and_disable_in_bulk(self):
+        self.enabled = {'nova-conductor': True, 'nova-scheduler': True}
+
+        module = self._setup([
+            {'service': 'nova-api', 'cmd': 'nova-api', 'enable': True},
+            {'service': 'nova-compute', 'cmd': 'nova-compute',
+             'enable': True},
+            {'service': 'nova-conductor', 'cmd': 'nova-conductor',
+             'enable': False},
+            {'service': 'nova-scheduler', 'cmd': 'nova-scheduler',
+             'enable': True},
+        ])
+
+        self.assertEqual(module.exited['enabled'],
+                         ['nova-api', 'nova-compute'])
+        self.assertEqual(module.exited['disabled'], ['nova-conductor'])
+        self.assertEqual(self.calls, [
+            [setup_systemd.SYSTEMCTL, 'enable', 'nova-api', 'nova-compute'],
+            [setup_systemd.SYSTEMCTL, 'disable', 'nova-conductor'],
+        ])
+
+    def test_unknown_arg_refused(self):
+        module = self._setup([
+            {'service': 'nova-api', 'cmd': 'nova-api'},
+            {'service': 'nova-conductor', 'cmd': 'nova-conductor',
+             'restart_secs': '5'},
+        ])
+
+        self.assertIn('restart_secs', module.failed['msg'])
+        self.assertIsNone(module.exited)
+        self.assertEqual(os.listdir(self.systemd_dir), [])
+        self.assertEqual(self.reloads, 0)
+
+    def test_unit_without_cmd_refused(self):
+        module = self._setup([{'service': 'nova-api'}])
+
+        self.assertIsNotNone(module.failed)
+        self.assertEqual(os.listdir(self.systemd_dir), [])
@@ -0,0 +1,351 @@
+#
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import os
+import os.path
+import subprocess
+import sys
+import threading
+import time
+
+import fixtures
+
+import tests.packager_base  # noqa
+
+from oslotest import base
+
+try:
+    from ardana_packager import venv_edit
+except SyntaxError:
+    # ardana_packager.ansible only compiles on python 2
+    venv_edit = None
+
+
+# Lays out a venv as current virtualenv does, enough for relocation
+FAKE_VIRTUALENV = '''#!{python}
+import os
+import sys
+
+if sys.argv[1] == '--version':
+    print("virtualenv 20.0.1 from /fake")
+    sys.exit(0)
+venv = sys.argv[1]
+prefix = os.environ.get('FAKE_VIRTUALENV_PREFIX', venv)
+for d in ('bin', 'local'):
+    if not os.path.isdir(os.path.join(venv, d)):
+        os.makedirs(os.path.join(venv, d))
+
+
+def write(name, data):
+    with open(os.path.join(venv, 'bin', name), 'w') as f:
+        f.write(data.format(prefix=prefix))
+
+
+write('activate', 'deactivate nondestructive\\n\\n'
+                  '    VIRTUAL_ENV={{prefix}}\\n    export VIRTUAL_ENV\\n')
+write('activate.csh', 'setenv VIRTUAL_ENV {{prefix}}\\n')
+write('activate.fish', 'set -gx VIRTUAL_ENV "{{prefix}}"\\n')
+write('activate.nu', 'let virtual-env = "{{prefix}}"\\n')
+write('activate.xsh', '$VIRTUAL_ENV = r"{{prefix}}"\\n')
+write('pip', '#!{{prefix}}/bin/python\\nimport pip\\n')
+with open(os.path.join(venv, 'bin', 'python'), 'wb') as f:
+    f.write(b'\\x7fELF\\x00' + prefix.encode('utf-8'))
+os.symlink(os.path.join(prefix, 'bin'), os.path.join(venv, 'local', 'bin'))
+'''
+
+
+class FakeModule(object):
+
+    def __init__(self, virtualenv_bin):
+        self.virtualenv_bin = virtualenv_bin
+        self.commands = []
+
+    def get_bin_path(self, name, required=False):
+        if name == 'virtualenv':
+            return self.virtualenv_bin
+        return sys.executable
+
+    def run_command(self, cmd):
+        self.commands.append(cmd)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        (out, err) = proc.communicate()
+        return (proc.returncode, out.decode('utf-8'), err.decode('utf-8'))
+
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs)
+
+
+class VenvEditTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(VenvEditTestCase, self).setUp()
+        if venv_edit is None:
+            self.skipTest("venv_edit needs python 2")
+        self.dir = self.useFixture(fixtures.TempDir()).path
+        virtualenv_bin = os.path.join(self.dir, 'virtualenv')
+        with open(virtualenv_bin, 'w') as f:
+            f.write(FAKE_VIRTUALENV.format(python=sys.executable))
+        os.chmod(virtualenv_bin, 0o755)
+        self.module = FakeModule(virtualenv_bin)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class TestVenvTemplate(VenvEditTestCase):
+
+    def setUp(self):
+        super(TestVenvTemplate, self).setUp()
+        self.template_cache = os.path.join(self.dir, 'venv', '.templates')
+        self.venv_dir = os.path.join(self.dir, 'venv')
+
+    def _create(self, name):
+        dest = os.path.join(self.venv_dir, name)
+        rc = venv_edit.create_venv(self.module, dest, self.template_cache)[0]
+        self.assertEqual(rc, 0)
+        return dest
+
+    def _builds(self):
+        return [cmd for cmd in self.module.commands if cmd[1] != '--version']
+
+    def _template(self):
+        (template,) = [name for name in os.listdir(self.template_cache)
+                       if not name.endswith(venv_edit._LOCK_SUFFIX)]
+        return os.path.join(self.template_cache, template)
+
+    def _assert_relocated(self, dest):
+        venv_bin = os.path.join(dest, 'bin')
+        target = dest.encode('utf-8')
+        self.assertIn(b'    VIRTUAL_ENV=' + target + b'\n',
+                      self._read(os.path.join(venv_bin, 'activate')))
+        for name in ('activate.csh', 'activate.fish', 'activate.nu',
+                     'activate.xsh'):
+            data = self._read(os.path.join(venv_bin, name))
+            self.assertIn(target, data, name)
+            self.assertNotIn(venv_edit._BUILD_SUFFIX.encode('utf-8'), data,
+                             name)
+        self.assertEqual(self._read(os.path.join(venv_bin, 'pip')),
+                         b'#!' + target + b'/bin/python\nimport pip\n')
+        self.assertEqual(os.readlink(os.path.join(dest, 'local', 'bin')),
+                         os.path.join(dest, 'bin'))
+
+    def test_template_built_once(self):
+        first = self._create('nova-1')
+        second = self._create('swift-22222')
+
+        self.assertEqual(len(self._builds()), 1)
+        built_at = self._template() + venv_edit._BUILD_SUFFIX
+        self.assertEqual(self._builds()[0][1], built_at)
+        self.assertFalse(os.path.exists(built_at))
+        self._assert_relocated(first)
+        self._assert_relocated(second)
+
+    def test_template_untouched(self):
+        self._create('nova-1')
+        template = self._template()
+        before = dict((name, self._read(os.path.join(template, 'bin', name)))
+                      for name in os.listdir(os.path.join(template, 'bin')))
+
+        dest = self._create('nova-2')
+
+        for (name, data) in before.items():
+            self.assertEqual(
+                self._read(os.path.join(template, 'bin', name)), data)
+        # Unchanged files are shared with the template
+        self.assertTrue(os.path.samefile(
+            os.path.join(template, 'bin', 'python'),
+            os.path.join(dest, 'bin', 'python')))
+        self.assertFalse(os.path.samefile(
+            os.path.join(template, 'bin', 'pip'),
+            os.path.join(dest, 'bin', 'pip')))
+
+    def test_binary_left_alone(self):
+        dest = self._create('nova-1')
+
+        self.assertIn(venv_edit._BUILD_SUFFIX.encode('utf-8'),
+                      self._read(os.path.join(dest, 'bin', 'python')))
+
+    def test_falls_back_without_prefix(self):
+        # A template that doesn't mention where it was built
+        self.useFixture(fixtures.EnvironmentVariable(
+            'FAKE_VIRTUALENV_PREFIX', '/elsewhere'))
+        self._create('nova-1')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'FAKE_VIRTUALENV_PREFIX'))
+
+        dest = self._create('nova-2')
+
+        self.assertEqual(self._builds()[-1][1], dest)
+        self._assert_relocated(dest)
+
+    def test_waits_for_concurrent_build(self):
+        key = venv_edit._template_key(self.module, self.module.virtualenv_bin)
+        template = os.path.join(self.template_cache, key)
+        os.makedirs(self.template_cache)
+        result = []
+
+        with venv_edit._locked(template + venv_edit._LOCK_SUFFIX):
+            thread = threading.Thread(target=lambda: result.append(
+                venv_edit._venv_template(self.module,
+                                         self.module.virtualenv_bin,
+                                         self.template_cache)))
+            thread.start()
+            time.sleep(0.2)
+            self.assertEqual(result, [])
+            # Somebody else finishes the build while we wait
+            os.mkdir(template)
+        thread.join()
+
+        self.assertEqual(result, [template])
+        self.assertEqual(self._builds(), [])
+
+    def test_filesystem_check_creates_nothing(self):
+        cache = os.path.join(self.dir, 'a', 'cache')
+        dest = os.path.join(self.dir, 'b', 'nova-1')
+
+        self.assertTrue(venv_edit._same_filesystem(cache, dest))
+        self.assertEqual(sorted(os.listdir(self.dir)), ['virtualenv'])
+
+
+OLD = '/opt/stack/venv/nova-1'
+NEW = '/opt/stack/venv/nova-2'
+
+# Each activation script, as the virtualenvs we've seen write it, and
+# how it reads once moved from OLD to NEW
+ACTIVATE = [
+    ('activate', 'VIRTUAL_ENV="{p}"\nexport VIRTUAL_ENV\n'),
+    ('activate', "VIRTUAL_ENV='{p}'\nexport VIRTUAL_ENV\n"),
+    ('activate', 'deactivate nondestructive\n\n'
+                 '    VIRTUAL_ENV={p}\n    export VIRTUAL_ENV\n'),
+    ('activate.csh', 'setenv VIRTUAL_ENV "{p}"\n'
+                     'setenv PATH "$VIRTUAL_ENV/bin:$PATH"\n'),
+    ('activate.csh', 'setenv VIRTUAL_ENV {p}\n'),
+    ('activate.fish', 'set -gx VIRTUAL_ENV "{p}"\n'),
+    ('activate.fish', "    set -gx VIRTUAL_ENV '{p}'\n"),
+    ('activate.nu', 'let virtual-env = "{p}"\nlet bin = "bin"\n'),
+    ('activate.nu', "    let virtual-env = '{p}'\n"),
+    ('activate.xsh', '$VIRTUAL_ENV = r"{p}"\n'),
+]
+
+
+class TestRelocate(VenvEditTestCase):
+
+    def setUp(self):
+        super(TestRelocate, self).setUp()
+        self.target = os.path.join(self.dir, 'nova-2')
+        os.makedirs(os.path.join(self.target, 'bin'))
+
+    def _write(self, name, data):
+        path = os.path.join(self.target, 'bin', name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_relocate_activate(self):
+        for (name, script) in ACTIVATE:
+            data = script.format(p=OLD).encode('utf-8')
+            expected = script.format(p=NEW).encode('utf-8')
+
+            self.assertEqual(
+                venv_edit._relocate_activate(name, data, NEW,
+                                             OLD.encode('utf-8')),
+                expected, name)
+            # Without knowing the old prefix, the setting itself is found
+            self.assertEqual(
+                venv_edit._relocate_activate(name, data, NEW)
+                .split(b'\n')[0],
+                expected.split(b'\n')[0], name)
+
+    def test_longer_path_left_alone(self):
+        data = b'VIRTUAL_ENV="' + OLD.encode('utf-8') + b'"\n' \
+               b'OTHER=' + OLD.encode('utf-8') + b'0/bin\n'
+
+        self.assertEqual(
+            venv_edit._relocate_activate('activate', data, NEW,
+                                         OLD.encode('utf-8')),
+            b'VIRTUAL_ENV="' + NEW.encode('utf-8') + b'"\n'
+            b'OTHER=' + OLD.encode('utf-8') + b'0/bin\n')
+
+    def test_virtual_env(self):
+        for (name, script) in ACTIVATE:
+            if name != 'activate':
+                continue
+            self.assertEqual(
+                venv_edit._virtual_env(script.format(p=OLD + '/')
+                                       .encode('utf-8')),
+                OLD.encode('utf-8'))
+        self.assertIsNone(venv_edit._virtual_env(b'export PATH\n'))
+        self.assertIsNone(venv_edit._virtual_env(None))
+
+    def test_relocate_script(self):
+        old = OLD.encode('utf-8')
+        new = NEW.encode('utf-8')
+        for (data, expected) in [
+                (b'#!' + old + b'/bin/python\nimport nova\n',
+                 b'#!' + new + b'/bin/python\nimport nova\n'),
+                (b'#!' + old + b'/bin/python2.7 -E\nimport nova\n',
+                 b'#!' + new + b'/bin/python2.7 -E\nimport nova\n'),
+                # Not our interpreter
+                (b'#!/usr/bin/env python\nimport nova\n', None),
+                (b'#!/usr/bin/python\nimport nova\n', None),
+                (b'#!' + old + b'0/bin/python\n', None),
+                (b'#!/bin/sh\nexec ' + old + b'/bin/python\n', None),
+                (b'\x7fELF\x00' + old, None)]:
+            self.assertEqual(
+                venv_edit._relocate_script(data, NEW, old),
+                data if expected is None else expected)
+
+    def test_relocate_script_without_prefix(self):
+        # Any python becomes ours; anything else is left alone
+        self.assertEqual(
+            venv_edit._relocate_script(
+                b'#!/usr/bin/python2.7 -E\nimport nova\n', NEW),
+            b'#!' + NEW.encode('utf-8') + b'/bin/python\nimport nova\n')
+        for data in (b'#!/bin/sh\nexit 0\n', b'\x7fELF\x00python'):
+            self.assertEqual(venv_edit._relocate_script(data, NEW), data)
+
+    def test_relocate_venv(self):
+        # The first of each script's variants
+        scripts = {}
+        for (name, script) in reversed(ACTIVATE):
+            scripts[name] = script
+        for (name, script) in scripts.items():
+            self._write(name, script.format(p=OLD).encode('utf-8'))
+        old = OLD.encode('utf-8')
+        pip = self._write('pip', b'#!' + old + b'/bin/python -E\nimport pip\n')
+        sh = self._write('run', b'#!/bin/sh\nexec ' + old + b'/bin/python\n')
+        binary = self._write('python', b'\x7fELF\x00' + old + b'\x00')
+        os.symlink('python', os.path.join(self.target, 'bin', 'python2'))
+        before = os.stat(binary)
+
+        venv_edit.relocate_venv(self.target)
+
+        target = self.target.encode('utf-8')
+        for (name, script) in scripts.items():
+            self.assertEqual(
+                self._read(os.path.join(self.target, 'bin', name)),
+                script.format(p=self.target).encode('utf-8'), name)
+        self.assertEqual(self._read(pip),
+                         b'#!' + target + b'/bin/python -E\nimport pip\n')
+        self.assertEqual(self._read(sh),
+                         b'#!/bin/sh\nexec ' + old + b'/bin/python\n')
+        # The binary isn't even rewritten in place
+        self.assertEqual(self._read(binary), b'\x7fELF\x00' + old + b'\x00')
+        self.assertEqual(os.stat(binary).st_ino, before.st_ino)
+        self.assertEqual(os.readlink(os.path.join(self.target, 'bin',
+                                                  'python2')), 'python')
@@ -0,0 +1,65 @@
+#
+# (c) Copyright 2017 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+import tests.packager_base  # noqa
+
+import pickle
+
+from ardana_packager import version
+from oslotest import base
+
+
+class TestVersion(base.BaseTestCase):
+
+    def test_from_str(self):
+        v = version.from_str('3.0.0:20160501T120000Z')
+        self.assertEqual(str(v), '3.0.0:20160501T120000Z')
+        self.assertEqual(
+            v, version.Version([[3, 0, 0], ['20160501T120000Z']]))
+
+    def test_ordering(self):
+        v1 = version.from_str('3.0.0:20160501T120000Z')
+        v2 = version.from_str('3.0.0:20160501T120000Z:1')
+        v3 = version.from_str('4.0.0:20160101T120000Z')
+        self.assertTrue(v1 < v2 < v3)
+        self.assertTrue(v3 >= v2 >= v1)
+        self.assertEqual(max([v2, v3, v1]), v3)
+
+    def test_hashable(self):
+        versions = {version.from_str('3.0.0:20160501T120000Z'),
+                    version.Version([[3, 0, 0], ['20160501T120000Z']])}
+        self.assertEqual(len(versions), 1)
+
+    def test_immutable(self):
+        v = version.from_str('3.0.0:20160501T120000Z')
+        self.assertRaises(AttributeError, setattr, v, '_parts', ())
+
+    def test_pickle(self):
+        v = version.from_str('3.0.0:20160501T120000Z')
+        self.assertEqual(pickle.loads(pickle.dumps(v)), v)
+
+    def test_not_equal_to_other_types(self):
+        v = version.from_str('3.0.0:20160501T120000Z')
+        self.assertFalse(v == None)  # noqa
+        self.assertTrue(v != None)  # noqa
+
+    def test_best_guess(self):
+        self.assertEqual(version.best_guess('20151022T080854Z'),
+                         '2.0.0:20151022T080854Z')
+        self.assertEqual(version.best_guess('20170101T000000Z'),
+                         '2.0.0:20170101T000000Z')
+        self.assertEqual(version.best_guess('4.0.0:20170101T000000Z'),
+                         '4.0.0:20170101T000000Z')